@@ -0,0 +1,113 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, HttpResponseNotAllowed
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import ParseError, PermissionDenied
+from rest_framework.parsers import JSONParser
+from rest_framework.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST
+
+from .predict_hist import predict_hist_writer
+from .views import get_predictors_or_404, get_predict_hists, get_stock_predict, get_stock_predict_batch, \
+    parse_batch_rows
+
+# Bounded worker pool of the model inference, so the event loop is never blocked by a slow predict call
+predict_executor = ThreadPoolExecutor(max_workers=settings.PREDICT_WORKERS, thread_name_prefix='predict')
+
+
+async def run_in_predict_pool(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(predict_executor, partial(func, *args))
+
+
+def check_csrf(request):
+    """
+    Check the CSRF token of a logged in session user, as the SessionAuthentication of the DRF views.
+
+    Return the error response of a failed check, or None. The check runs on the Django request, whose POST of a JSON
+    body is empty, so the body is left to the view.
+    """
+    user = getattr(request, 'user', None)
+    if not user or not user.is_active:
+        return None
+
+    try:
+        SessionAuthentication().enforce_csrf(request)
+    except PermissionDenied as e:
+        return JsonResponse({'detail': e.detail}, status=e.status_code)
+    return None
+
+
+async def stock_predict(request, stock_type, predict_type):
+    """
+    Retrieve a stock prediction with the model inference offloaded to the predict pool.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    error_response = await sync_to_async(check_csrf)(request)
+    if error_response is not None:
+        return error_response
+
+    pred_model = await sync_to_async(get_predictors_or_404)(stock_type, predict_type)
+
+    try:
+        data = JSONParser().parse(io.BytesIO(request.body))
+    except ParseError as e:
+        return JsonResponse({'detail': e.detail}, status=e.status_code)
+
+    try:
+        result = await run_in_predict_pool(get_stock_predict, pred_model[0], data)
+    except (AttributeError, TypeError, ValueError) as e:
+        return JsonResponse({'Error': f'Invalid request data: {e}'}, status=HTTP_400_BAD_REQUEST)
+
+    if result.get('Error') is not None:
+        return JsonResponse(result, status=HTTP_400_BAD_REQUEST)
+
+    await sync_to_async(predict_hist_writer.save)(get_predict_hists(pred_model[0], [data], [result]))
+
+    return JsonResponse(result, status=HTTP_201_CREATED)
+
+
+async def stock_predict_batch(request, stock_type, predict_type):
+    """
+    Retrieve the stock predictions of many rows with the model inference offloaded to the predict pool.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    error_response = await sync_to_async(check_csrf)(request)
+    if error_response is not None:
+        return error_response
+
+    pred_model = await sync_to_async(get_predictors_or_404)(stock_type, predict_type)
+
+    try:
+        rows = parse_batch_rows(request.body)
+    except ValueError as e:
+        return JsonResponse({'Error': f'Invalid batch request: {e}'}, status=HTTP_400_BAD_REQUEST)
+
+    if len(rows) > settings.PREDICT_BATCH_MAX_ROWS:
+        return JsonResponse({'Error': f'Batch request exceeds {settings.PREDICT_BATCH_MAX_ROWS} rows.'},
+                            status=HTTP_400_BAD_REQUEST)
+
+    results = await run_in_predict_pool(get_stock_predict_batch, pred_model[0], rows)
+    if isinstance(results, dict):
+        return JsonResponse(results, status=HTTP_400_BAD_REQUEST)
+
+    hists = get_predict_hists(pred_model[0], rows, results)
+    if len(hists) == 0:
+        return JsonResponse({'results': results}, status=HTTP_400_BAD_REQUEST)
+
+    await sync_to_async(predict_hist_writer.save)(hists)
+
+    return JsonResponse({'results': results}, status=HTTP_201_CREATED)
+
+
+# The same as the DRF views, the CSRF token is checked by the session authentication, for the logged in users only
+stock_predict.csrf_exempt = True
+stock_predict_batch.csrf_exempt = True
@@ -0,0 +1,177 @@
+import glob
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Staging data columns of the request features
+FEATURE_COLUMNS = {
+    'vol_moving_avg': 'vol_moving_avg',
+    'adj_close_rolling_med': 'price_rolling_med',
+    'adj_close_daily_std': 'price_daily_std',
+}
+
+
+class FeatureNotFoundException(Exception):
+    """
+    Cannot find the features of the symbol
+    """
+    pass
+
+
+class SymbolFeatures:
+    """
+    Features of one symbol sorted by date.
+    """
+    def __init__(self, signature, dates, features):
+        self.signature = signature
+        self.dates = dates
+        self.features = features
+
+    def get(self, date=None):
+        if date is None:
+            index = len(self.dates) - 1
+        else:
+            # The latest features on or before the date
+            index = np.searchsorted(self.dates, np.datetime64(date, 'D'), side='right') - 1
+
+        if index < 0:
+            return None
+
+        row = {'date': str(self.dates[index])}
+        row.update({name: self.features[name][index] for name in self.features})
+        return row
+
+
+class StageDataIndex:
+    """
+    In-memory index of one Step 2 staging parquet, partitioned by Symbol or clustered into files of the symbols.
+
+    A symbol partition, or a clustered file, is reloaded only when the modified time or size of its files changes.
+    """
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.symbols = {}
+        self.parts = {}
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_signature(part_path):
+        files = glob.glob(os.path.join(part_path, '*.parquet')) if os.path.isdir(part_path) else [part_path]
+        stats = [os.stat(i) for i in files]
+        return len(stats), max([i.st_mtime_ns for i in stats], default=0), sum(i.st_size for i in stats)
+
+    def get_parts(self):
+        """Symbol partition directories, or the parquet files of the clustered layout"""
+        partitions = glob.glob(os.path.join(self.data_path, 'Symbol=*'))
+        if len(partitions) > 0:
+            return partitions
+        return glob.glob(os.path.join(self.data_path, '[!_.]*.parquet'))
+
+    def refresh(self):
+        parts = {i: self.get_signature(i) for i in self.get_parts()}
+        changed = [i for i, signature in parts.items() if self.parts.get(i, (None, []))[0] != signature]
+
+        # Remove all the changed parts first, as a symbol may move to another clustered file
+        for part_path in (set(self.parts) - set(parts)) | set(changed):
+            self.remove_part(part_path)
+
+        loaded = 0
+        for part_path in changed:
+            symbols = self.load_part(part_path, parts[part_path])
+            self.symbols.update(symbols)
+            self.parts[part_path] = (parts[part_path], list(symbols))
+            loaded += len(symbols)
+
+        self.refreshed_at = time.monotonic()
+        if loaded > 0:
+            logger.info(f'Load the features of {loaded} symbols from {self.data_path}')
+
+    def remove_part(self, part_path):
+        _, symbols = self.parts.pop(part_path, (None, []))
+        for symbol in symbols:
+            self.symbols.pop(symbol, None)
+
+    @staticmethod
+    def load_part(part_path, signature):
+        """Features of the symbols of a Symbol partition, or of a clustered file"""
+        partition = os.path.basename(part_path)
+        if partition.startswith('Symbol='):
+            df = pd.read_parquet(part_path, columns=['Date'] + list(FEATURE_COLUMNS))
+            return {partition[len('Symbol='):]: StageDataIndex.load_symbol(df, signature)}
+
+        df = pd.read_parquet(part_path, columns=['Symbol', 'Date'] + list(FEATURE_COLUMNS))
+        return {
+            str(symbol): StageDataIndex.load_symbol(df_symbol, signature)
+            for symbol, df_symbol in df.groupby('Symbol', sort=False)
+        }
+
+    @staticmethod
+    def load_symbol(df, signature):
+        dates = pd.to_datetime(df['Date']).to_numpy().astype('datetime64[D]')
+        order = np.argsort(dates, kind='stable')
+        features = {name: df[column].to_numpy(dtype=np.float64)[order] for column, name in FEATURE_COLUMNS.items()}
+        return SymbolFeatures(signature, dates[order], features)
+
+
+class FeatureStore:
+    """
+    Serve the request features of a symbol from the Step 2 staging data of the predictors.
+
+    The staging data `{model}-{type}_StageData` is found next to the predictor name `{model}-{type}_{predict}_Model`,
+    and refreshed incrementally every `refresh_interval` seconds.
+    """
+    def __init__(self, data_path, refresh_interval=60):
+        self.data_path = data_path
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def get_stage_data_path(self, pred_model):
+        suffix = f'_{pred_model.predict_type}_Model'
+        prefix = pred_model.name[:-len(suffix)] if pred_model.name.endswith(suffix) else pred_model.name
+        return os.path.join(self.data_path, f'{prefix}_StageData')
+
+    def get_index(self, stage_data_path):
+        with self._lock:
+            index = self._indexes.get(stage_data_path)
+            if index is None:
+                index = self._indexes[stage_data_path] = StageDataIndex(stage_data_path)
+
+        with index.lock:
+            if index.refreshed_at is None or time.monotonic() - index.refreshed_at > self.refresh_interval:
+                index.refresh()
+        return index
+
+    def preload(self):
+        """Load all the staging data at startup"""
+        for stage_data_path in glob.glob(os.path.join(self.data_path, '*_StageData')):
+            self.get_index(stage_data_path)
+
+    def get_features(self, pred_model, symbol, date=None):
+        stage_data_path = self.get_stage_data_path(pred_model)
+        if not os.path.exists(stage_data_path):
+            raise FeatureNotFoundException(f'Staging data does not exist: {stage_data_path}')
+
+        symbol_features = self.get_index(stage_data_path).symbols.get(symbol)
+        row = symbol_features.get(date) if symbol_features is not None else None
+        if row is None:
+            raise FeatureNotFoundException(f'No features of the symbol {symbol} on {date or "the latest date"}')
+
+        missed = [name for name in FEATURE_COLUMNS.values() if np.isnan(row[name])]
+        if pred_model.predict_type == 'Volume' and 'price_daily_std' in missed:
+            missed.remove('price_daily_std')
+        if len(missed) > 0:
+            raise FeatureNotFoundException(f'Missing features {", ".join(missed)} of {symbol} on {row["date"]}')
+
+        return row
+
+
+feature_store = FeatureStore(settings.FEATURE_STORE_PATH, refresh_interval=settings.FEATURE_STORE_REFRESH_INTERVAL)
@@ -0,0 +1,88 @@
+import joblib
+import numpy as np
+
+# The layout of the forest arrays exported by `etl.forest_arrays` of stock_etl, which the API only loads, a file of
+# another version is rejected
+COMPILED_FOREST_SUFFIX = '_Forest.joblib'
+
+FOREST_ARRAYS_VERSION = 1
+
+FOREST_ARRAY_DTYPES = {
+    'feature': np.int64, 'threshold': np.float64, 'left': np.int64, 'right': np.int64, 'value': np.float64,
+    'roots': np.int64,
+}
+
+FOREST_ARRAYS = list(FOREST_ARRAY_DTYPES)
+
+
+def get_compiled_forest_path(model_path):
+    return model_path.replace('.joblib', COMPILED_FOREST_SUFFIX)
+
+
+class CompiledForest:
+    """
+    Vectorized inference engine of a random forest regressor compiled to flat node arrays.
+
+    The nodes of all the trees are concatenated, with the tree roots at `roots`. A leaf node points to itself
+    on both sides, so all the trees and rows are walked down together one level per step. The predictions are
+    bit-for-bit equal to the sklearn RandomForestRegressor.predict.
+    """
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.n_features = int(n_features)
+
+    @classmethod
+    def load(cls, forest_path, mmap_mode=None):
+        """
+        Load the forest arrays, memory-mapped read-only with `mmap_mode='r'`.
+
+        Raise ValueError for the arrays of another version or dtypes than FOREST_ARRAYS_VERSION.
+        """
+        arrays = joblib.load(forest_path, mmap_mode=mmap_mode)
+        version = arrays.get('version') if isinstance(arrays, dict) else None
+        if version != FOREST_ARRAYS_VERSION:
+            raise ValueError(f'Forest arrays version {version} is not {FOREST_ARRAYS_VERSION}: {forest_path}')
+        for name, dtype in FOREST_ARRAY_DTYPES.items():
+            if arrays[name].dtype != dtype:
+                raise ValueError(f'Forest array {name} is {arrays[name].dtype}, not {np.dtype(dtype)}: {forest_path}')
+        return cls(**{i: arrays[i] for i in FOREST_ARRAYS + ['max_depth', 'n_features']})
+
+    def apply(self, X):
+        """Find the leaf node of each tree and row, in the shape of (n_trees, n_rows)"""
+        n_rows = X.shape[0]
+        nodes = np.repeat(self.roots, n_rows)
+        rows = np.tile(np.arange(n_rows), len(self.roots))
+
+        # Walk down only the (tree, row) pairs which have not reached a leaf yet
+        active = np.flatnonzero(self.left[nodes] != nodes)
+        while active.size > 0:
+            current = nodes[active]
+            go_left = X[rows[active], self.feature[current]] <= self.threshold[current]
+            current = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = current
+            active = active[self.left[current] != current]
+
+        return nodes.reshape(len(self.roots), n_rows)
+
+    def predict(self, X):
+        # The same as sklearn, the features are compared in float32 precision
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f'X has {X.shape[-1]} features, but the forest is expecting {self.n_features} features')
+        if not np.isfinite(X).all():
+            raise ValueError('Input X contains NaN or infinity.')
+
+        leaf_values = self.value[self.apply(X)]
+
+        # Sum the trees one by one in the order of sklearn, to keep the same floating point rounding
+        y_pred = np.zeros(X.shape[0], dtype=np.float64)
+        for tree_values in leaf_values:
+            y_pred += tree_values
+        y_pred /= len(self.roots)
+        return y_pred
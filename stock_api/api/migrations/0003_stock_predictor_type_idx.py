@@ -0,0 +1,17 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_load_predictors'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockpredictormodel',
+            index=models.Index(fields=['stock_type', 'predict_type'], name='stock_predictor_type_idx'),
+        ),
+    ]
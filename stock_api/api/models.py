@@ -8,6 +8,11 @@ class StockPredictorModel(models.Model):
     predict_type = models.CharField(max_length=20)
     job_path = models.CharField(max_length=500)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['stock_type', 'predict_type'], name='stock_predictor_type_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .predict_joblib import predict_model_joblib
+
+logger = logging.getLogger(__name__)
+
+
+class PredictBatch:
+    """
+    The prediction rows of one model collected within the batching window.
+    """
+    def __init__(self):
+        self.rows = []
+        self.size = 0
+        self.enqueued_at = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def add(self, request_data):
+        offset = self.size
+        self.rows.append(np.asarray(request_data, dtype=np.float64))
+        self.size += len(request_data)
+        self.enqueued_at.append(time.perf_counter())
+        return offset
+
+
+class PredictBatcher:
+    """
+    Coalesce the concurrent predictions of the same model into one predict call.
+
+    The first request of a model waits up to `window` seconds, or until `max_rows` rows are queued,
+    then predicts the stacked rows of all the waiting requests and fans the results back out.
+    """
+    def __init__(self, window=0.002, max_rows=64):
+        self.window = window
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stats = {'batches': 0, 'requests': 0, 'rows': 0, 'max_batch_rows': 0,
+                       'queue_delay': 0.0, 'max_queue_delay': 0.0}
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def predict(self, model_path, request_data):
+        num_rows = len(request_data)
+        with self._lock:
+            batch = self._pending.get(model_path)
+            leader = batch is None
+            if leader:
+                batch = PredictBatch()
+                self._pending[model_path] = batch
+
+            offset = batch.add(request_data)
+            if batch.size >= self.max_rows:
+                # Close the full batch, so the next requests start a new one
+                del self._pending[model_path]
+                batch.full.set()
+
+        if leader:
+            self._run_batch(model_path, batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+
+        return batch.result[offset:offset + num_rows]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+
+        stats['window_ms'] = self.window * 1000
+        stats['max_rows'] = self.max_rows
+        stats['mean_batch_rows'] = stats['rows'] / stats['batches'] if stats['batches'] > 0 else None
+        stats['mean_queue_delay'] = stats['queue_delay'] / stats['requests'] if stats['requests'] > 0 else None
+        return stats
+
+    def _run_batch(self, model_path, batch):
+        batch.full.wait(self.window)
+        with self._lock:
+            if self._pending.get(model_path) is batch:
+                del self._pending[model_path]
+
+        start_time = time.perf_counter()
+        try:
+            batch.result = predict_model_joblib(model_path, np.vstack(batch.rows))
+            if batch.result is None:
+                batch.error = ValueError('Predict model does not work.')
+        except Exception as e:
+            logger.error(f'Failed to predict the batch of {batch.size} rows: {e}')
+            batch.error = e
+        finally:
+            batch.done.set()
+
+        queue_delays = [start_time - i for i in batch.enqueued_at]
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['requests'] += len(queue_delays)
+            self._stats['rows'] += batch.size
+            self._stats['max_batch_rows'] = max(self._stats['max_batch_rows'], batch.size)
+            self._stats['queue_delay'] += sum(queue_delays)
+            self._stats['max_queue_delay'] = max(self._stats['max_queue_delay'], max(queue_delays))
+
+
+predict_batcher = PredictBatcher(
+    window=settings.PREDICT_BATCH_WINDOW_MS / 1000, max_rows=settings.PREDICT_BATCH_MAX_SIZE,
+)
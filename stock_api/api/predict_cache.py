@@ -0,0 +1,117 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .predict_joblib import ModelRegistry, resolve_model_path
+
+logger = logging.getLogger(__name__)
+
+
+class PredictCache:
+    """
+    Cache of the prediction results keyed by the model version and the quantized features.
+
+    The results are kept in a per-process LRU of `max_size` entries, and optionally shared through the Django cache
+    `backend` alias. The model version is the modified time and size of the model file, so the cached results of a
+    changed model are never served again. The features are rounded to `precision` significant digits.
+    """
+    def __init__(self, max_size=0, precision=12, backend=None, timeout=3600):
+        self.max_size = max_size
+        self.precision = precision
+        self.backend = backend
+        self.timeout = timeout
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'backend_hits': 0, 'evictions': 0}
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def make_keys(self, model_path, request_data):
+        signature = ModelRegistry.get_signature(resolve_model_path(model_path))
+        prefix = f'{model_path}:{signature[0]}:{signature[1]}'
+        keys = []
+        for row in request_data:
+            features = ','.join(f'{float(i):.{self.precision}g}' for i in row)
+            keys.append('predict:' + hashlib.sha1(f'{prefix}:{features}'.encode()).hexdigest())
+        return keys
+
+    def predict(self, model_path, request_data, predict_func):
+        """Predict the rows missed from the cache with `predict_func`, and cache their results"""
+        keys = self.make_keys(model_path, request_data)
+        results = self._get_many(keys)
+
+        missed = [i for i, key in enumerate(keys) if key not in results]
+        if len(missed) > 0:
+            y_pred = predict_func(model_path, np.asarray([request_data[i] for i in missed], dtype=np.float64))
+            if y_pred is None:
+                return None
+            self._set_many({keys[i]: float(value) for i, value in zip(missed, y_pred)})
+            results.update({keys[i]: value for i, value in zip(missed, y_pred)})
+
+        return np.array([results[key] for key in keys], dtype=np.float64)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._results)
+
+        stats['max_size'] = self.max_size
+        stats['backend'] = self.backend
+        requests = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / requests if requests > 0 else None
+        return stats
+
+    def _get_many(self, keys):
+        results = {}
+        with self._lock:
+            for key in keys:
+                if key in self._results:
+                    self._results.move_to_end(key)
+                    results[key] = self._results[key]
+
+        backend_results = {}
+        if self.backend and len(results) < len(keys):
+            try:
+                backend_results = caches[self.backend].get_many([i for i in keys if i not in results])
+            except Exception as e:
+                logger.warning(f'Failed to read the prediction cache {self.backend}: {e}')
+
+        if len(backend_results) > 0:
+            self._set_local(backend_results)
+            results.update(backend_results)
+
+        with self._lock:
+            self._stats['hits'] += len(results)
+            self._stats['misses'] += len(keys) - len(results)
+            self._stats['backend_hits'] += len(backend_results)
+        return results
+
+    def _set_many(self, results):
+        self._set_local(results)
+        if self.backend:
+            try:
+                caches[self.backend].set_many(results, timeout=self.timeout)
+            except Exception as e:
+                logger.warning(f'Failed to write the prediction cache {self.backend}: {e}')
+
+    def _set_local(self, results):
+        with self._lock:
+            self._results.update(results)
+            for key in results:
+                self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+                self._stats['evictions'] += 1
+
+
+predict_cache = PredictCache(
+    max_size=settings.PREDICT_CACHE_SIZE, precision=settings.PREDICT_CACHE_PRECISION,
+    backend=settings.PREDICT_CACHE_BACKEND or None, timeout=settings.PREDICT_CACHE_TIMEOUT,
+)
@@ -0,0 +1,202 @@
+import atexit
+import logging
+import math
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, models
+from django.db.backends.base.operations import BaseDatabaseOperations
+
+from .models import PredictHistModel
+
+logger = logging.getLogger(__name__)
+
+
+def validate_hist(hist):
+    """
+    Validate the fields of a prediction history row, raise ValidationError for an invalid one.
+
+    The integers are checked against the ranges of the SQL databases, which SQLite does not validate, and the floats
+    must be finite. The foreign key to the predictor is not queried.
+    """
+    hist.full_clean(exclude=['predict_model'], validate_unique=False)
+    for field in hist._meta.concrete_fields:
+        value = getattr(hist, field.attname)
+        if value is None or field.primary_key:
+            continue
+        if isinstance(field, models.IntegerField):
+            low, high = BaseDatabaseOperations.integer_field_ranges[field.get_internal_type()]
+            if not low <= value <= high:
+                raise ValidationError({field.name: f'{value} is out of the range [{low}, {high}]'})
+        elif isinstance(field, models.FloatField) and not math.isfinite(value):
+            raise ValidationError({field.name: f'{value} is not a finite number'})
+
+
+class PredictHistWriter:
+    """
+    Buffer the prediction history rows in memory, and insert them with bulk_create.
+
+    The rows are flushed by a background writer once `batch_size` rows are queued, or `flush_interval`
+    seconds after the first queued row. When the queue is full, the rows are written in the request thread.
+    With `asynchronous` disabled, every save is a synchronous bulk_create.
+
+    The rows are validated by the writer before the bulk_create, in the background writer of the asynchronous mode,
+    and the invalid ones are dropped, so they do not fail the flush of the other rows. A failed flush is retried row by
+    row, and only the rows which still fail are dropped.
+    """
+    def __init__(self, batch_size=500, flush_interval=1.0, queue_size=10000, asynchronous=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.asynchronous = asynchronous
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {'queued': 0, 'written': 0, 'invalid': 0, 'failed': 0, 'flushes': 0, 'sync_writes': 0}
+
+    def save(self, hists):
+        if not self.asynchronous or self._stop.is_set():
+            self._write(hists, sync=True)
+            return
+
+        self._start()
+        overflow = []
+        for hist in hists:
+            try:
+                self._queue.put_nowait(hist)
+            except queue.Full:
+                overflow.append(hist)
+
+        with self._lock:
+            self._stats['queued'] += len(hists) - len(overflow)
+
+        if len(overflow) > 0:
+            logger.warning(f'Prediction history queue is full, write {len(overflow)} rows synchronously')
+            self._write(overflow, sync=True)
+
+    def flush(self, timeout=10.0):
+        """Stop the background writer, and write the remaining rows"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+        hists = self._drain(block=False)
+        while len(hists) > 0:
+            self._write(hists)
+            hists = self._drain(block=False)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        stats['asynchronous'] = self.asynchronous
+        return stats
+
+    def _validate(self, hists):
+        """Select the valid rows, the invalid ones are logged and counted"""
+        valid = []
+        for hist in hists:
+            try:
+                validate_hist(hist)
+                valid.append(hist)
+            except ValidationError as e:
+                logger.warning(f'Drop an invalid prediction history row: {e}')
+
+        if len(valid) < len(hists):
+            with self._lock:
+                self._stats['invalid'] += len(hists) - len(valid)
+        return valid
+
+    def _start(self):
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='PredictHistWriter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            hists = self._drain(block=True)
+            if len(hists) > 0:
+                self._write(hists)
+
+        close_old_connections()
+
+    def _drain(self, block):
+        """Collect up to `batch_size` queued rows within the flush interval"""
+        hists = []
+        deadline = None
+        while len(hists) < self.batch_size:
+            if not block or self._stop.is_set():
+                timeout = None
+            elif deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+
+            try:
+                if timeout is None:
+                    hists.append(self._queue.get_nowait())
+                else:
+                    hists.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+        return hists
+
+    def _write(self, hists, sync=False):
+        if not sync:
+            close_old_connections()
+        hists = self._validate(hists)
+        if len(hists) == 0:
+            return
+
+        try:
+            PredictHistModel.objects.bulk_create(hists, batch_size=self.batch_size)
+            written = len(hists)
+        except Exception as e:
+            logger.error(f'Failed to write {len(hists)} prediction history rows, retry row by row: {e}')
+            written = self._write_rows(hists)
+
+        with self._lock:
+            self._stats['written'] += written
+            self._stats['failed'] += len(hists) - written
+            self._stats['flushes'] += 1
+            if sync:
+                self._stats['sync_writes'] += 1
+
+    @staticmethod
+    def _write_rows(hists):
+        """Write the rows one by one, and the number of the written rows"""
+        failed = 0
+        for hist in hists:
+            try:
+                PredictHistModel.objects.bulk_create([hist])
+            except Exception as e:
+                failed += 1
+                logger.debug(f'Failed to write a prediction history row: {e}')
+
+        if failed > 0:
+            logger.error(f'Dropped {failed} of {len(hists)} prediction history rows')
+        return len(hists) - failed
+
+
+predict_hist_writer = PredictHistWriter(
+    batch_size=settings.PREDICT_HIST_BATCH_SIZE,
+    flush_interval=settings.PREDICT_HIST_FLUSH_INTERVAL,
+    queue_size=settings.PREDICT_HIST_QUEUE_SIZE,
+    asynchronous=settings.PREDICT_HIST_ASYNC,
+)
+
+# Flush the buffered prediction history on shutdown
+atexit.register(predict_hist_writer.flush)
@@ -1,17 +1,111 @@
 import logging
 import os
-from sklearn.ensemble import RandomForestRegressor
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
 import joblib
 
+from .forest_engine import CompiledForest, COMPILED_FOREST_SUFFIX, get_compiled_forest_path
+
 logger = logging.getLogger(__name__)
 
 
+class ModelRegistry:
+    """
+    Per-process cache of the loaded regression models.
+
+    The models are keyed by the model path, and reloaded when the file modified time or size changes.
+    The least recently used model is evicted once the registry holds more than `max_size` models.
+    """
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'reloads': 0, 'evictions': 0, 'load_time': 0.0}
+
+    @staticmethod
+    def get_signature(model_path):
+        """Identify the model file version by its modified time and size"""
+        stat = os.stat(model_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, model_path):
+        signature = self.get_signature(model_path)
+        with self._lock:
+            cached = self._models.get(model_path)
+            if cached is not None and cached[0] == signature:
+                self._models.move_to_end(model_path)
+                self._stats['hits'] += 1
+                return cached[1]
+
+            self._stats['misses'] += 1
+            if cached is not None:
+                self._stats['reloads'] += 1
+
+        # Load the model outside the lock, so the other models are still served
+        start_time = time.perf_counter()
+        pred_model = load_model(model_path)
+        load_time = time.perf_counter() - start_time
+        logger.info(f'Loaded the regression model: {model_path} in {load_time:.3f}s')
+
+        with self._lock:
+            self._stats['load_time'] += load_time
+            self._models[model_path] = (signature, pred_model)
+            self._models.move_to_end(model_path)
+            while len(self._models) > self.max_size:
+                evicted_path, _ = self._models.popitem(last=False)
+                self._stats['evictions'] += 1
+                logger.info(f'Evict the regression model: {evicted_path}')
+
+        return pred_model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._models)
+            stats['max_size'] = self.max_size
+            stats['models'] = list(self._models.keys())
+
+        requests = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / requests if requests > 0 else None
+        return stats
+
+
+def load_model(model_path):
+    """Load the compiled forest, or the joblib model also in place of the forest arrays of another version"""
+    if model_path.endswith(COMPILED_FOREST_SUFFIX):
+        try:
+            # Memory-map the node arrays, so the worker processes share one page cache copy
+            return CompiledForest.load(model_path, mmap_mode='r' if settings.PREDICT_MODEL_MMAP else None)
+        except ValueError as e:
+            logger.warning(f'Use the joblib model in place of the compiled forest: {e}')
+            model_path = model_path[:-len(COMPILED_FOREST_SUFFIX)] + '.joblib'
+    return joblib.load(model_path)
+
+
+def resolve_model_path(model_path):
+    """Use the compiled forest exported next to the joblib model if the compiled engine is enabled"""
+    if settings.PREDICT_ENGINE == 'compiled':
+        forest_path = get_compiled_forest_path(model_path)
+        if os.path.exists(forest_path):
+            return forest_path
+    return model_path
+
+
+model_registry = ModelRegistry(max_size=settings.PREDICT_MODEL_CACHE_SIZE)
+
+
 def predict_model_joblib(model_path, request_data):
-    # Load the model
-    print(f'Load the regression model: {model_path}')
-    pred_model = joblib.load(model_path)
+    # Load the model from the per-process registry
+    pred_model = model_registry.get(resolve_model_path(model_path))
 
-    print(f'predict data: {request_data}')
+    logger.debug(f'predict data: {request_data}')
     y_pred = pred_model.predict(request_data)
-    print(f'Predict: {y_pred}')
+    logger.debug(f'Predict: {y_pred}')
     return y_pred
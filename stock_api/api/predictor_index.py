@@ -0,0 +1,62 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .models import StockPredictorModel
+
+logger = logging.getLogger(__name__)
+
+
+class PredictorIndex:
+    """
+    In-memory index of the stock predictors by (stock_type, predict_type) and by pk.
+
+    The index is loaded on first use, invalidated by the StockPredictorModel save/delete signals,
+    and reloaded after `ttl` seconds to pick up the changes made by the other processes.
+    """
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._items = []
+        self._by_pk = {}
+        self._by_type = {}
+
+    def all(self):
+        return self._load()[0]
+
+    def get(self, pk):
+        return self._load()[1].get(pk)
+
+    def filter(self, stock_type, predict_type):
+        return self._load()[2].get((stock_type, predict_type), [])
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _expired(self):
+        if self._loaded_at is None:
+            return True
+        return bool(self.ttl) and time.monotonic() - self._loaded_at > self.ttl
+
+    def _load(self):
+        with self._lock:
+            if self._expired():
+                items = list(StockPredictorModel.objects.all().order_by('pk'))
+                by_type = {}
+                for item in items:
+                    by_type.setdefault((item.stock_type, item.predict_type), []).append(item)
+
+                self._items = items
+                self._by_pk = {item.pk: item for item in items}
+                self._by_type = by_type
+                self._loaded_at = time.monotonic()
+                logger.info(f'Load the stock predictor index: {len(items)} predictors')
+
+            return self._items, self._by_pk, self._by_type
+
+
+predictor_index = PredictorIndex(ttl=settings.PREDICTOR_INDEX_TTL)
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import StockPredictorModel
+from .predictor_index import predictor_index
+
+
+@receiver(post_save, sender=StockPredictorModel)
+@receiver(post_delete, sender=StockPredictorModel)
+def invalidate_predictor_index(sender, **kwargs):
+    predictor_index.invalidate()
@@ -1,3 +1,376 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+import joblib
+import numpy as np
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from sklearn.ensemble import RandomForestRegressor
+
+from .forest_engine import CompiledForest, get_compiled_forest_path
+from .models import PredictHistModel, StockPredictorModel
+from .predict_batcher import PredictBatcher
+from .predict_cache import PredictCache
+from .predict_hist import PredictHistWriter, predict_hist_writer
+from .predict_joblib import ModelRegistry, load_model
+from .predictor_index import PredictorIndex, predictor_index
+
+
+def train_forest(num_features, seed=0, n_estimators=5):
+    """A small random forest regressor of random features"""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(100, 10, (200, num_features))
+    y = X.sum(axis=1) + rng.normal(0, 1, 200)
+    return RandomForestRegressor(n_estimators=n_estimators, max_depth=6, random_state=seed).fit(X, y)
+
+
+def save_forest(model_path, num_features, seed=0):
+    joblib.dump(train_forest(num_features, seed), model_path)
+    # A new modified time, so the model is a new version even within the resolution of the file system
+    stat = os.stat(model_path)
+    os.utime(model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seed * 10 ** 9))
+    return model_path
+
+
+def export_forest(forest, forest_path):
+    # The forest arrays are exported by the ETL, from the stock_etl directory next to stock_api
+    from benchmarks import STOCK_ETL_PATH  # noqa: F401
+    from etl.forest_arrays import export_forest_arrays
+    export_forest_arrays(forest, forest_path)
+
+
+class ModelDirTestMixin:
+    """A temporary directory of the models of the test case"""
+    @classmethod
+    def setUpClass(cls):
+        # Before the test data of a TestCase, which saves its models in the directory
+        cls.model_dir = tempfile.mkdtemp(prefix='stock_api_test_')
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.model_dir)
+        super().tearDownClass()
+
+    def get_model_path(self, name):
+        return os.path.join(self.model_dir, f'{name}.joblib')
+
+
+class ModelRegistryTest(ModelDirTestMixin, SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        paths = [save_forest(self.get_model_path(f'evict_{i}'), 2) for i in range(3)]
+        registry = ModelRegistry(max_size=2)
+        registry.get(paths[0])
+        registry.get(paths[1])
+        # The first model is used again, so the second one is the least recently used
+        registry.get(paths[0])
+        registry.get(paths[2])
+
+        stats = registry.stats()
+        self.assertEqual(stats['models'], [paths[0], paths[2]])
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (1, 3, 1))
+
+        registry.get(paths[1])
+        self.assertEqual(registry.stats()['models'], [paths[2], paths[1]])
+
+    def test_reloads_changed_model(self):
+        model_path = save_forest(self.get_model_path('reload'), 2)
+        registry = ModelRegistry(max_size=2)
+        model = registry.get(model_path)
+        self.assertIs(registry.get(model_path), model)
+
+        save_forest(model_path, 2, seed=1)
+        reloaded = registry.get(model_path)
+        self.assertIsNot(reloaded, model)
+        X = np.array([[100.0, 100.0]])
+        np.testing.assert_array_equal(reloaded.predict(X), joblib.load(model_path).predict(X))
+
+        stats = registry.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['reloads'], stats['size']), (1, 2, 1, 1))
+
+
+class CompiledForestTest(ModelDirTestMixin, SimpleTestCase):
+    def test_predictions_equal_sklearn(self):
+        forest = train_forest(3, n_estimators=20)
+        forest_path = os.path.join(self.model_dir, 'parity_Forest.joblib')
+        export_forest(forest, forest_path)
+
+        rng = np.random.default_rng(1)
+        X = rng.normal(100, 20, (500, 3))
+        # The split thresholds themselves, where the float32 comparison of sklearn decides the branch
+        thresholds = forest.estimators_[0].tree_.threshold
+        X[:10] = thresholds[thresholds > 0][:1]
+        for mmap_mode in [None, 'r']:
+            compiled = CompiledForest.load(forest_path, mmap_mode=mmap_mode)
+            np.testing.assert_array_equal(compiled.predict(X), forest.predict(X))
+
+    def test_rejects_invalid_features(self):
+        forest_path = os.path.join(self.model_dir, 'invalid_Forest.joblib')
+        export_forest(train_forest(2), forest_path)
+        compiled = CompiledForest.load(forest_path)
+        with self.assertRaises(ValueError):
+            compiled.predict([[1.0, 2.0, 3.0]])
+        with self.assertRaises(ValueError):
+            compiled.predict([[1.0, np.nan]])
+
+    def test_loads_joblib_model_for_another_version(self):
+        model_path = save_forest(self.get_model_path('version'), 2)
+        forest_path = get_compiled_forest_path(model_path)
+        export_forest(joblib.load(model_path), forest_path)
+        arrays = joblib.load(forest_path)
+        joblib.dump(dict(arrays, version=arrays['version'] + 1), forest_path)
+
+        with self.assertRaises(ValueError):
+            CompiledForest.load(forest_path)
+        self.assertIsInstance(load_model(forest_path), RandomForestRegressor)
+
+
+class PredictorIndexTest(TestCase):
+    def tearDown(self):
+        predictor_index.invalidate()
+
+    def test_loads_once_until_invalidated(self):
+        index = PredictorIndex(ttl=0)
+        with self.assertNumQueries(1):
+            self.assertEqual([i.name for i in index.filter('Stock', 'Price')],
+                             ['StockPredict_v1_2019-Stock_Price_Model'])
+            self.assertEqual(index.get(index.all()[0].pk), index.all()[0])
+            self.assertEqual(index.filter('Stock', 'Nope'), [])
+
+        index.invalidate()
+        with self.assertNumQueries(1):
+            index.all()
+
+    def test_reloads_after_ttl(self):
+        index = PredictorIndex(ttl=60)
+        with mock.patch('api.predictor_index.time.monotonic', return_value=1000.0):
+            index.all()
+        with mock.patch('api.predictor_index.time.monotonic', return_value=1030.0), self.assertNumQueries(0):
+            index.all()
+        with mock.patch('api.predictor_index.time.monotonic', return_value=1061.0), self.assertNumQueries(1):
+            index.all()
+
+    def test_invalidated_by_model_changes(self):
+        predictor = predictor_index.filter('ETF', 'Volume')[0]
+        predictor.name = 'ETF_Volume_Renamed'
+        predictor.save()
+        self.assertEqual(predictor_index.get(predictor.pk).name, 'ETF_Volume_Renamed')
+
+        predictor.delete()
+        self.assertIsNone(predictor_index.get(predictor.pk))
+        self.assertEqual(predictor_index.filter('ETF', 'Volume'), [])
+
+
+class PredictHistWriterTest(TestCase):
+    def get_hists(self, num_rows):
+        predictor = StockPredictorModel.objects.get(stock_type='Stock', predict_type='Volume')
+        return [
+            PredictHistModel(predict_model=predictor, vol_moving_avg=1000 + i, price_rolling_med=10.0, volume=5.0)
+            for i in range(num_rows)
+        ]
+
+    def test_drops_invalid_rows(self):
+        writer = PredictHistWriter(asynchronous=False)
+        hists = self.get_hists(3)
+        hists[1].vol_moving_avg = 2 ** 70
+        hists[2].volume = float('inf')
+        writer.save(hists)
+
+        self.assertEqual(PredictHistModel.objects.count(), 1)
+        stats = writer.stats()
+        self.assertEqual((stats['written'], stats['invalid'], stats['sync_writes']), (1, 2, 1))
+
+    def test_retries_failed_flush_row_by_row(self):
+        writer = PredictHistWriter(asynchronous=False)
+        hists = self.get_hists(4)
+        bulk_create = PredictHistModel.objects.bulk_create
+
+        def fail_batch(rows, **kwargs):
+            # The flush of many rows fails, and then only the row of the third one
+            if len(rows) > 1 or rows[0] is hists[2]:
+                raise RuntimeError('insert failed')
+            return bulk_create(rows, **kwargs)
+
+        with mock.patch.object(PredictHistModel.objects, 'bulk_create', side_effect=fail_batch):
+            writer.save(hists)
+
+        self.assertEqual(sorted(PredictHistModel.objects.values_list('vol_moving_avg', flat=True)), [1000, 1001, 1003])
+        stats = writer.stats()
+        self.assertEqual((stats['written'], stats['failed'], stats['flushes']), (3, 1, 1))
+
+
+class PredictHistWriterFlushTest(TransactionTestCase):
+    # Restore the predictors of the migrations, which the flush of the test database removes
+    serialized_rollback = True
+
+    def test_flush_writes_queued_rows(self):
+        predictor = StockPredictorModel.objects.get(stock_type='ETF', predict_type='Price')
+        writer = PredictHistWriter(batch_size=2, flush_interval=0.01, queue_size=3)
+        writer.save([PredictHistModel(predict_model=predictor, price=float(i)) for i in range(5)])
+        writer.flush()
+
+        self.assertEqual(sorted(PredictHistModel.objects.values_list('price', flat=True)), [0, 1, 2, 3, 4])
+        stats = writer.stats()
+        # The rows beyond the queue size are written in the request thread
+        self.assertEqual((stats['queued'], stats['written'], stats['pending'], stats['sync_writes']), (3, 5, 0, 1))
+
+        # A save after the flush is written synchronously
+        writer.save([PredictHistModel(predict_model=predictor, price=5.0)])
+        self.assertEqual(PredictHistModel.objects.count(), 6)
+
+
+class PredictBatcherTest(SimpleTestCase):
+    def predict_concurrently(self, batcher, rows):
+        results, errors = [None] * len(rows), [None] * len(rows)
+        barrier = threading.Barrier(len(rows))
+
+        def predict(i):
+            barrier.wait()
+            try:
+                results[i] = batcher.predict('model.joblib', [rows[i]])
+            except ValueError as e:
+                errors[i] = e
+
+        threads = [threading.Thread(target=predict, args=(i,)) for i in range(len(rows))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        return results, errors
+
+    def test_coalesces_concurrent_rows(self):
+        rows = [[float(i), 1.0] for i in range(4)]
+        batcher = PredictBatcher(window=5.0, max_rows=4)
+        with mock.patch('api.predict_batcher.predict_model_joblib', side_effect=lambda path, X: X.sum(axis=1)) as predict:
+            results, _ = self.predict_concurrently(batcher, rows)
+
+        # The full batch is predicted before the window ends, in one call of all the rows
+        self.assertEqual(predict.call_count, 1)
+        self.assertEqual(predict.call_args[0][1].shape, (4, 2))
+        self.assertEqual([list(i) for i in results], [[1.0], [2.0], [3.0], [4.0]])
+        stats = batcher.stats()
+        self.assertEqual((stats['batches'], stats['requests'], stats['rows'], stats['max_batch_rows']), (1, 4, 4, 4))
+
+    def test_raises_error_to_every_request(self):
+        batcher = PredictBatcher(window=5.0, max_rows=3)
+        with mock.patch('api.predict_batcher.predict_model_joblib', side_effect=ValueError('bad features')):
+            results, errors = self.predict_concurrently(batcher, [[1.0], [2.0], [3.0]])
+
+        self.assertEqual(results, [None] * 3)
+        self.assertTrue(all(isinstance(i, ValueError) for i in errors))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PredictCacheTest(ModelDirTestMixin, SimpleTestCase):
+    def setUp(self):
+        self.model_path = save_forest(self.get_model_path('cache'), 2)
+        self.predict = mock.Mock(side_effect=lambda path, X: X.sum(axis=1))
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def test_predicts_only_missed_rows(self):
+        cache = PredictCache(max_size=2)
+        np.testing.assert_array_equal(cache.predict(self.model_path, [[1, 2], [3, 4]], self.predict), [3, 7])
+        np.testing.assert_array_equal(cache.predict(self.model_path, [[3, 4], [5, 6]], self.predict), [7, 11])
+
+        self.assertEqual(self.predict.call_count, 2)
+        np.testing.assert_array_equal(self.predict.call_args[0][1], [[5, 6]])
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['size']), (1, 3, 1, 2))
+
+    def test_misses_after_model_change(self):
+        cache = PredictCache(max_size=10)
+        cache.predict(self.model_path, [[1, 2]], self.predict)
+        save_forest(self.model_path, 2, seed=1)
+        cache.predict(self.model_path, [[1, 2]], self.predict)
+        self.assertEqual(self.predict.call_count, 2)
+
+    def test_quantizes_features(self):
+        cache = PredictCache(max_size=10, precision=6)
+        cache.predict(self.model_path, [[1.0, 2.0]], self.predict)
+        cache.predict(self.model_path, [[1.0000001, 2.0]], self.predict)
+        self.assertEqual(self.predict.call_count, 1)
+
+    def test_shares_results_through_backend(self):
+        PredictCache(max_size=10, backend='default').predict(self.model_path, [[1, 2]], self.predict)
+        other = PredictCache(max_size=10, backend='default')
+        np.testing.assert_array_equal(other.predict(self.model_path, [[1, 2]], self.predict), [3])
+
+        self.assertEqual(self.predict.call_count, 1)
+        self.assertEqual(other.stats()['backend_hits'], 1)
+
+
+class StockPredictBatchTest(ModelDirTestMixin, TestCase):
+    url = '/api/predict/Stock/Volume/batch/'
+
+    @classmethod
+    def setUpTestData(cls):
+        for predictor in StockPredictorModel.objects.all():
+            num_features = 2 if predictor.predict_type == 'Volume' else 3
+            predictor.job_path = save_forest(os.path.join(cls.model_dir, f'{predictor.name}.joblib'), num_features)
+            predictor.save()
+
+    def setUp(self):
+        # Write the prediction history within the request, in the transaction of the test
+        patcher = mock.patch.object(predict_hist_writer, 'asynchronous', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        predictor_index.invalidate()
+
+    def post(self, body, content_type='application/json'):
+        return self.client.post(self.url, body if isinstance(body, str) else json.dumps(body), content_type=content_type)
+
+    def test_predicts_rows_with_errors_in_order(self):
+        rows = [
+            {'vol_moving_avg': 1000, 'price_rolling_med': 25.5},
+            {'vol_moving_avg': 'x', 'price_rolling_med': 25.5},
+            [1000, 25.5],
+            {'vol_moving_avg': 1000, 'price_rolling_med': 1e39},
+            {'vol_moving_avg': 2000, 'price_rolling_med': 30.0},
+        ]
+        response = self.post(rows)
+        self.assertEqual(response.status_code, 201)
+
+        results = response.json()['results']
+        model = joblib.load(StockPredictorModel.objects.get(name='StockPredict_v1_2019-Stock_Volume_Model').job_path)
+        expected = model.predict(np.array([[1000, 25.5], [2000, 30.0]]))
+        self.assertEqual([results[0]['volume'], results[4]['volume']], list(expected))
+        self.assertEqual([sorted(results[i]) for i in [1, 2, 3]], [['Error']] * 3)
+        self.assertIn('expect a JSON object', results[2]['Error'])
+
+        hists = PredictHistModel.objects.order_by('vol_moving_avg')
+        self.assertEqual([(i.vol_moving_avg, i.volume) for i in hists], list(zip([1000, 2000], expected)))
+
+    def test_predicts_json_lines(self):
+        rows = [{'vol_moving_avg': 1000, 'price_rolling_med': 25.5}, {'vol_moving_avg': 2000, 'price_rolling_med': 30}]
+        response = self.post('\n'.join(json.dumps(i) for i in rows) + '\n', content_type='application/jsonl')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertEqual(PredictHistModel.objects.count(), 2)
+
+    def test_rejects_invalid_batch(self):
+        for body in ['', '[]', '{bad', '[{"vol_moving_avg": 1']:
+            response = self.post(body)
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn('Invalid batch request', response.json()['Error'])
+
+        with override_settings(PREDICT_BATCH_MAX_ROWS=1):
+            response = self.post([{'vol_moving_avg': 1000, 'price_rolling_med': 25.5}] * 2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(PredictHistModel.objects.count(), 0)
+
+    def test_rejects_batch_without_valid_rows(self):
+        response = self.post([{'vol_moving_avg': 1000}, {'price_rolling_med': 'nan', 'vol_moving_avg': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([sorted(i) for i in response.json()['results']], [['Error'], ['Error']])
+
+    def test_unknown_predictor(self):
+        response = self.client.post('/api/predict/Bond/Volume/batch/', '[]', content_type='application/json')
+        self.assertEqual(response.status_code, 404)
@@ -1,8 +1,9 @@
 # api/urls.py
 
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('csrf/', views.get_csrf, name='api-csrf'),
@@ -12,5 +13,17 @@ urlpatterns = [
     path('whoami/', views.WhoAmIView.as_view(), name='api-whoami'),
     path('predictors/', views.PredictorList.as_view()),
     path('predictors/<int:pk>/', views.PredictorDetail.as_view()),
-    path('predict/<str:stock_type>/<str:predict_type>/', views.StockPredict.as_view()),
+    path('predict/stats/', views.PredictStats.as_view()),
 ]
+
+if settings.PREDICT_ASYNC_VIEWS:
+    # Async prediction views of the ASGI deployment
+    urlpatterns += [
+        path('predict/<str:stock_type>/<str:predict_type>/', async_views.stock_predict),
+        path('predict/<str:stock_type>/<str:predict_type>/batch/', async_views.stock_predict_batch),
+    ]
+else:
+    urlpatterns += [
+        path('predict/<str:stock_type>/<str:predict_type>/', views.StockPredict.as_view()),
+        path('predict/<str:stock_type>/<str:predict_type>/batch/', views.StockPredictBatch.as_view()),
+    ]
@@ -1,9 +1,11 @@
 import json
+import logging
 import os
 
-from django.shortcuts import get_object_or_404, get_list_or_404
+import numpy as np
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from rest_framework.parsers import JSONParser
+from rest_framework.parsers import BaseParser, JSONParser
 from django.contrib.auth import authenticate, login, logout
 from django.http import JsonResponse, HttpResponse, Http404
 from django.middleware.csrf import get_token
@@ -14,9 +16,16 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_204_NO_CONTENT
 
-from .models import StockPredictorModel, PredictHistModel
-from .serializer import StockPredictorSerializer, PredictHistModelSerializer
-from .predict_joblib import predict_model_joblib
+from .models import PredictHistModel
+from .serializer import StockPredictorSerializer
+from .predict_joblib import predict_model_joblib, model_registry
+from .predict_hist import predict_hist_writer
+from .predict_batcher import predict_batcher
+from .predict_cache import predict_cache
+from .predictor_index import predictor_index
+from .feature_store import feature_store, FeatureNotFoundException, FEATURE_COLUMNS
+
+logger = logging.getLogger(__name__)
 
 
 def get_csrf(request):
@@ -74,7 +83,7 @@ class PredictorList(APIView):
     List all stock predictors.
     """
     def get(self, request, format=None):
-        items = StockPredictorModel.objects.all()
+        items = predictor_index.all()
         serializer = StockPredictorSerializer(items, many=True)
         return Response(serializer.data)
 
@@ -84,60 +93,245 @@ class PredictorDetail(APIView):
     Retrieve a stock predictor.
     """
     def get(self, request, pk, format=None):
-        item = get_object_or_404(StockPredictorModel.objects.all(), pk=pk)
-        print(f'StockPredictorModel: {item} - {item.__dict__}')
+        item = predictor_index.get(pk)
+        if item is None:
+            raise Http404('No StockPredictorModel matches the given query.')
+        logger.debug(f'StockPredictorModel: {item} - {item.__dict__}')
         serializer = StockPredictorSerializer(item)
         return Response(serializer.data)
 
 
+class PredictStats(APIView):
+    """
+    Retrieve the prediction cache statistics of this process.
+    """
+    def get(self, request, format=None):
+        return Response({
+            'model_registry': model_registry.stats(),
+            'predict_hist': predict_hist_writer.stats(),
+            'predict_batcher': predict_batcher.stats(),
+            'predict_cache': predict_cache.stats(),
+        })
+
+
 class StockPredict(APIView):
     """
     Retrieve a stock prediction.
     """
+    # The JSON body is parsed once by the request, also read by the CSRF check of the session users
+    parser_classes = [JSONParser]
+
     def post(self, request, stock_type, predict_type, *args, **kwargs):
-        pred_model = get_list_or_404(StockPredictorModel.objects.all(),
-                                     stock_type=stock_type, predict_type=predict_type)
+        pred_model = get_predictors_or_404(stock_type, predict_type)
 
-        data = JSONParser().parse(request)
+        data = request.data
         data['predict_model'] = pred_model[0].id
-        print(f'request data: {stock_type} - {predict_type} - {data}')
+        logger.debug(f'request data: {stock_type} - {predict_type} - {data}')
 
         result = get_stock_predict(pred_model[0], data)
         if result.get('Error') is not None:
             return Response(result, status=HTTP_400_BAD_REQUEST)
 
         data.update(result)
-        print(f'updated data: {data}')
+        logger.debug(f'updated data: {data}')
 
-        serializer = PredictHistModelSerializer(data=data)
-        if serializer.is_valid():
-            serializer.save()
+        predict_hist_writer.save(get_predict_hists(pred_model[0], [data], [result]))
 
         return Response(result, status=HTTP_201_CREATED)
 
 
-def get_stock_predict(pred_model, data):
-    if not os.path.exists(pred_model.job_path):
-        return {'Error': f'Predict model path does not exist: {pred_model.job_path}'}
+class BatchBodyParser(BaseParser):
+    """
+    Keep the batch request body as bytes, which the view parses as a JSON array or JSON lines.
+    """
+    media_type = '*/*'
 
-    # Make predictions
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream.read()
+
+
+class StockPredictBatch(APIView):
+    """
+    Retrieve the stock predictions of many rows in one request.
+
+    The request body is either a JSON array or JSON lines of the single prediction requests.
+    """
+    # The body is read once by the request, also read by the CSRF check of the session users
+    parser_classes = [BatchBodyParser]
+
+    def post(self, request, stock_type, predict_type, *args, **kwargs):
+        pred_model = get_predictors_or_404(stock_type, predict_type)
+
+        try:
+            rows = parse_batch_rows(request.data or b'')
+        except ValueError as e:
+            return Response({'Error': f'Invalid batch request: {e}'}, status=HTTP_400_BAD_REQUEST)
+
+        if len(rows) > settings.PREDICT_BATCH_MAX_ROWS:
+            return Response({'Error': f'Batch request exceeds {settings.PREDICT_BATCH_MAX_ROWS} rows.'},
+                            status=HTTP_400_BAD_REQUEST)
+
+        logger.debug(f'batch request data: {stock_type} - {predict_type} - {len(rows)} rows')
+        results = get_stock_predict_batch(pred_model[0], rows)
+        if isinstance(results, dict):
+            return Response(results, status=HTTP_400_BAD_REQUEST)
+
+        hists = get_predict_hists(pred_model[0], rows, results)
+        if len(hists) == 0:
+            return Response({'results': results}, status=HTTP_400_BAD_REQUEST)
+
+        predict_hist_writer.save(hists)
+
+        return Response({'results': results}, status=HTTP_201_CREATED)
+
+
+def get_predictors_or_404(stock_type, predict_type):
+    """Look up the stock predictors from the in-memory index"""
+    pred_model = predictor_index.filter(stock_type, predict_type)
+    if len(pred_model) == 0:
+        raise Http404('No StockPredictorModel matches the given query.')
+    return pred_model
+
+
+def parse_batch_rows(body):
+    """Parse the batch request body of a JSON array or JSON lines"""
+    text = body.decode('utf-8').strip()
+    if text.startswith('['):
+        rows = json.loads(text)
+    else:
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    if not isinstance(rows, list) or len(rows) == 0:
+        raise ValueError('expect a non-empty JSON array or JSON lines')
+    return rows
+
+
+def get_predict_feature_names(pred_model):
+    """Request features of the predict model, in the order of its training columns"""
+    names = ['vol_moving_avg', 'price_rolling_med']
+    return names if pred_model.predict_type == 'Volume' else names + ['price_daily_std']
+
+
+def fill_request_features(pred_model, data):
+    """Fill the missing request features of the symbol from the feature store, only looked up when one is missing"""
+    if data.get('symbol') is None or all(data.get(i) is not None for i in get_predict_feature_names(pred_model)):
+        return
+
+    features = feature_store.get_features(pred_model, data['symbol'], data.get('date'))
+    for name in FEATURE_COLUMNS.values():
+        if data.get(name) is None:
+            data[name] = features[name]
+    data['features_date'] = features['date']
+
+
+def get_predict_features(pred_model, data):
+    """Build the feature row of the predict model from the request data, of finite numbers only"""
     volume_avg = int(data.get('vol_moving_avg'))
     price_med = float(data.get('price_rolling_med'))
     if pred_model.predict_type == 'Volume':
-        request_data = [
-            [volume_avg, price_med]
-        ]
+        features = [volume_avg, price_med]
     else:
         price_std = float(data.get('price_daily_std'))
+        features = [volume_avg, price_med, price_std]
+
+    # The models compare the features in float32, and reject the whole matrix of a NaN or infinite one, so a row
+    # beyond the float32 range is rejected before it
+    with np.errstate(over='ignore'):
+        if not np.isfinite(np.array(features, dtype=np.float32)).all():
+            raise ValueError(f'features must be finite float32 numbers: {features}')
+    return features
+
+
+def get_predict_hist_fields(data, result):
+    """Select the prediction history fields of the request data and result"""
+    fields = ['vol_moving_avg', 'price_rolling_med', 'price_daily_std']
+    hist = {i: data.get(i) for i in fields}
+    # The model predictions are numpy scalars, the model fields validate Python numbers
+    hist.update({k: float(v) for k, v in result.items() if k in ('volume', 'price')})
+    return hist
+
+
+def get_predict_hists(pred_model, rows, results):
+    """Build the prediction history rows of the successful predictions"""
+    predict_key = pred_model.predict_type.lower()
+    return [
+        PredictHistModel(predict_model=pred_model, **get_predict_hist_fields(data, result))
+        for data, result in zip(rows, results) if predict_key in result
+    ]
+
+
+def get_stock_predict(pred_model, data):
+    if not os.path.exists(pred_model.job_path):
+        return {'Error': f'Predict model path does not exist: {pred_model.job_path}'}
+
+    try:
+        fill_request_features(pred_model, data)
+    except (FeatureNotFoundException, ValueError) as e:
+        return {'Error': str(e)}
+
+    # Make predictions
+    try:
         request_data = [
-            [volume_avg, price_med, price_std]
+            get_predict_features(pred_model, data)
         ]
+    except (TypeError, ValueError, OverflowError) as e:
+        return {'Error': f'Invalid request data: {e}'}
 
     predict_type = pred_model.predict_type.lower()
-    print(f'Request_data: {predict_type} - {request_data}')
-
-    result = predict_model_joblib(pred_model.job_path, request_data)
+    logger.debug(f'Request_data: {predict_type} - {request_data}')
+
+    predict_func = predict_batcher.predict if predict_batcher.enabled else predict_model_joblib
+    try:
+        if predict_cache.enabled:
+            result = predict_cache.predict(pred_model.job_path, request_data, predict_func)
+        else:
+            result = predict_func(pred_model.job_path, request_data)
+    except ValueError as e:
+        return {'Error': f'Invalid request data: {e}'}
     if result is None:
         return {'Error': f'Predict model does not work.'}
 
+    if data.get('features_date') is not None:
+        return {predict_type: result[0], 'features_date': data['features_date']}
     return {predict_type: result[0]}
+
+
+def get_stock_predict_batch(pred_model, rows):
+    if not os.path.exists(pred_model.job_path):
+        return {'Error': f'Predict model path does not exist: {pred_model.job_path}'}
+
+    # Validate each row, and keep the errors in the request order
+    results = [None] * len(rows)
+    valid_index, request_data = [], []
+    for i, data in enumerate(rows):
+        try:
+            if not isinstance(data, dict):
+                raise ValueError('expect a JSON object')
+            fill_request_features(pred_model, data)
+            request_data.append(get_predict_features(pred_model, data))
+            valid_index.append(i)
+        except FeatureNotFoundException as e:
+            results[i] = {'Error': str(e)}
+        except (TypeError, ValueError, OverflowError) as e:
+            results[i] = {'Error': f'Invalid request data: {e}'}
+
+    predict_type = pred_model.predict_type.lower()
+    if len(request_data) > 0:
+        # Make predictions over the whole matrix at once
+        request_data = np.array(request_data, dtype=np.float64)
+        try:
+            if predict_cache.enabled:
+                y_pred = predict_cache.predict(pred_model.job_path, request_data, predict_model_joblib)
+            else:
+                y_pred = predict_model_joblib(pred_model.job_path, request_data)
+        except ValueError as e:
+            return {'Error': f'Invalid request data: {e}'}
+        if y_pred is None:
+            return {'Error': f'Predict model does not work.'}
+
+        for i, value in zip(valid_index, y_pred):
+            results[i] = {predict_type: value}
+            if rows[i].get('features_date') is not None:
+                results[i]['features_date'] = rows[i]['features_date']
+
+    return results
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The benchmarks export the forest arrays with the exporter of the ETL, from the stock_etl directory next to stock_api
+STOCK_ETL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'stock_etl')
+if STOCK_ETL_PATH not in sys.path:
+    sys.path.append(STOCK_ETL_PATH)
@@ -0,0 +1,86 @@
+"""
+Benchmark the compiled forest engine against the sklearn RandomForestRegressor.predict.
+
+Run from the stock_api directory:
+    python -m benchmarks.bench_forest_engine [--model path/to/model.joblib]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import joblib
+import numpy as np
+
+from api.forest_engine import CompiledForest
+from etl.forest_arrays import export_forest_arrays
+
+
+def build_sample_forest(n_estimators, n_samples, random_state):
+    """Train a forest on synthetic volume features, similar to the ETL Volume model"""
+    from sklearn.ensemble import RandomForestRegressor
+
+    rng = np.random.default_rng(random_state)
+    X = np.column_stack([rng.lognormal(12, 2, n_samples), rng.lognormal(3, 1, n_samples)])
+    y = X[:, 0] * rng.normal(1, 0.2, n_samples)
+    return RandomForestRegressor(n_estimators=n_estimators, random_state=random_state).fit(X, y)
+
+
+def time_single_rows(predict, X, repeat):
+    """Median latency of one row predictions in microseconds"""
+    latency = []
+    for i in range(repeat):
+        row = X[i % len(X)][np.newaxis, :]
+        start_time = time.perf_counter()
+        predict(row)
+        latency.append(time.perf_counter() - start_time)
+    return float(np.median(latency) * 1e6)
+
+
+def time_batch(predict, X):
+    """Throughput of one batch prediction in rows per second"""
+    start_time = time.perf_counter()
+    predict(X)
+    return X.shape[0] / (time.perf_counter() - start_time)
+
+
+def main(model_path=None, n_estimators=40, n_samples=100000, n_rows=10000, repeat=1000, random_state=188):
+    if model_path is None:
+        forest = build_sample_forest(n_estimators, n_samples, random_state)
+    else:
+        forest = joblib.load(model_path)
+
+    # Export the forest arrays as the ETL does, and load them as the API does
+    with tempfile.TemporaryDirectory(prefix='bench_forest_engine_') as forest_dir:
+        forest_path = os.path.join(forest_dir, 'Model_Forest.joblib')
+        export_forest_arrays(forest, forest_path)
+        compiled = CompiledForest.load(forest_path)
+    rng = np.random.default_rng(random_state + 1)
+    X = np.column_stack([rng.lognormal(12, 2, n_rows), rng.lognormal(3, 1, n_rows), rng.uniform(0, 0.1, n_rows)])
+    X = X[:, :forest.n_features_in_]
+
+    result = {
+        'model': model_path or 'synthetic',
+        'trees': len(compiled.roots),
+        'nodes': len(compiled.value),
+        'max_depth': compiled.max_depth,
+        'bit_equal': bool(np.array_equal(forest.predict(X), compiled.predict(X))),
+        'sklearn_row_latency_us': time_single_rows(forest.predict, X, repeat),
+        'compiled_row_latency_us': time_single_rows(compiled.predict, X, repeat),
+        'sklearn_batch_rows_per_sec': time_batch(forest.predict, X),
+        'compiled_batch_rows_per_sec': time_batch(compiled.predict, X),
+    }
+    result['row_speedup'] = result['sklearn_row_latency_us'] / result['compiled_row_latency_us']
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == '__main__':
+    cli_parser = argparse.ArgumentParser(description='Benchmark the compiled forest engine')
+    cli_parser.add_argument('--model', dest='model_path', default=None,
+                            help='path to a joblib RandomForestRegressor, or train a synthetic one')
+    cli_parser.add_argument('--rows', dest='n_rows', type=int, default=10000, help='number of rows to predict')
+    cli_parser.add_argument('--repeat', dest='repeat', type=int, default=1000, help='number of single row predictions')
+    args = cli_parser.parse_args()
+    main(model_path=args.model_path, n_rows=args.n_rows, repeat=args.repeat)
@@ -0,0 +1,193 @@
+"""
+Load test the predict endpoints in this process with the Django test client.
+
+The predictors of the fixture serve the joblib models of `--models`, such as the `output_model` of the stock_etl
+`bench_etl_steps`, or synthetic forests trained into a temporary directory. With the staging data of `--features`,
+the requests look up the features of random symbols from the feature store, otherwise they carry random features.
+The requests run from `--concurrency` threads over a test database, and the benchmark reports the throughput, the
+latency percentiles and the peak RSS. Run from the stock_api directory, with the environment of manage.py:
+    python -m benchmarks.bench_predict_api [--requests 2000] [--concurrency 4] [--batch 0] [--models DIR]
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+import joblib
+import numpy as np
+
+# Number of the features of the predict types
+PREDICT_FEATURES = {'Volume': 2, 'Price': 3}
+
+
+def build_sample_models(model_dir, pred_models, n_estimators, random_state):
+    """Train a synthetic forest for each predictor, and export its compiled forest next to it"""
+    from sklearn.ensemble import RandomForestRegressor
+    from api.forest_engine import get_compiled_forest_path
+    from etl.forest_arrays import export_forest_arrays
+
+    rng = np.random.default_rng(random_state)
+    for pred_model in pred_models:
+        X = get_random_features(rng, 5000)[:, :PREDICT_FEATURES[pred_model.predict_type]]
+        y = X[:, 0] * rng.normal(1, 0.2, len(X)) if pred_model.predict_type == 'Volume' else X[:, 1] * 1.01
+        forest = RandomForestRegressor(n_estimators=n_estimators, random_state=random_state).fit(X, y)
+        model_path = os.path.join(model_dir, f'{pred_model.name}.joblib')
+        joblib.dump(forest, model_path)
+        export_forest_arrays(forest, get_compiled_forest_path(model_path))
+
+
+def get_random_features(rng, n_rows):
+    """Random vol_moving_avg, price_rolling_med and price_daily_std rows"""
+    return np.column_stack([
+        np.round(rng.lognormal(12, 2, n_rows)), rng.lognormal(3, 1, n_rows), rng.uniform(0, 0.1, n_rows)
+    ])
+
+
+def get_symbols(pred_models):
+    """Symbols of the staging data of each predictor in the feature store"""
+    from api.feature_store import feature_store
+
+    symbols = {}
+    for pred_model in pred_models:
+        stage_data_path = feature_store.get_stage_data_path(pred_model)
+        if os.path.exists(stage_data_path):
+            symbols[pred_model.id] = sorted(feature_store.get_index(stage_data_path).symbols)
+    return symbols
+
+
+def get_request_rows(rng, pred_model, symbols, n_rows):
+    """Request rows of random symbols of the predictor, or of random features without the staging data"""
+    if pred_model.id in symbols:
+        return [{'symbol': i} for i in rng.choice(symbols[pred_model.id], n_rows)]
+
+    columns = ['vol_moving_avg', 'price_rolling_med', 'price_daily_std']
+    return [dict(zip(columns, i)) for i in get_random_features(rng, n_rows).tolist()]
+
+
+def get_requests(rng, pred_models, symbols, n_requests, batch_size):
+    """URL and JSON body of each request, over the predictors at random"""
+    requests = []
+    for pred_model in rng.choice(pred_models, n_requests):
+        url = f'/api/predict/{pred_model.stock_type}/{pred_model.predict_type}/'
+        if batch_size > 0:
+            requests.append((f'{url}batch/', get_request_rows(rng, pred_model, symbols, batch_size)))
+        else:
+            requests.append((url, get_request_rows(rng, pred_model, symbols, 1)[0]))
+    return requests
+
+
+def send_requests(requests):
+    """Send the requests one after another from one test client, and their latency and status codes"""
+    from django.db import connection
+    from django.test import Client
+
+    client = Client()
+    latency, status = [], []
+    try:
+        for url, body in requests:
+            start_time = time.perf_counter()
+            response = client.post(url, data=json.dumps(body), content_type='application/json')
+            latency.append(time.perf_counter() - start_time)
+            status.append(response.status_code)
+    finally:
+        connection.close()
+    return latency, status
+
+
+def run_load(requests, concurrency):
+    """Send the requests from `concurrency` clients, and the wall time, latency and status codes"""
+    shares = [requests[i::concurrency] for i in range(concurrency)]
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send_requests, shares))
+    wall_sec = time.perf_counter() - start_time
+    return wall_sec, np.concatenate([i[0] for i in results]), np.concatenate([i[1] for i in results])
+
+
+def main(model_dir=None, features_path=None, n_requests=2000, concurrency=4, batch_size=0, warmup=20,
+         n_estimators=40, random_state=188, verbose=False):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stock_api.settings')
+    django.setup()
+    if verbose:
+        # The views log each request at the debug level
+        logging.basicConfig()
+        logging.getLogger('api').setLevel(logging.DEBUG)
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from api.feature_store import feature_store
+    from api.models import StockPredictorModel
+    from api.predict_hist import predict_hist_writer
+
+    setup_test_environment()
+    # The migrations of the test database load the predictors of the fixture
+    test_db_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        pred_models = list(StockPredictorModel.objects.order_by('id'))
+        if model_dir is None:
+            model_dir = tempfile.mkdtemp(prefix='bench_predict_api_')
+            build_sample_models(model_dir, pred_models, n_estimators, random_state)
+        for pred_model in pred_models:
+            pred_model.job_path = os.path.join(model_dir, f'{pred_model.name}.joblib')
+            pred_model.save()
+
+        if features_path is not None:
+            feature_store.data_path = features_path
+        symbols = get_symbols(pred_models) if features_path is not None else {}
+
+        rng = np.random.default_rng(random_state)
+        warmup_requests = [j for i in pred_models for j in get_requests(rng, [i], symbols, warmup, batch_size)]
+        requests = get_requests(rng, pred_models, symbols, n_requests, batch_size)
+
+        run_load(warmup_requests, concurrency)
+        wall_sec, latency, status = run_load(requests, concurrency)
+        predict_hist_writer.flush()
+    finally:
+        connection.creation.destroy_test_db(test_db_name, verbosity=0)
+        teardown_test_environment()
+
+    latency_ms = latency * 1000
+    rows = n_requests * max(batch_size, 1)
+    result = {
+        'models': model_dir, 'features': features_path, 'engine': settings.PREDICT_ENGINE,
+        'async_views': settings.PREDICT_ASYNC_VIEWS, 'requests': n_requests, 'concurrency': concurrency,
+        'batch': batch_size, 'symbols': sum(len(i) for i in symbols.values()),
+        'status': {str(k): int(v) for k, v in zip(*np.unique(status, return_counts=True))},
+        'wall_sec': wall_sec, 'requests_per_sec': n_requests / wall_sec, 'rows_per_sec': rows / wall_sec,
+        'latency_ms': {
+            'mean': float(latency_ms.mean()), 'p50': float(np.percentile(latency_ms, 50)),
+            'p90': float(np.percentile(latency_ms, 90)), 'p99': float(np.percentile(latency_ms, 99)),
+            'max': float(latency_ms.max()),
+        },
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == '__main__':
+    cli_parser = argparse.ArgumentParser(description='Load test the predict endpoints with the Django test client')
+    cli_parser.add_argument('--models', dest='model_dir', default=None,
+                            help='directory of the predictor joblib models, or train synthetic ones')
+    cli_parser.add_argument('--features', dest='features_path', default=None,
+                            help='directory of the Step 2 staging data to request the features of the symbols')
+    cli_parser.add_argument('--requests', dest='n_requests', type=int, default=2000, help='number of timed requests')
+    cli_parser.add_argument('--concurrency', dest='concurrency', type=int, default=4, help='number of client threads')
+    cli_parser.add_argument('--batch', dest='batch_size', type=int, default=0,
+                            help='rows of each batch request, or single row requests with 0')
+    cli_parser.add_argument('--warmup', dest='warmup', type=int, default=20, help='untimed requests of each predictor')
+    cli_parser.add_argument('--verbose', dest='verbose', action='store_true', help='log the requests of the views')
+    cli_parser.add_argument('--output', dest='result_path', default=None, help='also write the JSON result here')
+    args = cli_parser.parse_args()
+    bench_result = main(args.model_dir, args.features_path, args.n_requests, args.concurrency, args.batch_size,
+                        args.warmup, verbose=args.verbose)
+    if args.result_path is not None:
+        with open(args.result_path, 'w') as result_fp:
+            json.dump(bench_result, result_fp, indent=2)
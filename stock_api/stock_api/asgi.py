@@ -12,5 +12,15 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stock_api.settings')
+# The settings default to the async views in the ASGI application, unless PREDICT_ASYNC_VIEWS is set
+os.environ['DJANGO_ASGI_APPLICATION'] = 'True'
 
 application = get_asgi_application()
+
+# Load the staging features at startup, only when the deployment opts in
+from django.conf import settings  # noqa: E402
+
+if settings.FEATURE_STORE_PRELOAD:
+    from api.feature_store import feature_store
+
+    feature_store.preload()
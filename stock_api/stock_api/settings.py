@@ -27,6 +27,28 @@ env = environ.Env(
     POSTGRES_USER=(str, 'user'),
     POSTGRES_PASSWORD=(str, 'password'),
     POSTGRES_PORT=(str, '5432'),
+    PREDICT_MODEL_CACHE_SIZE=(int, 8),
+    PREDICT_BATCH_MAX_ROWS=(int, 10000),
+    PREDICT_HIST_ASYNC=(bool, True),
+    PREDICT_HIST_BATCH_SIZE=(int, 500),
+    PREDICT_HIST_FLUSH_INTERVAL=(float, 1.0),
+    PREDICT_HIST_QUEUE_SIZE=(int, 10000),
+    PREDICTOR_INDEX_TTL=(int, 300),
+    # The ASGI application marks its process, where the async views are the default
+    PREDICT_ASYNC_VIEWS=(bool, os.environ.get('DJANGO_ASGI_APPLICATION') == 'True'),
+    PREDICT_WORKERS=(int, min(4, os.cpu_count() or 1)),
+    PREDICT_BATCH_WINDOW_MS=(float, 0),
+    PREDICT_BATCH_MAX_SIZE=(int, 64),
+    PREDICT_ENGINE=(str, 'sklearn'),
+    PREDICT_MODEL_MMAP=(bool, True),
+    FEATURE_STORE_PATH=(str, 'private_assets/stock_data/output_data'),
+    FEATURE_STORE_REFRESH_INTERVAL=(int, 60),
+    FEATURE_STORE_PRELOAD=(bool, False),
+    CACHE_URL=(str, 'locmemcache://'),
+    PREDICT_CACHE_SIZE=(int, 0),
+    PREDICT_CACHE_PRECISION=(int, 12),
+    PREDICT_CACHE_BACKEND=(str, ''),
+    PREDICT_CACHE_TIMEOUT=(int, 3600),
 )
 
 # Load the environment configures
@@ -49,7 +71,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'api',
+    'api.apps.ApiConfig',
     'rest_framework',
 ]
 
@@ -96,6 +118,12 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+CACHES = {
+    'default': env.cache('CACHE_URL'),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -151,3 +179,51 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
     ],
 }
+
+# Maximum number of the regression models kept loaded per process
+PREDICT_MODEL_CACHE_SIZE = env('PREDICT_MODEL_CACHE_SIZE')
+
+# Maximum number of rows in one batch prediction request
+PREDICT_BATCH_MAX_ROWS = env('PREDICT_BATCH_MAX_ROWS')
+
+# Buffer the prediction history rows, and insert them with bulk_create from a background writer.
+# Set PREDICT_HIST_ASYNC=False to write the rows synchronously within the request.
+PREDICT_HIST_ASYNC = env('PREDICT_HIST_ASYNC')
+PREDICT_HIST_BATCH_SIZE = env('PREDICT_HIST_BATCH_SIZE')
+PREDICT_HIST_FLUSH_INTERVAL = env('PREDICT_HIST_FLUSH_INTERVAL')
+PREDICT_HIST_QUEUE_SIZE = env('PREDICT_HIST_QUEUE_SIZE')
+
+# Seconds before the in-memory stock predictor index is reloaded, 0 to reload on changes of this process only
+PREDICTOR_INDEX_TTL = env('PREDICTOR_INDEX_TTL')
+
+# Serve the predictions with the async views, and run the model inference in a pool of PREDICT_WORKERS threads.
+# The ASGI application enables the async views by default, and PREDICT_ASYNC_VIEWS=False in .env still disables them.
+PREDICT_ASYNC_VIEWS = env('PREDICT_ASYNC_VIEWS')
+PREDICT_WORKERS = env('PREDICT_WORKERS')
+
+# Coalesce the concurrent single row predictions of a model within PREDICT_BATCH_WINDOW_MS milliseconds,
+# or up to PREDICT_BATCH_MAX_SIZE rows, into one predict call. The batching is disabled with a zero window.
+PREDICT_BATCH_WINDOW_MS = env('PREDICT_BATCH_WINDOW_MS')
+PREDICT_BATCH_MAX_SIZE = env('PREDICT_BATCH_MAX_SIZE')
+
+# Inference engine of the regression models: 'sklearn' (default) always uses the joblib model, the opt-in 'compiled'
+# uses the compiled forest arrays exported next to the joblib model when they exist
+PREDICT_ENGINE = env('PREDICT_ENGINE')
+
+# Memory-map the compiled forest arrays read-only with the compiled engine, so all the worker processes on a host share
+# one copy
+PREDICT_MODEL_MMAP = env('PREDICT_MODEL_MMAP')
+
+# Step 2 staging data of the ETL, to look up the request features by symbol and date
+FEATURE_STORE_PATH = env('FEATURE_STORE_PATH')
+FEATURE_STORE_REFRESH_INTERVAL = env('FEATURE_STORE_REFRESH_INTERVAL')
+# Load all the staging data when the worker starts, otherwise that of a predictor on its first symbol request
+FEATURE_STORE_PRELOAD = env('FEATURE_STORE_PRELOAD')
+
+# Cache up to PREDICT_CACHE_SIZE prediction results per process, keyed by the model file version and the features
+# rounded to PREDICT_CACHE_PRECISION significant digits. The results are also shared through the Django cache alias
+# PREDICT_CACHE_BACKEND (e.g. 'default') if set. The cache is disabled with a zero size.
+PREDICT_CACHE_SIZE = env('PREDICT_CACHE_SIZE')
+PREDICT_CACHE_PRECISION = env('PREDICT_CACHE_PRECISION')
+PREDICT_CACHE_BACKEND = env('PREDICT_CACHE_BACKEND')
+PREDICT_CACHE_TIMEOUT = env('PREDICT_CACHE_TIMEOUT')
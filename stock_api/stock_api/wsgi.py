@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stock_api.settings')
 
 application = get_wsgi_application()
+
+# Load the staging features at startup, only when the deployment opts in
+from django.conf import settings  # noqa: E402
+
+if settings.FEATURE_STORE_PRELOAD:
+    from api.feature_store import feature_store
+
+    feature_store.preload()
@@ -0,0 +1,126 @@
+"""
+Benchmark Step 1, Step 2 and Step 3 of the ETL pipeline separately, over synthetic market data at a given scale.
+
+The steps run through the `etl_task` pipeline of each dataset, with the engine, output layout and predictors of the
+stock config, over the data of `benchmarks.synthetic_data` generated into the output directory. Each step reports its
+wall time, the rows and bytes of its outputs, its rows per second, and the peak RSS of this process, of the worker
+processes and of the Spark JVM, the largest of its datasets in the run report. Run from the stock_etl directory:
+    python -m benchmarks.bench_etl_steps [--stocks 100] [--etfs 20] [--years 5] [--engine pandas] [--output bench.json]
+
+The models and the staging data of the output directory serve the `stock_api` predict benchmark.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks import synthetic_data
+from etl.run_report import RunReport, get_run_report_path, get_data_stats
+from etl.spark.session import start_spark
+from etl_task import run_pipeline, get_engine, get_step_manifest
+
+ETL_STEPS = ['Step1', 'Step2', 'Step3']
+
+
+def read_step_records(run_report, step):
+    """Records of the step of all the datasets in the run report of this run"""
+    with open(run_report.path) as fp:
+        records = [json.loads(i) for i in fp]
+    return [i for i in records if i['run_id'] == run_report.run_id and i.get('step') == step]
+
+
+def get_max(records, name):
+    return max((i[name] for i in records if i.get(name) is not None), default=None)
+
+
+def run_step(spark, stock_config, step, rows_in, output_data, output_model, run_report):
+    """Run one step of all the datasets, and its timing, outputs and the peak memory of its datasets"""
+    step_config = dict(stock_config, ETL_Steps=[step])
+    start_time = time.perf_counter()
+    for stock_type, stock_csv in stock_config['Stock_Data'].items():
+        run_pipeline(spark, step_config, stock_type, stock_csv, output_data, output_model, run_report=run_report)
+    step_sec = time.perf_counter() - start_time
+
+    outputs = [
+        j for stock_type, stock_csv in stock_config['Stock_Data'].items()
+        for j in get_step_manifest(stock_config, step, stock_type, stock_csv, output_data, output_model).outputs
+    ]
+    rows_out, bytes_out = get_data_stats(outputs)
+    records = read_step_records(run_report, step)
+    return {
+        'sec': step_sec, 'rows_in': rows_in, 'rows_out': rows_out, 'bytes_out': bytes_out,
+        'rows_per_sec': rows_in / step_sec,
+        'peak_rss_mb': get_max(records, 'peak_rss_mb'),
+        'children_peak_rss_mb': get_max(records, 'children_peak_rss_mb'),
+        'jvm_peak_rss_mb': get_max(records, 'jvm_peak_rss_mb'),
+    }
+
+
+def main(stock_config, num_stocks=100, num_etfs=20, years=5, seed=188, steps=None, output_path=None):
+    output_path = output_path or tempfile.mkdtemp(prefix='bench_etl_steps_')
+    output_data, output_model = [os.path.join(output_path, i) for i in ['output_data', 'output_model']]
+    for i in [output_data, output_model]:
+        os.makedirs(i, exist_ok=True)
+
+    data = synthetic_data.main(os.path.join(output_path, 'input'), num_stocks, num_etfs, years, seed=seed)
+    stock_config = dict(stock_config, Stock_Data=data['stock_data'], Stock_Desc=data['stock_desc'],
+                        Incremental=False, Skip_Unchanged=False)
+    steps = steps or ETL_STEPS
+    result = {
+        'output': output_path, 'engine': get_engine(stock_config),
+        'data': {i: data[i] for i in ['symbols', 'years', 'start_date', 'end_date', 'seed', 'rows', 'bytes']},
+        'config': {i: stock_config.get(i) for i in ['Start_Date', 'End_Date', 'Feature_Engine', 'Output_Layout',
+                                                    'Compression', 'Workers', 'Train_Memory_MB', 'CPU_Budget']},
+        'steps': {},
+    }
+
+    spark = None
+    if result['engine'] == 'spark' and any(i in steps for i in ['Step1', 'Step2']):
+        start_time = time.perf_counter()
+        spark = start_spark('BenchETLSteps', {'spark.master': 'local[*]'})
+        result['spark_startup_sec'] = time.perf_counter() - start_time
+
+    # The peak memory of each dataset is measured by the run report of the steps
+    run_report = RunReport(get_run_report_path(output_data, stock_config['Model_Name']))
+    try:
+        rows_in = data['rows']
+        for step in ETL_STEPS:
+            if step in steps:
+                result['steps'][step] = run_step(
+                    spark, stock_config, step, rows_in, output_data, output_model, run_report
+                )
+                rows_in = result['steps'][step]['rows_out'] or rows_in
+    finally:
+        if spark is not None:
+            spark.stop()
+
+    result['total_sec'] = sum(i['sec'] for i in result['steps'].values())
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == '__main__':
+    cli_parser = argparse.ArgumentParser(description='Benchmark the ETL steps over synthetic market data')
+    cli_parser.add_argument('--stock-config', dest='stock_config', type=argparse.FileType('r'),
+                            default='stock_data/input/stock-config.json', help='stock config of the steps')
+    cli_parser.add_argument('--stocks', dest='num_stocks', type=int, default=100, help='number of stock symbols')
+    cli_parser.add_argument('--etfs', dest='num_etfs', type=int, default=20, help='number of ETF symbols')
+    cli_parser.add_argument('--years', dest='years', type=float, default=5, help='years of business days per symbol')
+    cli_parser.add_argument('--seed', dest='seed', type=int, default=188, help='random seed of the synthetic data')
+    cli_parser.add_argument('--start', dest='start_date', default=None, help='Start_Date of the steps, all by default')
+    cli_parser.add_argument('--engine', dest='engine', default=None, help='spark or pandas Engine of Step 1 and 2')
+    cli_parser.add_argument('--steps', dest='steps', default=None, help='comma separated steps, all by default')
+    cli_parser.add_argument('--work', dest='output_path', default=None,
+                            help='directory of the synthetic data and the outputs, a new temporary one by default')
+    cli_parser.add_argument('--output', dest='result_path', default=None, help='also write the JSON result here')
+    args = cli_parser.parse_args()
+
+    bench_config = dict(json.load(args.stock_config), Start_Date=args.start_date, End_Date=None)
+    if args.engine is not None:
+        bench_config['Engine'] = args.engine
+    bench_result = main(bench_config, args.num_stocks, args.num_etfs, args.years, args.seed,
+                        args.steps.split(',') if args.steps else None, args.output_path)
+    if args.result_path is not None:
+        with open(args.result_path, 'w') as result_fp:
+            json.dump(bench_result, result_fp, indent=2)
@@ -0,0 +1,101 @@
+"""
+Benchmark the two backends of the feature registry, the Spark window expressions against the NumPy kernels.
+
+Both backends compute the same feature specs over the Step 1 output. The rolling median of Spark is approximate,
+so its differences are reported apart from the other features. Run from the stock_etl directory:
+    python -m benchmarks.bench_feature_registry [--data stock_data/output_data/StockPredict_v1_2019-Stock_IngestData]
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyspark.sql.functions as F
+
+from benchmarks.spark_timing import time_noop_write
+from etl.features import get_features, get_sources, compute_features
+from etl.spark.features import with_features
+from etl.spark.session import start_spark
+
+# Features which the Spark backend computes with an approximate aggregate
+APPROX_FEATURES = ['adj_close_rolling_med']
+
+
+def time_spark(df_daily, features, repeat):
+    return time_noop_write(lambda: with_features(df_daily, features), repeat)
+
+
+def time_numpy(pdf, features, repeat):
+    """Compute the features per symbol over the contiguous arrays of its rows, and the best run time"""
+    symbols = []
+    for _, df_symbol in pdf.groupby('Symbol', sort=True):
+        columns = {i: df_symbol[i].to_numpy(dtype=np.float64, na_value=np.nan) for i in get_sources(features)}
+        symbols.append((columns, df_symbol['TimeStamp'].to_numpy()))
+
+    timing, results = [], None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        results = [compute_features(columns, timestamps, features) for columns, timestamps in symbols]
+        timing.append(time.perf_counter() - start_time)
+    return min(timing), {i.name: np.concatenate([j[i.name] for j in results]) for i in features}
+
+
+def compare_feature(spark_values, numpy_values, rtol=1e-9):
+    """Number of the different rows, and the max relative difference of the numeric features"""
+    if spark_values.dtype.kind not in 'fi':
+        spark_values = spark_values.to_numpy(dtype=object)
+        equal = (spark_values == numpy_values) | (pd.isna(spark_values) & pd.isna(numpy_values))
+        return int((~equal).sum()), None
+
+    spark_values = spark_values.to_numpy(dtype=np.float64, na_value=np.nan)
+    numpy_values = numpy_values.astype(np.float64)
+    equal = np.isclose(spark_values, numpy_values, rtol=rtol, atol=0, equal_nan=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rel_diff = np.abs(spark_values - numpy_values) / np.abs(spark_values)
+    max_rel_diff = float(np.nanmax(rel_diff[~equal])) if (~equal).any() else 0.0
+    return int((~equal).sum()), max_rel_diff
+
+
+def main(data_path, names=None, repeat=3):
+    features = get_features(names)
+    spark = start_spark('BenchFeatureRegistry', {'spark.master': 'local[*]'})
+    try:
+        df_daily = spark.read.parquet(data_path).where(F.col('Date2').isNotNull()) \
+            .withColumn('TimeStamp', F.unix_timestamp('Date2').cast('long'))
+        pdf = with_features(df_daily, features).toPandas()
+        pdf['Symbol'] = pdf['Symbol'].astype(str)
+        pdf = pdf.sort_values(['Symbol', 'TimeStamp'], kind='stable').reset_index(drop=True)
+        spark_sec = time_spark(df_daily, features, repeat)
+    finally:
+        spark.stop()
+
+    numpy_sec, numpy_features = time_numpy(pdf, features, repeat)
+    result = {
+        'input': data_path, 'rows': len(pdf), 'features': [i.name for i in features],
+        'spark_sec': spark_sec, 'numpy_sec': numpy_sec,
+        'spark_rows_per_sec': len(pdf) / spark_sec, 'numpy_rows_per_sec': len(pdf) / numpy_sec,
+        'diff': {}, 'approx_diff': {},
+    }
+    for feature in features:
+        diff_rows, max_rel_diff = compare_feature(pdf[feature.name], numpy_features[feature.name])
+        if diff_rows > 0:
+            diff = 'approx_diff' if feature.name in APPROX_FEATURES else 'diff'
+            result[diff][feature.name] = {'rows': diff_rows, 'max_rel_diff': max_rel_diff}
+
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == '__main__':
+    cli_parser = argparse.ArgumentParser(description='Benchmark the Spark and NumPy backends of the feature registry')
+    cli_parser.add_argument('--data', dest='data_path',
+                            default='stock_data/output_data/StockPredict_v1_2019-Stock_IngestData',
+                            help='Step 1 output parquet')
+    cli_parser.add_argument('--features', dest='names', default=None, help='comma separated feature names')
+    cli_parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='timing runs of each backend')
+    args = cli_parser.parse_args()
+    bench_result = main(args.data_path, args.names.split(',') if args.names else None, args.repeat)
+    if len(bench_result['diff']) > 0:
+        sys.exit(1)
@@ -0,0 +1,95 @@
+"""
+Benchmark and check the parity of the pandas engine of Step 1 and Step 2 against the Spark engine.
+
+The Spark engine runs with the exact pandas feature engine, so both produce the same rolling median.
+Run from the stock_etl directory, next to the stock_data inputs:
+    python -m benchmarks.bench_local_engine [--data stock_data/input/stocks] [--start 2019-01-01]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from etl import step1_ingest_data, step2_extract_features
+from etl.local import step1_ingest_data as local_step1_ingest_data
+from etl.local import step2_extract_features as local_step2_extract_features
+from etl.spark.session import start_spark
+
+
+def read_output(data_path):
+    df = pd.read_parquet(data_path)
+    df['Symbol'] = df['Symbol'].astype(str)
+    return df.sort_values(['Symbol', 'Date']).reset_index(drop=True)
+
+
+def compare_output(spark_path, local_path, rtol=1e-9):
+    """Columns of the local output which differ from the Spark output"""
+    df_spark, df_local = read_output(spark_path), read_output(local_path)
+    if len(df_spark) != len(df_local) or list(df_spark.columns) != list(df_local.columns):
+        return {'rows': [len(df_spark), len(df_local)], 'columns': sorted(set(df_spark) ^ set(df_local))}
+
+    diff = {}
+    for name in df_spark.columns:
+        spark_values, local_values = df_spark[name], df_local[name]
+        if spark_values.dtype.kind in 'fi' and local_values.dtype.kind in 'fi':
+            equal = np.isclose(spark_values.astype(float), local_values.astype(float), rtol=rtol, atol=0, equal_nan=True)
+        else:
+            equal = (spark_values == local_values) | (spark_values.isna() & local_values.isna())
+        if not equal.all():
+            diff[name] = int((~equal).sum())
+    return diff
+
+
+def main(stock_csv, symbol_csv, start_date, end_date, workers=None):
+    output_path = tempfile.mkdtemp(prefix='bench_local_engine_')
+    spark_ingest, spark_staging, local_ingest, local_staging = [
+        os.path.join(output_path, i) for i in ['Spark_IngestData', 'Spark_StageData', 'Local_IngestData',
+                                               'Local_StageData']
+    ]
+    result = {'input': stock_csv, 'output': output_path}
+
+    start_time = time.perf_counter()
+    spark = start_spark('BenchLocalEngine', {'spark.master': 'local[*]'})
+    try:
+        result['spark_startup_sec'] = time.perf_counter() - start_time
+        step1_ingest_data.main(spark, stock_csv, symbol_csv, start_date, end_date, spark_ingest)
+        result['spark_step1_sec'] = time.perf_counter() - start_time - result['spark_startup_sec']
+        step2_start_time = time.perf_counter()
+        step2_extract_features.main(spark, spark_ingest, spark_staging, start_date, end_date, feature_engine='pandas')
+        result['spark_step2_sec'] = time.perf_counter() - step2_start_time
+    finally:
+        spark.stop()
+    result['spark_sec'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    local_step1_ingest_data.main(stock_csv, symbol_csv, start_date, end_date, local_ingest, workers)
+    result['pandas_step1_sec'] = time.perf_counter() - start_time
+    step2_start_time = time.perf_counter()
+    local_step2_extract_features.main(local_ingest, local_staging, start_date, end_date, workers)
+    result['pandas_step2_sec'] = time.perf_counter() - step2_start_time
+    result['pandas_sec'] = time.perf_counter() - start_time
+    result['speedup'] = result['spark_sec'] / result['pandas_sec']
+
+    result['ingest_diff'] = compare_output(spark_ingest, local_ingest)
+    result['staging_diff'] = compare_output(spark_staging, local_staging)
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == '__main__':
+    cli_parser = argparse.ArgumentParser(description='Benchmark the pandas engine against the Spark engine')
+    cli_parser.add_argument('--data', dest='stock_csv', default='stock_data/input/stocks', help='stock CSV directory')
+    cli_parser.add_argument('--symbols', dest='symbol_csv', default='stock_data/input/symbols_valid_meta.csv',
+                            help='symbol metadata CSV')
+    cli_parser.add_argument('--start', dest='start_date', default='2019-01-01', help='start date')
+    cli_parser.add_argument('--end', dest='end_date', default=None, help='end date')
+    cli_parser.add_argument('--workers', dest='workers', type=int, default=None, help='pandas worker processes')
+    args = cli_parser.parse_args()
+    bench_result = main(args.stock_csv, args.symbol_csv, args.start_date, args.end_date, args.workers)
+    if len(bench_result['ingest_diff']) > 0 or len(bench_result['staging_diff']) > 0:
+        sys.exit(1)
@@ -0,0 +1,71 @@
+"""
+Benchmark the Step 2 rolling features of the Spark window expressions against the exact pandas engine.
+
+Run from the stock_etl directory on the Step 1 output:
+    python -m benchmarks.bench_rolling_median [--data stock_data/output_data/StockPredict_v1_2019-Stock_IngestData]
+"""
+import argparse
+import json
+
+import numpy as np
+
+from benchmarks.spark_timing import time_noop_write
+from etl.rolling import WINDOW_30_DAYS
+from etl.spark.session import start_spark
+from etl.step2_extract_features import extract_features, ROLLING_FEATURES
+
+
+def time_features(spark, data_path, feature_engine, repeat):
+    return time_noop_write(lambda: extract_features(spark.read.parquet(data_path), feature_engine), repeat)
+
+
+def get_exact_median(pdf):
+    """Brute force median of the 30 days window of each row"""
+    medians = []
+    for symbol, df_symbol in pdf.groupby('Symbol'):
+        timestamps = df_symbol['TimeStamp'].to_numpy()
+        values = df_symbol['Adj Close'].to_numpy(dtype=np.float64)
+        for i in timestamps:
+            window = values[(timestamps >= i - WINDOW_30_DAYS) & (timestamps <= i)]
+            medians.append(np.nanmedian(window))
+    return np.asarray(medians)
+
+
+def main(data_path, repeat=3):
+    spark = start_spark('BenchRollingMedian', {'spark.master': 'local[*]'})
+    try:
+        features = {}
+        for feature_engine in ['window', 'pandas']:
+            df_out = extract_features(spark.read.parquet(data_path), feature_engine)
+            features[feature_engine] = df_out.select(['Symbol', 'TimeStamp', 'Adj Close'] + ROLLING_FEATURES) \
+                .toPandas().sort_values(['Symbol', 'TimeStamp'], kind='stable').reset_index(drop=True)
+
+        exact_median = get_exact_median(features['pandas'])
+        result = {'input': data_path, 'rows': len(exact_median)}
+        for feature_engine, pdf in features.items():
+            median_error = np.abs(pdf['adj_close_rolling_med'].to_numpy(dtype=np.float64) - exact_median)
+            result[f'{feature_engine}_median_max_error'] = float(np.nanmax(median_error))
+            result[f'{feature_engine}_median_inexact_rows'] = int((median_error > 0).sum())
+
+        for name in ['vol_moving_avg', 'adj_close_daily_std']:
+            window, pandas = [features[i][name].to_numpy(dtype=np.float64) for i in ['window', 'pandas']]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[f'{name}_max_rel_diff'] = float(np.nanmax(np.abs(window - pandas) / np.abs(window)))
+
+        result['window_sec'] = time_features(spark, data_path, 'window', repeat)
+        result['pandas_sec'] = time_features(spark, data_path, 'pandas', repeat)
+        result['speedup'] = result['window_sec'] / result['pandas_sec']
+        print(json.dumps(result, indent=2))
+        return result
+    finally:
+        spark.stop()
+
+
+if __name__ == '__main__':
+    cli_parser = argparse.ArgumentParser(description='Benchmark the rolling features of the Step 2 feature engines')
+    cli_parser.add_argument('--data', dest='data_path',
+                            default='stock_data/output_data/StockPredict_v1_2019-Stock_IngestData',
+                            help='Step 1 ingested parquet')
+    cli_parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='number of timed runs')
+    args = cli_parser.parse_args()
+    main(args.data_path, args.repeat)
@@ -0,0 +1,68 @@
+"""
+Benchmark the Python UDFs of Step 1 and Step 2 against the native Spark column expressions.
+
+Run from the stock_etl directory, next to the stock_data inputs:
+    python -m benchmarks.bench_spark_udf [--data stock_data/input/stocks stock_data/input/etfs]
+"""
+import argparse
+import json
+
+import pyspark.sql.functions as F
+from pyspark.sql.window import Window
+
+from benchmarks.spark_timing import time_noop_write
+from etl.spark import expressions, udf
+from etl.spark.session import start_spark
+from etl.step1_ingest_data import get_csv_schema
+
+
+def build_features(df_daily, get_symbol_filename, get_number_sign, get_market_trend):
+    """The symbol, trend flags and market trend columns of Step 1 and Step 2"""
+    symbol_partition = Window.partitionBy('Symbol').orderBy('Date')
+    return df_daily.withColumn('Symbol', get_symbol_filename(F.input_file_name())) \
+        .withColumn('adj_close_return', F.col('Adj Close') / F.lag('Adj Close').over(symbol_partition) - F.lit(1)) \
+        .withColumn('adj_close_trend_flag', get_number_sign(F.col('adj_close_return'))) \
+        .withColumn('vol_trend_flag', get_number_sign(F.col('Volume') - F.lag('Volume').over(symbol_partition))) \
+        .withColumn('market_trend', get_market_trend(F.col('adj_close_trend_flag'), F.col('vol_trend_flag')))
+
+
+def time_features(spark, stock_csv, functions, repeat):
+    return time_noop_write(
+        lambda: build_features(spark.read.csv(stock_csv, schema=get_csv_schema(), sep=',', header=True), *functions),
+        repeat)
+
+
+def main(stock_csv, repeat=3):
+    spark = start_spark('BenchSparkUDF', {'spark.master': 'local[*]'})
+    try:
+        python_udf = (udf.get_symbol_filename_udf, udf.get_number_sign_udf, udf.get_market_trend_udf)
+        native = (expressions.get_symbol_filename, expressions.get_number_sign, expressions.get_market_trend)
+
+        # Check both produce the same columns before timing them
+        df_daily = spark.read.csv(stock_csv, schema=get_csv_schema(), sep=',', header=True)
+        df_udf = build_features(df_daily, *python_udf)
+        df_native = build_features(df_daily, *native)
+        num_diff = df_udf.exceptAll(df_native).count() + df_native.exceptAll(df_udf).count()
+
+        result = {
+            'input': stock_csv,
+            'rows': df_daily.count(),
+            'different_rows': num_diff,
+            'python_udf_sec': time_features(spark, stock_csv, python_udf, repeat),
+            'native_sec': time_features(spark, stock_csv, native, repeat),
+        }
+        result['speedup'] = result['python_udf_sec'] / result['native_sec']
+        print(json.dumps(result, indent=2))
+        return result
+    finally:
+        spark.stop()
+
+
+if __name__ == '__main__':
+    cli_parser = argparse.ArgumentParser(description='Benchmark the Python UDFs against the native Spark expressions')
+    cli_parser.add_argument('--data', dest='stock_csv', nargs='+',
+                            default=['stock_data/input/stocks', 'stock_data/input/etfs'],
+                            help='stock CSV directories')
+    cli_parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='number of timed runs')
+    args = cli_parser.parse_args()
+    main(args.stock_csv, args.repeat)
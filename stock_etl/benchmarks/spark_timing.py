@@ -0,0 +1,20 @@
+"""
+Timing of the Spark benchmarks, shared by the benchmarks which compare two ways of computing the same columns.
+"""
+import time
+
+
+def time_noop_write(build_output, repeat):
+    """
+    Best run time in seconds of the output DataFrame over `repeat` runs.
+
+    `build_output` builds a new output DataFrame for each run, so no run reuses the plan of another one. The noop
+    sink evaluates all the columns without writing any output, so only the computation of the columns is timed.
+    """
+    timing = []
+    for _ in range(repeat):
+        df_out = build_output()
+        start_time = time.perf_counter()
+        df_out.write.format('noop').mode('overwrite').save()
+        timing.append(time.perf_counter() - start_time)
+    return min(timing)
@@ -0,0 +1,110 @@
+"""
+Generate synthetic daily market data with the schema of the stock_data inputs, at a configurable scale.
+
+Each symbol is a geometric random walk over the business days of the last `years` years, written as a
+`{Symbol}.csv` of Date,Open,High,Low,Close,Adj Close,Volume, with the `symbols_valid_meta.csv` of all the symbols.
+The same seed generates the same files. Run from the stock_etl directory:
+    python -m benchmarks.synthetic_data --output /tmp/synthetic_data [--stocks 100] [--etfs 20] [--years 5]
+"""
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+CSV_COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+META_COLUMNS = ['Nasdaq Traded', 'Symbol', 'Security Name', 'Listing Exchange', 'Market Category', 'ETF',
+                'Round Lot Size', 'Test Issue', 'Financial Status', 'CQS Symbol', 'NASDAQ Symbol', 'NextShares']
+
+TRADING_DAYS = 252
+
+
+def get_symbols(prefix, count):
+    return [f'{prefix}{i:04d}' for i in range(count)]
+
+
+def generate_prices(rng, num_days):
+    """Daily OHLCV of one symbol, a geometric random walk with a random drift, volatility and volume level"""
+    drift = rng.normal(0.08, 0.1) / TRADING_DAYS
+    volatility = rng.uniform(0.15, 0.5) / np.sqrt(TRADING_DAYS)
+    log_returns = rng.normal(drift - volatility ** 2 / 2, volatility, num_days)
+    close = rng.uniform(5, 500) * np.exp(np.cumsum(log_returns))
+
+    # The open gaps from the previous close, and the high and low are beyond both of them
+    previous_close = np.concatenate([[close[0]], close[:-1]])
+    open_ = previous_close * np.exp(rng.normal(0, volatility / 4, num_days))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, volatility / 2, num_days)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, volatility / 2, num_days)))
+
+    # The adjusted close discounts the dividends of a yearly yield back from the last day
+    dividend_yield = rng.uniform(0, 0.04)
+    adj_close = close * (1 - dividend_yield) ** ((num_days - 1 - np.arange(num_days)) / TRADING_DAYS)
+
+    # The volume level drifts slowly, with daily noise around it
+    volume_level = rng.uniform(9, 15) + np.cumsum(rng.normal(0, 0.02, num_days))
+    volume = np.round(np.exp(volume_level + rng.normal(0, 0.4, num_days)) / 100) * 100
+    return open_, high, low, close, adj_close, volume.astype(np.int64)
+
+
+def write_symbol_csv(csv_path, dates, prices):
+    df = pd.DataFrame(dict(zip(CSV_COLUMNS, [dates.strftime('%Y-%m-%d'), *prices])))
+    df.to_csv(csv_path, index=False)
+    return len(df)
+
+
+def write_symbol_meta(meta_path, symbols):
+    """Symbols metadata in the columns of symbols_valid_meta.csv, for the (symbol, is ETF) pairs"""
+    with open(meta_path, 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(META_COLUMNS)
+        for symbol, etf in symbols:
+            name = f'Synthetic {symbol} {"ETF" if etf else "Common Stock"}'
+            writer.writerow(['Y', symbol, name, 'N', ' ', 'Y' if etf else 'N', '100.0', 'N', '', symbol, symbol, 'N'])
+
+
+def main(output_path, num_stocks=100, num_etfs=20, years=5, end_date='2020-03-31', seed=188):
+    """
+    Write the synthetic `stocks` and `etfs` CSV directories and the symbols metadata under `output_path`.
+
+    Return the paths, the number of rows and the bytes of the generated files.
+    """
+    dates = pd.bdate_range(end=end_date, periods=int(years * TRADING_DAYS))
+    # One generator per symbol from the same seed sequence, so a symbol is the same at any scale
+    seeds = np.random.SeedSequence(seed).spawn(num_stocks + num_etfs)
+
+    symbols, rows, num_bytes = [], 0, 0
+    stock_data = {}
+    for stock_type, prefix, count, offset in [('Stock', 'STK', num_stocks, 0), ('ETF', 'ETF', num_etfs, num_stocks)]:
+        csv_dir = os.path.join(output_path, 'etfs' if stock_type == 'ETF' else 'stocks')
+        os.makedirs(csv_dir, exist_ok=True)
+        stock_data[stock_type] = csv_dir
+        for i, symbol in enumerate(get_symbols(prefix, count)):
+            csv_path = os.path.join(csv_dir, f'{symbol}.csv')
+            prices = generate_prices(np.random.default_rng(seeds[offset + i]), len(dates))
+            rows += write_symbol_csv(csv_path, dates, prices)
+            num_bytes += os.path.getsize(csv_path)
+            symbols.append((symbol, stock_type == 'ETF'))
+
+    meta_path = os.path.join(output_path, 'symbols_valid_meta.csv')
+    write_symbol_meta(meta_path, symbols)
+    return {
+        'stock_data': stock_data, 'stock_desc': meta_path, 'symbols': len(symbols), 'years': years,
+        'start_date': str(dates[0].date()), 'end_date': str(dates[-1].date()), 'seed': seed,
+        'rows': rows, 'bytes': num_bytes,
+    }
+
+
+if __name__ == '__main__':
+    cli_parser = argparse.ArgumentParser(description='Generate synthetic daily market data CSV files')
+    cli_parser.add_argument('--output', dest='output_path', required=True, help='output directory')
+    cli_parser.add_argument('--stocks', dest='num_stocks', type=int, default=100, help='number of stock symbols')
+    cli_parser.add_argument('--etfs', dest='num_etfs', type=int, default=20, help='number of ETF symbols')
+    cli_parser.add_argument('--years', dest='years', type=float, default=5, help='years of business days per symbol')
+    cli_parser.add_argument('--end', dest='end_date', default='2020-03-31', help='last date of the data')
+    cli_parser.add_argument('--seed', dest='seed', type=int, default=188, help='random seed')
+    args = cli_parser.parse_args()
+    print(json.dumps(main(args.output_path, args.num_stocks, args.num_etfs, args.years, args.end_date, args.seed),
+                     indent=2))
@@ -0,0 +1,36 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Diagnostics levels of the ETL steps:
+#   none    - no extra Spark jobs
+#   sample  - show the first rows of the written output
+#   summary - show the first rows and the summary statistics of the written output
+DIAGNOSTICS_LEVELS = ['none', 'sample', 'summary']
+
+
+def get_diagnostics_level(level):
+    level = level or 'none'
+    if level not in DIAGNOSTICS_LEVELS:
+        raise ValueError(f'Unknown diagnostics level: {level}')
+    return level
+
+
+def show_diagnostics(spark, data_path, level, columns=None, num_rows=20):
+    """
+    Show the diagnostics of a step output read back from its written parquet.
+
+    The output is already materialized, so the diagnostics do not recompute the step.
+    """
+    if get_diagnostics_level(level) == 'none':
+        return
+
+    df_out = spark.read.parquet(data_path)
+    if columns is not None:
+        df_out = df_out.select(columns)
+
+    print(f'Diagnostics: {data_path}')
+    df_out.printSchema()
+    df_out.show(num_rows)
+    if level == 'summary':
+        df_out.summary().show()
@@ -0,0 +1,173 @@
+"""
+Registry of the Step 2 feature columns, one declarative spec per feature.
+
+The specs are compiled by two backends: the Spark window expressions of `etl.spark.features`, and the NumPy kernels
+of `compute_features` over the contiguous arrays of one symbol sorted by date. The features are listed in the order
+of the staging data columns, which is also an order where each feature comes after its sources.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from etl import rolling
+
+
+class Feature:
+    """
+    Spec of one feature column.
+
+    `kind` is the function of the feature over its `sources` columns, and `window_days` the time range of the
+    rolling window kinds.
+    """
+    def __init__(self, name, kind, sources, window_days=None):
+        self.name = name
+        self.kind = kind
+        self.sources = sources if isinstance(sources, list) else [sources]
+        self.window_days = window_days
+
+    def __repr__(self):
+        return f'Feature({self.name}: {self.kind} of {", ".join(self.sources)})'
+
+
+# 252 - number of trading days in a year
+ANNUAL_RATE = math.sqrt(252)
+
+# Kinds of the rolling window features over the time range of `window_days`
+ROLLING_KINDS = ['rolling_mean', 'rolling_median', 'rolling_std']
+
+FEATURES = [
+    Feature('vol_moving_avg', 'rolling_mean', 'Volume', window_days=30),
+    Feature('vol_moving_avg_log', 'log', 'vol_moving_avg'),
+    Feature('adj_close_rolling_med', 'rolling_median', 'Adj Close', window_days=30),
+    Feature('adj_close_return', 'daily_return', 'Adj Close'),
+    Feature('adj_close_daily_std', 'rolling_std', 'adj_close_return', window_days=30),
+    Feature('adj_close_annual_std', 'annualize', 'adj_close_daily_std'),
+    Feature('adj_close_trend_flag', 'sign', 'adj_close_return'),
+    Feature('high_vol_ratio', 'ratio', ['High', 'Volume']),
+    Feature('vol_trend_flag', 'trend_sign', 'Volume'),
+    Feature('market_trend', 'market_trend', ['adj_close_trend_flag', 'vol_trend_flag']),
+    Feature('future_adj_close', 'lead', 'Adj Close'),
+    Feature('future_volume', 'lead', 'Volume'),
+    Feature('future_volume_log', 'log', 'future_volume'),
+]
+
+FEATURE_NAMES = [i.name for i in FEATURES]
+
+# Market trend of the price and volume signs
+MARKET_TRENDS = [((1, 1), 'Bullish'), ((1, -1), 'Weak Buying'), ((-1, 1), 'Bearish'), ((-1, -1), 'Weak Selling')]
+
+
+def get_features(names=None):
+    """The features of the names, in the order of the registry"""
+    if names is None:
+        return list(FEATURES)
+    unknown = set(names) - set(FEATURE_NAMES)
+    if len(unknown) > 0:
+        raise ValueError(f'Unknown features: {", ".join(sorted(unknown))}')
+    return [i for i in FEATURES if i.name in names]
+
+
+def get_dependencies(features):
+    """The features which the `features` are computed from, directly or not, in the order of the registry"""
+    names = set()
+    pending = [j for i in features for j in i.sources]
+    while len(pending) > 0:
+        name = pending.pop()
+        if name in FEATURE_NAMES and name not in names:
+            names.add(name)
+            pending.extend(FEATURES[FEATURE_NAMES.index(name)].sources)
+    return get_features(names)
+
+
+def get_sources(features):
+    """The input columns which the `features` are computed from, the sources which are not features"""
+    sources = [j for i in get_dependencies(features) + features for j in i.sources if j not in FEATURE_NAMES]
+    return list(dict.fromkeys(sources))
+
+
+def shift(values, periods):
+    """Shift the values by `periods` rows, the lag of positive and the lead of negative periods, filled by NaN"""
+    shifted = np.full(len(values), np.nan)
+    if periods > 0:
+        shifted[periods:] = values[:-periods]
+    else:
+        shifted[:periods] = values[-periods:]
+    return shifted
+
+
+def divide(dividend, divisor):
+    """Division, NaN for the divisor 0 like the Spark divide"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(divisor != 0, dividend / divisor, np.nan)
+
+
+def log(values):
+    """Natural logarithm, NaN for the values not greater than 0 like the Spark log"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(values > 0, np.log(values), np.nan)
+
+
+def market_trend(price_sign, volume_sign):
+    """Market trend of the price and volume signs, the last known trend for the unknown ones"""
+    conditions = [(price_sign * i > 0) & (volume_sign * j > 0) for (i, j), _ in MARKET_TRENDS]
+    trends = np.select(conditions, [i for _, i in MARKET_TRENDS], default=None)
+    return pd.Series(trends, dtype=object).ffill().to_numpy()
+
+
+def compute_feature(feature, columns, bounds):
+    """NumPy kernel of one feature over the float64 arrays of its sources"""
+    sources = [columns[i] for i in feature.sources]
+    if feature.kind in ROLLING_KINDS:
+        start, end = bounds[feature.window_days]
+        kernel = getattr(rolling, feature.kind)
+        return kernel(sources[0], start, end)
+    if feature.kind == 'log':
+        return log(sources[0])
+    if feature.kind == 'daily_return':
+        return divide(sources[0], shift(sources[0], 1)) - 1
+    if feature.kind == 'annualize':
+        return sources[0] * ANNUAL_RATE
+    if feature.kind == 'sign':
+        return np.sign(sources[0])
+    if feature.kind == 'ratio':
+        return divide(sources[0], sources[1])
+    if feature.kind == 'trend_sign':
+        return np.sign(sources[0] - shift(sources[0], 1))
+    if feature.kind == 'market_trend':
+        return market_trend(sources[0], sources[1])
+    if feature.kind == 'lead':
+        return shift(sources[0], -1)
+    raise ValueError(f'Unknown feature kind: {feature.kind}')
+
+
+def compute_features(columns, timestamps, features=None):
+    """
+    Compute the features over the columns of one symbol sorted by `timestamps` in seconds, the NumPy backend.
+
+    The source columns are float64 arrays with NaN for the nulls. Return the arrays of the features by name.
+    """
+    features = get_features() if features is None else features
+    columns = dict(columns)
+    bounds = {
+        i.window_days: rolling.get_window_bounds(timestamps, i.window_days * 86400)
+        for i in features if i.kind in ROLLING_KINDS
+    }
+    for feature in features:
+        columns[feature.name] = compute_feature(feature, columns, bounds)
+    return {i.name: columns[i.name] for i in features}
+
+
+def compute_features_pandas(pdf, names):
+    """
+    Compute the features of the names over the rows of one symbol, for `applyInPandas`.
+
+    The rows are sorted by the TimeStamp seconds, and their source columns are already in `pdf`.
+    """
+    features = get_features(names)
+    pdf = pdf.sort_values('TimeStamp', kind='stable').reset_index(drop=True)
+    sources = set(j for i in features for j in i.sources) - set(names)
+    columns = {i: pd.to_numeric(pdf[i]).to_numpy(dtype=np.float64, na_value=np.nan) for i in sources}
+    for name, values in compute_features(columns, pdf['TimeStamp'].to_numpy(), features).items():
+        pdf[name] = values
+    return pdf
@@ -0,0 +1,57 @@
+"""
+Flat node arrays of a random forest regressor, exported next to the joblib model for the compiled engine of the API.
+
+The file is an uncompressed joblib dict of the node arrays in the dtypes of FOREST_ARRAY_DTYPES, with `max_depth`,
+`n_features` and `version`. The `forest_engine` of stock_api loads this layout and rejects any other version, so a
+change of the arrays or of their dtypes bumps FOREST_ARRAYS_VERSION on both sides.
+"""
+import joblib
+import numpy as np
+
+# File suffix of the forest arrays next to the joblib model
+FOREST_ARRAYS_SUFFIX = '_Forest.joblib'
+
+FOREST_ARRAYS_VERSION = 1
+
+# Fixed size dtypes, so the files do not depend on the platform of the exporter
+FOREST_ARRAY_DTYPES = {
+    'feature': np.int64, 'threshold': np.float64, 'left': np.int64, 'right': np.int64, 'value': np.float64,
+    'roots': np.int64,
+}
+
+
+def get_forest_arrays_path(model_path):
+    return model_path.replace('.joblib', FOREST_ARRAYS_SUFFIX)
+
+
+def export_forest_arrays(forest, forest_output):
+    """
+    Export the trees of the random forest as flat node arrays.
+
+    The nodes of all the trees are concatenated, with the tree roots at `roots`. A leaf node points to itself
+    on both sides, and its feature is 0, so the API can walk all the trees at once without sklearn.
+    """
+    trees = [i.tree_ for i in forest.estimators_]
+    offsets = np.cumsum([0] + [i.node_count for i in trees])
+    feature, threshold, left, right, value = [], [], [], [], []
+    for offset, tree in zip(offsets, trees):
+        nodes = np.arange(tree.node_count) + offset
+        is_leaf = tree.children_left < 0
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        left.append(np.where(is_leaf, nodes, tree.children_left + offset))
+        right.append(np.where(is_leaf, nodes, tree.children_right + offset))
+        value.append(tree.value[:, 0, 0])
+
+    arrays = {
+        'feature': np.concatenate(feature), 'threshold': np.concatenate(threshold), 'left': np.concatenate(left),
+        'right': np.concatenate(right), 'value': np.concatenate(value), 'roots': offsets[:-1],
+    }
+    arrays = {k: np.ascontiguousarray(v, dtype=FOREST_ARRAY_DTYPES[k]) for k, v in arrays.items()}
+    arrays.update({
+        'max_depth': max(i.max_depth for i in trees), 'n_features': forest.n_features_in_,
+        'version': FOREST_ARRAYS_VERSION,
+    })
+    # Keep the arrays uncompressed, so the API workers can memory-map them with joblib.load(mmap_mode='r')
+    joblib.dump(arrays, forest_output, compress=0)
+    print('Export the forest arrays:', forest_output)
@@ -0,0 +1,196 @@
+"""
+Layout of the parquet outputs of Step 1 and Step 2, and the statistics of their files.
+
+The output layouts:
+  partitioned - one Symbol=... directory per symbol, the layout of `partitionBy('Symbol')`
+  clustered   - fewer, larger files of the rows sorted by Symbol and Date2, each file holds a range of the symbols
+
+Each output keeps the rows, and the Symbol and Date2 min-max statistics of its files in `_file_stats.json`. The readers
+select the files of the symbols and dates from it, without listing the Symbol directories or reading the footers.
+"""
+import json
+import logging
+import os
+from urllib.parse import unquote
+
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_LAYOUTS = ['partitioned', 'clustered']
+
+# Parquet compression codecs supported by both Spark and pyarrow
+COMPRESSION_CODECS = ['snappy', 'gzip', 'zstd', 'uncompressed']
+
+# The leading underscore hides the statistics file from the Spark and pyarrow parquet readers
+FILE_STATS_NAME = '_file_stats.json'
+
+
+class OutputLayout:
+    """
+    Output layout of a parquet output.
+
+    `row_group_mb` is the target size of the row groups, about a thousand rows by default, and `num_files` the
+    number of the clustered files, the default of the engine when not set.
+    """
+    def __init__(self, layout='partitioned', compression='snappy', row_group_mb=None, num_files=None):
+        if layout not in OUTPUT_LAYOUTS:
+            raise ValueError(f'Unknown output layout: {layout}')
+        if compression not in COMPRESSION_CODECS:
+            raise ValueError(f'Unknown compression codec: {compression}')
+        if row_group_mb is not None and row_group_mb <= 0:
+            raise ValueError(f'Row group size must be positive: {row_group_mb}')
+        if num_files is not None and num_files < 1:
+            raise ValueError(f'Output files must be at least 1: {num_files}')
+
+        self.layout = layout
+        self.compression = compression
+        self.row_group_mb = row_group_mb
+        self.num_files = num_files
+
+    def __repr__(self):
+        return f'OutputLayout({self.layout}, {self.compression}, row_group_mb={self.row_group_mb}, ' \
+               f'num_files={self.num_files})'
+
+    @property
+    def clustered(self):
+        return self.layout == 'clustered'
+
+    def get_file_name(self, index=0):
+        """Name of the output file, with the codec extension of the Spark output files"""
+        extension = '' if self.compression == 'uncompressed' else f'.{self.compression}'
+        return f'part-{index:05d}{extension}.parquet'
+
+
+def get_file_stats_path(data_path):
+    return os.path.join(data_path, FILE_STATS_NAME)
+
+
+def list_parquet_files(data_path):
+    """Paths of the parquet files under the output, relative to it, without the hidden files"""
+    files = []
+    for root, dirs, names in os.walk(data_path):
+        dirs[:] = sorted(i for i in dirs if not i.startswith(('_', '.')))
+        for name in sorted(names):
+            if name.endswith('.parquet') and not name.startswith(('_', '.')):
+                files.append(os.path.relpath(os.path.join(root, name), data_path))
+    return files
+
+
+def get_min_max(metadata, column):
+    """Min and max value of a column over the row groups of the footer, None when a row group has no statistics"""
+    names = [metadata.schema.column(i).name for i in range(metadata.num_columns)]
+    if column not in names:
+        return None, None
+
+    index = names.index(column)
+    values = []
+    for i in range(metadata.num_row_groups):
+        statistics = metadata.row_group(i).column(index).statistics
+        if statistics is None or not statistics.has_min_max:
+            return None, None
+        values.append((statistics.min, statistics.max))
+    if len(values) == 0:
+        return None, None
+    return min(i[0] for i in values), max(i[1] for i in values)
+
+
+def read_file_stats(data_path, file_path):
+    """Statistics of one parquet file from its footer, the Symbol of a partition file from its directory"""
+    full_path = os.path.join(data_path, file_path)
+    metadata = pq.read_metadata(full_path)
+
+    partition = os.path.dirname(file_path)
+    if partition.startswith('Symbol='):
+        symbol_min = symbol_max = unquote(partition[len('Symbol='):])
+    else:
+        symbol_min, symbol_max = get_min_max(metadata, 'Symbol')
+    date_min, date_max = get_min_max(metadata, 'Date2')
+
+    return {
+        'path': file_path,
+        'rows': metadata.num_rows,
+        'bytes': os.path.getsize(full_path),
+        'symbol_min': symbol_min,
+        'symbol_max': symbol_max,
+        'date_min': str(date_min) if date_min is not None else None,
+        'date_max': str(date_max) if date_max is not None else None,
+    }
+
+
+def write_file_stats(data_path):
+    """
+    Write the statistics of the files of the output.
+
+    The footers of the files already in the previous statistics are not read again, so the append of an incremental
+    run reads only the footers of its new files.
+    """
+    previous = {i['path']: i for i in load_file_stats(data_path) or []}
+    file_stats = []
+    for file_path in list_parquet_files(data_path):
+        cached = previous.get(file_path)
+        if cached is not None and cached['bytes'] == os.path.getsize(os.path.join(data_path, file_path)):
+            file_stats.append(cached)
+        else:
+            file_stats.append(read_file_stats(data_path, file_path))
+
+    with open(get_file_stats_path(data_path), 'w') as fp:
+        json.dump(file_stats, fp, indent=1)
+    logger.info(f'File statistics: {data_path} - {len(file_stats)} files')
+    return file_stats
+
+
+def load_file_stats(data_path):
+    """Statistics of the files of the output, None when the output has no statistics file"""
+    file_stats_path = get_file_stats_path(data_path)
+    if not os.path.exists(file_stats_path):
+        return None
+    with open(file_stats_path) as fp:
+        return json.load(fp)
+
+
+def overlaps(value_min, value_max, low, high):
+    """Whether the [value_min, value_max] range overlaps [low, high], the unknown ranges always do"""
+    if value_min is None or value_max is None:
+        return True
+    return (low is None or value_max >= low) and (high is None or value_min <= high)
+
+
+def select_files(data_path, symbols=None, date_from=None, date_to=None):
+    """
+    Paths of the output files which may have rows of the symbols in [date_from, date_to], from the file statistics.
+
+    Return None when the output has no statistics file, so the reader falls back to the whole output.
+    """
+    file_stats = load_file_stats(data_path)
+    if file_stats is None:
+        return None
+
+    date_from, date_to = [str(i) if i is not None else None for i in [date_from, date_to]]
+    selected = []
+    for i in file_stats:
+        if not overlaps(i['date_min'], i['date_max'], date_from, date_to):
+            continue
+        if symbols is not None and not any(overlaps(i['symbol_min'], i['symbol_max'], j, j) for j in symbols):
+            continue
+        selected.append(os.path.join(data_path, i['path']))
+    return selected
+
+
+def get_symbol_dates(data_path):
+    """
+    The latest Date2 of each symbol, from the file statistics of the files with only one symbol.
+
+    Return None when the output has no statistics file, or a file of several symbols.
+    """
+    file_stats = load_file_stats(data_path)
+    if file_stats is None:
+        return None
+
+    symbol_dates = {}
+    for i in file_stats:
+        if i['symbol_min'] is None or i['symbol_min'] != i['symbol_max']:
+            return None
+        if i['date_max'] is not None:
+            symbol_dates[i['symbol_min']] = max(i['date_max'], symbol_dates.get(i['symbol_min'], i['date_max']))
+    return symbol_dates
@@ -0,0 +1,183 @@
+import logging
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv
+
+from etl.layout import OutputLayout
+from etl.local.utils import run_tasks, get_workers, get_chunks, reset_output, mark_success
+from etl.local.utils import write_partition, write_partition_batches, write_cluster
+
+logger = logging.getLogger(__name__)
+
+# Schema of the ingested data, the same as the Spark output without the Symbol partition column
+INGEST_SCHEMA = pa.schema([
+    ('Date', pa.string()),
+    ('Open', pa.float32()),
+    ('High', pa.float32()),
+    ('Low', pa.float32()),
+    ('Close', pa.float32()),
+    ('Adj Close', pa.float32()),
+    ('Volume', pa.int32()),
+    ('Date2', pa.date32()),
+    ('Security Name', pa.string()),
+])
+
+# Column types of the daily stock CSV files, the same as the Spark CSV schema of Step 1
+CSV_COLUMN_TYPES = {
+    'Date': pa.string(),
+    'Open': pa.float32(),
+    'High': pa.float32(),
+    'Low': pa.float32(),
+    'Close': pa.float32(),
+    'Adj Close': pa.float32(),
+    'Volume': pa.int32(),
+}
+
+# Bytes of the CSV block of each record batch
+CSV_BLOCK_SIZE = 4 * 1024 * 1024
+
+_security_names = {}
+
+
+def _init_worker(security_names):
+    global _security_names
+    _security_names = security_names
+
+
+def get_security_names(symbol_csv):
+    """Security name of each symbol, the first one of a duplicated symbol"""
+    df_symbol = pd.read_csv(
+        symbol_csv, usecols=['Symbol', 'Security Name'], dtype=str, keep_default_na=False, na_values=['']
+    )
+    return df_symbol.drop_duplicates('Symbol').set_index('Symbol')['Security Name'].to_dict()
+
+
+def read_stock_batches(csv_path, date_from=None, date_to=None, security_name=None):
+    """
+    Stream the record batches of one daily stock CSV with the Arrow CSV reader.
+
+    The rows out of [date_from, date_to] are filtered out batch by batch, before they are written.
+    A malformed value raises `pyarrow.ArrowInvalid`.
+    """
+    reader = csv.open_csv(
+        csv_path, read_options=csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+        convert_options=csv.ConvertOptions(column_types=CSV_COLUMN_TYPES, include_columns=list(CSV_COLUMN_TYPES)),
+    )
+    for batch in reader:
+        date2 = pc.cast(pc.strptime(batch.column('Date'), format='%Y-%m-%d', unit='s', error_is_null=True), pa.date32())
+        if date_from is not None or date_to is not None:
+            mask = pc.and_kleene(
+                pc.greater_equal(date2, pa.scalar(date_from, pa.date32())) if date_from is not None else True,
+                pc.less_equal(date2, pa.scalar(date_to, pa.date32())) if date_to is not None else True,
+            )
+            batch, date2 = batch.filter(mask), date2.filter(mask)
+
+        if batch.num_rows == 0:
+            continue
+
+        names = pa.array([security_name] * batch.num_rows, pa.string())
+        batch = pa.RecordBatch.from_arrays(batch.columns + [date2, names], schema=INGEST_SCHEMA)
+        # Sort the rows by date, so the row group statistics of Date2 are selective
+        yield batch.take(pc.sort_indices(batch, sort_keys=[('Date2', 'ascending')]))
+
+
+def read_stock_csv(csv_path):
+    """Read one daily stock CSV, the malformed values are nulls like the Spark PERMISSIVE mode"""
+    df = pd.read_csv(csv_path, dtype=str, keep_default_na=False, na_values=[''])
+    for name in ['Open', 'High', 'Low', 'Close', 'Adj Close']:
+        df[name] = pd.to_numeric(df[name], errors='coerce').astype(np.float32)
+
+    volume = pd.to_numeric(df['Volume'], errors='coerce')
+    df['Volume'] = volume.where(volume % 1 == 0).astype('Int32')
+    df['Date2'] = pd.to_datetime(df['Date'], format='%Y-%m-%d', errors='coerce').dt.date
+    return df
+
+
+def read_stock_rows(csv_path, date_from=None, date_to=None, security_name=None):
+    """Read the rows of one daily stock CSV in [date_from, date_to] with pandas, the slow path of the malformed CSV"""
+    df = read_stock_csv(csv_path)
+
+    if date_from is not None:
+        df = df[df['Date2'].notna() & (df['Date2'] >= date_from)]
+    if date_to is not None:
+        df = df[df['Date2'].notna() & (df['Date2'] <= date_to)]
+
+    return df.assign(**{'Security Name': security_name})
+
+
+def ingest_stock_csv(task):
+    csv_path, date_from, date_to, data_output_path, layout = task
+    symbol = os.path.basename(csv_path)[:-4]
+    security_name = _security_names.get(symbol)
+    try:
+        batches = read_stock_batches(csv_path, date_from, date_to, security_name)
+        return symbol, write_partition_batches(batches, data_output_path, symbol, INGEST_SCHEMA, layout)
+    except pa.ArrowInvalid as e:
+        # Read the malformed values as nulls with pandas, the slow path
+        logger.warning(f'Read {csv_path} with pandas: {e}')
+
+    df = read_stock_rows(csv_path, date_from, date_to, security_name)
+    if len(df) == 0:
+        return symbol, 0
+
+    return symbol, write_partition(df, data_output_path, symbol, INGEST_SCHEMA, layout)
+
+
+def ingest_stock_cluster(task):
+    """Ingest the CSV files of a range of the symbols into one file of the clustered layout"""
+    csv_paths, index, date_from, date_to, data_output_path, layout = task
+    tables = []
+    for csv_path in csv_paths:
+        symbol = os.path.basename(csv_path)[:-4]
+        security_name = _security_names.get(symbol)
+        try:
+            table = pa.Table.from_batches(
+                list(read_stock_batches(csv_path, date_from, date_to, security_name)), schema=INGEST_SCHEMA,
+            )
+        except pa.ArrowInvalid as e:
+            logger.warning(f'Read {csv_path} with pandas: {e}')
+            df = read_stock_rows(csv_path, date_from, date_to, security_name)
+            table = pa.Table.from_pandas(df, schema=INGEST_SCHEMA, preserve_index=False)
+        tables.append((symbol, table.sort_by('Date2')))
+
+    return f'part-{index:05d}', write_cluster(tables, data_output_path, index, INGEST_SCHEMA, layout)
+
+
+def main(stock_csv, symbol_csv, start_date, end_date, data_output_path, workers=None, layout=None):
+    """
+    Ingest the daily stock CSV files into the parquet of the output `layout` without Spark, partitioned by Symbol by
+    default.
+
+    Each CSV file is streamed with the Arrow CSV reader and written into its Symbol partition by a worker process.
+    In the clustered layout, each worker process writes the CSV files of a range of the symbols into one file.
+    The security names of the symbols are looked up from a dictionary sent once to each worker.
+    """
+    layout = layout or OutputLayout()
+    csv_paths = sorted(os.path.join(stock_csv, i) for i in os.listdir(stock_csv) if i.endswith('.csv'))
+
+    date_from, date_to = [pd.to_datetime(i).date() if i is not None else None for i in [start_date, end_date]]
+    if start_date is not None:
+        logger.info(f'Start Date: {start_date}')
+        date_from = date_from - timedelta(days=30)
+
+    if end_date is not None:
+        logger.info(f'End Date: {end_date}')
+        date_to = date_to + timedelta(days=1)
+
+    reset_output(data_output_path)
+    if layout.clustered:
+        chunks = get_chunks(csv_paths, layout.num_files or get_workers(workers))
+        tasks = [(chunk, i, date_from, date_to, data_output_path, layout) for i, chunk in enumerate(chunks)]
+        results = run_tasks(ingest_stock_cluster, tasks, workers, _init_worker, (get_security_names(symbol_csv),))
+    else:
+        tasks = [(i, date_from, date_to, data_output_path, layout) for i in csv_paths]
+        results = run_tasks(ingest_stock_csv, tasks, workers, _init_worker, (get_security_names(symbol_csv),))
+    mark_success(data_output_path)
+
+    num_rows = sum(i[1] for i in results)
+    print(f'Export: {data_output_path} - {len(csv_paths)} files, {num_rows} rows')
@@ -0,0 +1,133 @@
+import logging
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from etl.local.step1_ingest_data import INGEST_SCHEMA
+from etl.layout import OutputLayout, list_parquet_files, select_files
+from etl.local.utils import run_tasks, get_workers, get_chunks, get_partitions, reset_output, mark_success
+from etl.local.utils import write_partition, write_cluster
+from etl.features import get_features, get_sources, compute_features
+from etl.rolling import LOOKBACK_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Schema of the staging data, the same as the Spark output of the pandas feature engine
+STAGING_SCHEMA = pa.schema(list(INGEST_SCHEMA) + [
+    ('vol_moving_avg', pa.float64()),
+    ('vol_moving_avg_log', pa.float64()),
+    ('adj_close_rolling_med', pa.float64()),
+    ('adj_close_return', pa.float64()),
+    ('adj_close_daily_std', pa.float64()),
+    ('adj_close_annual_std', pa.float64()),
+    ('adj_close_trend_flag', pa.int32()),
+    ('high_vol_ratio', pa.float64()),
+    ('vol_trend_flag', pa.int32()),
+    ('market_trend', pa.string()),
+    ('future_adj_close', pa.float32()),
+    ('future_volume', pa.int32()),
+    ('future_volume_log', pa.float64()),
+])
+
+
+def extract_features(df_daily):
+    """Extract the window features of the rows of one symbol, by the NumPy backend of the feature registry"""
+    df_daily = df_daily[df_daily['Date2'].notna()].sort_values('Date2', kind='stable').reset_index(drop=True)
+    df_daily['TimeStamp'] = pd.to_datetime(df_daily['Date2']).to_numpy().astype('datetime64[s]').astype(np.int64)
+
+    features = get_features()
+    columns = {i: df_daily[i].to_numpy(dtype=np.float64, na_value=np.nan) for i in get_sources(features)}
+    for name, values in compute_features(columns, df_daily['TimeStamp'].to_numpy(), features).items():
+        df_daily[name] = values
+    return df_daily
+
+
+def read_sources(sources, filters):
+    """Read the daily stock prices of the sources, the (path, symbol) pairs of the Symbol partitions or files"""
+    frames = []
+    for path, symbol in sources:
+        df = pd.read_parquet(path, filters=filters)
+        if symbol is not None:
+            df['Symbol'] = symbol
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def extract_source_features(task):
+    """Extract the features of the symbols of the sources, and write them in the output layout"""
+    sources, index, date_from, date_to, stock_price_staging, layout = task
+    # Read only the row groups of the lookback before the start date, and the day after the end date
+    filters = []
+    if date_from is not None:
+        filters.append(('Date2', '>=', date_from - timedelta(days=LOOKBACK_DAYS)))
+    if date_to is not None:
+        filters.append(('Date2', '<=', date_to + timedelta(days=1)))
+    df_sources = read_sources(sources, filters or None)
+
+    results = []
+    for symbol, df_daily in df_sources.groupby('Symbol', sort=True):
+        df_daily = extract_features(df_daily.drop(columns='Symbol'))
+        if date_from is not None:
+            df_daily = df_daily[df_daily['Date2'] >= date_from]
+        if date_to is not None:
+            df_daily = df_daily[df_daily['Date2'] <= date_to]
+        results.append((symbol, df_daily))
+
+    if layout.clustered:
+        tables = [(symbol, pa.Table.from_pandas(df, schema=STAGING_SCHEMA, preserve_index=False))
+                  for symbol, df in results]
+        return len(results), write_cluster(tables, stock_price_staging, index, STAGING_SCHEMA, layout)
+
+    results = [(symbol, df) for symbol, df in results if len(df) > 0]
+    num_rows = sum(write_partition(df, stock_price_staging, symbol, STAGING_SCHEMA, layout) for symbol, df in results)
+    return len(results), num_rows
+
+
+def get_input_sources(stock_price_daily, date_from, date_to):
+    """
+    The (path, symbol) pairs of the Symbol partitions of the daily stock prices, or of the files of the clustered
+    layout, only the files of the lookback date range when the output has file statistics.
+    """
+    partitions = get_partitions(stock_price_daily)
+    if len(partitions) > 0:
+        return [(path, symbol) for symbol, path in partitions.items()]
+
+    files = select_files(
+        stock_price_daily, date_from=date_from - timedelta(days=LOOKBACK_DAYS) if date_from is not None else None,
+        date_to=date_to + timedelta(days=1) if date_to is not None else None,
+    )
+    if files is None:
+        files = [os.path.join(stock_price_daily, i) for i in list_parquet_files(stock_price_daily)]
+    return [(path, None) for path in files]
+
+
+def main(stock_price_daily, stock_price_staging, start_date, end_date, workers=None, layout=None):
+    """
+    Extract the features of the daily stock prices into the staging parquet of the output `layout` without Spark,
+    partitioned by Symbol by default.
+
+    Each Symbol partition, or file of the clustered input, is read, processed and written by a worker process.
+    The clustered output of the partitioned input has one file per range of the symbols. The rolling median is exact.
+    """
+    layout = layout or OutputLayout()
+    logger.info(f'Start Date: {start_date} - End Date: {end_date}')
+    date_from, date_to = [pd.to_datetime(i).date() if i is not None else None for i in [start_date, end_date]]
+
+    sources = get_input_sources(stock_price_daily, date_from, date_to) if os.path.exists(stock_price_daily) else []
+    if len(sources) == 0:
+        raise FileNotFoundError(f'file {stock_price_daily} does not exists!')
+
+    chunks = [[i] for i in sources]
+    if layout.clustered and sources[0][1] is not None:
+        chunks = get_chunks(sources, layout.num_files or get_workers(workers))
+
+    reset_output(stock_price_staging)
+    tasks = [(chunk, i, date_from, date_to, stock_price_staging, layout) for i, chunk in enumerate(chunks)]
+    results = run_tasks(extract_source_features, tasks, workers)
+    mark_success(stock_price_staging)
+
+    num_symbols, num_rows = sum(i[0] for i in results), sum(i[1] for i in results)
+    print(f'Export: {stock_price_staging} - {num_symbols} symbols, {num_rows} rows')
@@ -0,0 +1,137 @@
+import glob
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from etl.layout import OutputLayout, write_file_stats
+
+# Rows of each parquet row group, about 4 years of trading days, so the Date2 statistics skip the unread years
+ROW_GROUP_SIZE = 1024
+
+# Symbol partition directories of the partitioned layout
+PARTITION_PREFIX = 'Symbol='
+
+
+def get_workers(workers=None):
+    """Number of the worker processes, one per CPU by default"""
+    return max(1, workers or os.cpu_count() or 1)
+
+
+def run_tasks(func, tasks, workers=None, initializer=None, initargs=()):
+    """Run the tasks in a process pool, and return their results in the order of the tasks"""
+    workers = min(get_workers(workers), max(1, len(tasks)))
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [func(i) for i in tasks]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        return list(executor.map(func, tasks))
+
+
+def get_chunks(items, num_chunks):
+    """Split the items into at most `num_chunks` contiguous chunks of about the same size"""
+    num_chunks = max(1, min(num_chunks, len(items)))
+    size, extra = divmod(len(items), num_chunks)
+    chunks, start = [], 0
+    for i in range(num_chunks):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return [i for i in chunks if len(i) > 0]
+
+
+def get_partitions(data_path):
+    """Symbol partition directories of a parquet output"""
+    return {
+        os.path.basename(i)[len(PARTITION_PREFIX):]: i
+        for i in sorted(glob.glob(os.path.join(data_path, f'{PARTITION_PREFIX}*')))
+    }
+
+
+def get_writer_options(layout, table):
+    """Compression and row group rows of the output layout, the row group size estimated from the table rows"""
+    row_group_size = ROW_GROUP_SIZE
+    if layout.row_group_mb is not None and table.num_rows > 0:
+        row_group_size = max(1, int(layout.row_group_mb * 1024 * 1024 * table.num_rows // max(1, table.nbytes)))
+    compression = 'none' if layout.compression == 'uncompressed' else layout.compression
+    return compression, row_group_size
+
+
+def reset_output(data_path):
+    """Remove the previous output, the same as the Spark overwrite mode"""
+    if os.path.exists(data_path):
+        shutil.rmtree(data_path)
+    os.makedirs(data_path)
+
+
+def write_partition(df, data_path, symbol, schema, layout=None):
+    """Write the rows of one symbol into its Symbol partition, the same layout as `partitionBy('Symbol')`"""
+    layout = layout or OutputLayout()
+    partition_path = os.path.join(data_path, f'{PARTITION_PREFIX}{symbol}')
+    os.makedirs(partition_path, exist_ok=True)
+
+    # The NaN values of the float columns are written as nulls, like the Spark output
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    compression, row_group_size = get_writer_options(layout, table)
+    pq.write_table(
+        table, os.path.join(partition_path, layout.get_file_name()), row_group_size=row_group_size,
+        compression=compression,
+    )
+    return len(df)
+
+
+def write_cluster(tables, data_path, index, schema, layout):
+    """
+    Write the tables of the symbols sorted by Symbol into one file of the clustered layout, with their Symbol column.
+
+    `tables` are the (symbol, table) pairs, no file is written without any rows.
+    """
+    tables = [table.append_column('Symbol', pa.array([symbol] * table.num_rows, pa.string()))
+              for symbol, table in sorted(tables, key=lambda i: i[0]) if table.num_rows > 0]
+    if len(tables) == 0:
+        return 0
+
+    table = pa.concat_tables(tables).cast(pa.schema(list(schema) + [('Symbol', pa.string())]))
+    compression, row_group_size = get_writer_options(layout, table)
+    pq.write_table(
+        table, os.path.join(data_path, layout.get_file_name(index)), row_group_size=row_group_size,
+        compression=compression,
+    )
+    return table.num_rows
+
+
+def write_partition_batches(batches, data_path, symbol, schema, layout=None):
+    """Stream the record batches of one symbol into its Symbol partition, no file is written without any rows"""
+    layout = layout or OutputLayout()
+    partition_file = os.path.join(data_path, f'{PARTITION_PREFIX}{symbol}', layout.get_file_name())
+    writer = None
+    row_group_size = None
+    num_rows = 0
+    try:
+        for batch in batches:
+            if writer is None:
+                os.makedirs(os.path.dirname(partition_file), exist_ok=True)
+                compression, row_group_size = get_writer_options(layout, batch)
+                writer = pq.ParquetWriter(partition_file, schema, compression=compression)
+            writer.write_batch(batch, row_group_size=row_group_size)
+            num_rows += batch.num_rows
+    except Exception:
+        # Remove the partial file, so the partition can be rewritten
+        if writer is not None:
+            writer.close()
+            os.remove(partition_file)
+        raise
+
+    if writer is not None:
+        writer.close()
+    return num_rows
+
+
+def mark_success(data_path):
+    """Mark the output complete, and write the statistics of its files"""
+    open(os.path.join(data_path, '_SUCCESS'), 'w').close()
+    write_file_stats(data_path)
@@ -0,0 +1,109 @@
+"""
+Manifests of the ETL steps, to skip a step when nothing upstream changed.
+
+The manifest of a step records the fingerprints of its input files, the slice of the configuration it depends on,
+and the fingerprints of its outputs after the step. A step is unchanged when its inputs and configuration are the
+same as the manifest of its last run, and its outputs were not changed or removed since.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+
+
+def get_manifest_path(output_path):
+    """The manifest file is kept next to the step output, so an overwrite of the output keeps it"""
+    return f'{output_path}_Manifest.json'
+
+
+def list_files(path):
+    """Paths of the files of a file or directory, relative to it, without the hidden files"""
+    if os.path.isfile(path):
+        return ['']
+
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs[:] = sorted(i for i in dirs if not i.startswith('.'))
+        files.extend(os.path.relpath(os.path.join(root, i), path) for i in sorted(names) if not i.startswith('.'))
+    return files
+
+
+def get_fingerprint(path):
+    """Fingerprint of the files of a path: their number, total bytes, and the digest of their paths, sizes and mtimes"""
+    digest = hashlib.sha256()
+    num_bytes = 0
+    files = list_files(path) if os.path.exists(path) else []
+    for file_path in files:
+        stat = os.stat(os.path.join(path, file_path) if file_path else path)
+        digest.update(f'{file_path}\t{stat.st_size}\t{stat.st_mtime_ns}\n'.encode())
+        num_bytes += stat.st_size
+    return {'path': path, 'files': len(files), 'bytes': num_bytes, 'digest': digest.hexdigest()}
+
+
+class StepManifest:
+    """
+    Manifest of one ETL step.
+
+    The input fingerprints are taken when the manifest is created before the step runs, and the output fingerprints
+    when it is saved after the step, so a change of the inputs during the step runs it again the next time.
+    """
+    def __init__(self, step, output_path, inputs, outputs, config):
+        self.step = step
+        self.path = get_manifest_path(output_path)
+        self.inputs = inputs
+        self.outputs = outputs
+        self.manifest = {
+            'step': step,
+            'inputs': [get_fingerprint(i) for i in inputs],
+            'config': config,
+        }
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as fp:
+            return json.load(fp)
+
+    def get_changes(self):
+        """Reasons to run the step, none when it is unchanged since its last run"""
+        previous = self.load()
+        if previous is None:
+            return ['no manifest of the last run']
+
+        changes = []
+        previous_inputs = {i['path']: i for i in previous.get('inputs', [])}
+        for i in self.manifest['inputs']:
+            if previous_inputs.get(i['path']) != i:
+                changes.append(f'input {i["path"]} changed')
+
+        config = previous.get('config', {})
+        changes.extend(
+            f'config {i} changed' for i in sorted(set(config) | set(self.manifest['config']))
+            if config.get(i) != self.manifest['config'].get(i)
+        )
+
+        previous_outputs = {i['path']: i for i in previous.get('outputs', [])}
+        for i in self.outputs:
+            if previous_outputs.get(i) != get_fingerprint(i):
+                changes.append(f'output {i} changed')
+        return changes
+
+    def skip(self, skip_unchanged):
+        """Whether to skip the step, and print the decision when `skip_unchanged` is enabled"""
+        if not skip_unchanged:
+            return False
+
+        changes = self.get_changes()
+        if len(changes) == 0:
+            print(f'Skip {self.step}: unchanged since {self.load()["created_at"]} - {self.path}')
+            return True
+
+        print(f'Run {self.step}: {", ".join(changes)}')
+        return False
+
+    def save(self):
+        manifest = dict(self.manifest, outputs=[get_fingerprint(i) for i in self.outputs],
+                        created_at=datetime.now().isoformat(timespec='seconds'))
+        with open(self.path, 'w') as fp:
+            json.dump(manifest, fp, indent=2)
+        print('Export:', self.path)
@@ -0,0 +1,159 @@
+"""
+Exact rolling statistics over the time range windows of one symbol sorted by date.
+
+The windows are the same as `Window.orderBy('TimeStamp').rangeBetween(-seconds, 0)`: each row covers the rows
+with TimeStamp in [t - seconds, t], including the following rows of the same TimeStamp. The NaN values are
+ignored, like the nulls in the Spark aggregate functions.
+"""
+import heapq
+from collections import defaultdict
+
+import numpy as np
+
+# Total seconds of the 30 days rolling window
+WINDOW_30_DAYS = 30 * 86400
+
+# Days of the rolling window before the first computed row, plus a margin for the lag of the window's first row
+LOOKBACK_DAYS = 30 + 10
+
+
+def get_window_bounds(timestamps, seconds):
+    """Start (inclusive) and end (exclusive) row of the range window of each row"""
+    timestamps = np.asarray(timestamps)
+    start = np.searchsorted(timestamps, timestamps - seconds, side='left')
+    end = np.searchsorted(timestamps, timestamps, side='right')
+    return start, end
+
+
+def rolling_count_sum(values, start, end):
+    """Count and sum of the non-NaN values per window, from the cumulative sums"""
+    valid = ~np.isnan(values)
+    count = np.concatenate([[0], np.cumsum(valid)])
+    total = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+    return count[end] - count[start], total[end] - total[start]
+
+
+def rolling_mean(values, start, end):
+    values = np.asarray(values, dtype=np.float64)
+    count, total = rolling_count_sum(values, start, end)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def rolling_std(values, start, end):
+    """Sample standard deviation per window, NaN for the windows of less than 2 values"""
+    values = np.asarray(values, dtype=np.float64)
+    # Center the values first, so the sum of squares does not lose the precision of small deviations
+    center = np.nanmean(values) if np.isfinite(values).any() else 0.0
+    values = values - center
+    count, total = rolling_count_sum(values, start, end)
+    _, total_sq = rolling_count_sum(values * values, start, end)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = (total_sq - total * total / count) / (count - 1)
+    return np.where(count > 1, np.sqrt(np.maximum(variance, 0.0)), np.nan)
+
+
+class MedianWindow:
+    """
+    Sliding window median of two heaps, the lower half in a max heap and the upper half in a min heap.
+
+    The lower half holds the middle value of an odd sized window. A removed value is deleted lazily once it reaches
+    the top of its heap, and a heap is compacted once it holds more removed than kept values, so each heap holds
+    O(w) values and each insert and remove costs O(log w) for a window of w values.
+    """
+    def __init__(self):
+        # The lower half is kept negated in a min heap
+        self.lower, self.upper = [], []
+        self.lower_size, self.upper_size = 0, 0
+        # Counts of the removed values still in each heap
+        self.lower_removed, self.upper_removed = defaultdict(int), defaultdict(int)
+
+    def __len__(self):
+        return self.lower_size + self.upper_size
+
+    def add(self, value):
+        if self.lower_size == 0 or value <= -self.lower[0]:
+            heapq.heappush(self.lower, -value)
+            self.lower_size += 1
+        else:
+            heapq.heappush(self.upper, value)
+            self.upper_size += 1
+        self._balance()
+
+    def remove(self, value):
+        """Remove a value of the window, from the lower half when it is not above the lower top"""
+        if value <= -self.lower[0]:
+            self.lower_size -= 1
+            self.lower_removed[value] += 1
+            self._prune(self.lower, self.lower_removed, -1, self.lower_size)
+        else:
+            self.upper_size -= 1
+            self.upper_removed[value] += 1
+            self._prune(self.upper, self.upper_removed, 1, self.upper_size)
+        self._balance()
+
+    def median(self):
+        if self.lower_size > self.upper_size:
+            return -self.lower[0]
+        return (-self.lower[0] + self.upper[0]) / 2
+
+    def _balance(self):
+        if self.lower_size > self.upper_size + 1:
+            heapq.heappush(self.upper, -heapq.heappop(self.lower))
+            self.lower_size -= 1
+            self.upper_size += 1
+            self._prune(self.lower, self.lower_removed, -1, self.lower_size)
+        elif self.lower_size < self.upper_size:
+            heapq.heappush(self.lower, -heapq.heappop(self.upper))
+            self.lower_size += 1
+            self.upper_size -= 1
+            self._prune(self.upper, self.upper_removed, 1, self.upper_size)
+
+    @staticmethod
+    def _prune(heap, removed, sign, size):
+        """Pop the removed values off the top of the heap, and compact it once most of its values are removed"""
+        while len(heap) > 0 and removed.get(sign * heap[0], 0) > 0:
+            value = sign * heapq.heappop(heap)
+            removed[value] -= 1
+            if removed[value] == 0:
+                del removed[value]
+
+        if len(heap) > 2 * size + 8:
+            kept = []
+            for item in heap:
+                if removed.get(sign * item, 0) > 0:
+                    removed[sign * item] -= 1
+                else:
+                    kept.append(item)
+            removed.clear()
+            heapq.heapify(kept)
+            heap[:] = kept
+
+
+def rolling_median(values, start, end):
+    """
+    Exact median per window, the mean of the two middle values of an even sized window.
+
+    The window values are kept in a MedianWindow while the window slides forward, so each row costs O(log w) to insert
+    and remove one value from the window of w values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    # The Python loop indexes the lists faster than the numpy arrays
+    valid, items = (~np.isnan(values)).tolist(), values.tolist()
+    start, end = np.asarray(start).tolist(), np.asarray(end).tolist()
+    window = MedianWindow()
+    lower, upper = 0, 0
+    for i in range(len(items)):
+        while upper < end[i]:
+            if valid[upper]:
+                window.add(items[upper])
+            upper += 1
+        while lower < start[i]:
+            if valid[lower]:
+                window.remove(items[lower])
+            lower += 1
+
+        if len(window) > 0:
+            result[i] = window.median()
+    return result
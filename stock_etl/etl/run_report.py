@@ -0,0 +1,178 @@
+"""
+Run report of the ETL steps, a JSON lines file next to the outputs.
+
+Each step of each dataset appends one `step` record with its wall time, the rows and bytes of its inputs and outputs,
+the peak RSS, and the Spark jobs and stages of its job group from the status tracker. The run appends one `run`
+record at its end. The records of one run share its `run_id`.
+"""
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from etl.layout import load_file_stats
+from etl.manifest import get_fingerprint
+
+# Thread local properties of the Spark jobs set by setJobGroup
+JOB_GROUP_PROPERTIES = ['spark.jobGroup.id', 'spark.job.description', 'spark.job.interruptOnCancel']
+
+
+def get_run_report_path(output_data, model_name):
+    return os.path.join(output_data, f'{model_name}_RunReport.jsonl')
+
+
+def get_peak_rss_mb(pid='self'):
+    """Peak resident set size of a process since its last reset, the ru_maxrss of this process without /proc"""
+    try:
+        with open(f'/proc/{pid}/status') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if pid == 'self' else None
+
+
+def reset_peak_rss(pid='self'):
+    """Reset the peak resident set size of a process to its current one, where /proc supports it"""
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as fp:
+            fp.write('5')
+    except OSError:
+        pass
+
+
+def get_children_peak_rss_mb():
+    """Peak resident set size of the largest terminated child process so far, ru_maxrss is in KB on Linux"""
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def get_data_stats(paths):
+    """
+    Rows and bytes of the data paths.
+
+    The rows are summed from the file statistics of the parquet outputs, None when a path has no statistics.
+    """
+    rows, num_bytes = 0, 0
+    for path in paths:
+        file_stats = load_file_stats(path) if os.path.isdir(path) else None
+        if file_stats is None:
+            rows = None
+        elif rows is not None:
+            rows += sum(i['rows'] for i in file_stats)
+        num_bytes += get_fingerprint(path)['bytes']
+    return rows, num_bytes
+
+
+def add_data_stats(record, direction, paths):
+    """Add the `bytes_in` or `bytes_out` of the paths to the record, and their rows only when all of them are known"""
+    rows, record[f'bytes_{direction}'] = get_data_stats(paths)
+    if rows is not None:
+        record[f'rows_{direction}'] = rows
+
+
+def get_jvm_pid(spark):
+    """PID of the Spark JVM launched by this process, None when it attached to a JVM it did not launch"""
+    gateway = getattr(spark.sparkContext, '_gateway', None)
+    return getattr(getattr(gateway, 'proc', None), 'pid', None)
+
+
+def get_spark_jobs(spark, job_group):
+    """Jobs and stages of the job group from the status tracker of the SparkContext"""
+    tracker = spark.sparkContext.statusTracker()
+    jobs, stages = [], []
+    for job_id in sorted(tracker.getJobIdsForGroup(job_group)):
+        job_info = tracker.getJobInfo(job_id)
+        if job_info is None:
+            continue
+        jobs.append({'job_id': job_id, 'status': job_info.status, 'stage_ids': sorted(job_info.stageIds)})
+        for stage_id in sorted(job_info.stageIds):
+            stage_info = tracker.getStageInfo(stage_id)
+            # The stages skipped as their shuffle output is reused have no info
+            if stage_info is not None:
+                stages.append({
+                    'stage_id': stage_id, 'attempt': stage_info.currentAttemptId, 'name': stage_info.name,
+                    'tasks': stage_info.numTasks, 'completed_tasks': stage_info.numCompletedTasks,
+                    'failed_tasks': stage_info.numFailedTasks,
+                })
+    return {
+        'job_group': job_group, 'jobs': jobs, 'stages': stages,
+        'tasks': sum(i['tasks'] for i in stages), 'failed_tasks': sum(i['failed_tasks'] for i in stages),
+    }
+
+
+class RunReport:
+    """
+    JSON lines run report of one ETL run, nothing is written without a path.
+
+    The datasets run their steps from concurrent threads, so the records are appended under a lock.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.started_at = datetime.now()
+        self.run_id = self.started_at.strftime('%Y%m%dT%H%M%S')
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        if self.path is None:
+            return
+        line = json.dumps(dict({'run_id': self.run_id}, **record), default=str)
+        with self._lock, open(self.path, 'a') as fp:
+            fp.write(line + '\n')
+
+    @contextmanager
+    def step(self, spark, stock_type, manifest, exclusive=True):
+        """
+        Measure the step of the manifest, and write its record.
+
+        The record is yielded to the step, which sets the `skipped` status, or the peak RSS of a step run in another
+        process. The Spark jobs of the step run in its own job group. The peak RSS is reset at the start only when the
+        step is `exclusive`, not concurrent with other steps in this process.
+        """
+        record = {'record': 'step', 'stock_type': stock_type, 'step': manifest.step, 'status': 'ok'}
+        add_data_stats(record, 'in', manifest.inputs)
+
+        jvm_pid = get_jvm_pid(spark) if spark is not None else None
+        if exclusive:
+            reset_peak_rss()
+            if jvm_pid is not None:
+                reset_peak_rss(jvm_pid)
+        if spark is not None:
+            job_group = f'{self.run_id}-{stock_type}-{manifest.step}'
+            previous = {i: spark.sparkContext.getLocalProperty(i) for i in JOB_GROUP_PROPERTIES}
+            spark.sparkContext.setJobGroup(job_group, f'{stock_type} {manifest.step}')
+
+        record['started_at'] = datetime.now().isoformat(timespec='seconds')
+        start_time = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record.update(status='failed', error=repr(e))
+            raise
+        finally:
+            record['wall_sec'] = time.perf_counter() - start_time
+            if record['status'] != 'skipped':
+                add_data_stats(record, 'out', manifest.outputs)
+            record.setdefault('peak_rss_mb', get_peak_rss_mb())
+            record.setdefault('children_peak_rss_mb', get_children_peak_rss_mb())
+            if spark is not None:
+                # Restore the job group of the thread, the unset properties are removed with None
+                for key, value in previous.items():
+                    spark.sparkContext.setLocalProperty(key, value)
+                if jvm_pid is not None:
+                    record['jvm_peak_rss_mb'] = get_peak_rss_mb(jvm_pid)
+                record['spark'] = get_spark_jobs(spark, job_group)
+            self.write(record)
+
+    def finish(self, status='ok'):
+        """Write the record of the whole run"""
+        self.write({
+            'record': 'run', 'status': status, 'started_at': self.started_at.isoformat(timespec='seconds'),
+            'wall_sec': (datetime.now() - self.started_at).total_seconds(), 'peak_rss_mb': get_peak_rss_mb(),
+            'children_peak_rss_mb': get_children_peak_rss_mb(),
+        })
+        if self.path is not None:
+            print('Export:', self.path)
@@ -0,0 +1,20 @@
+import pyspark.sql.functions as F
+
+
+def get_symbol_filename(col):
+    """Native column expression of the symbol from the CSV file path, e.g. /path/to/AAPL.csv -> AAPL"""
+    file_name = F.substring_index(col, '/', -1)
+    return file_name.substr(F.lit(1), F.length(file_name) - 4)
+
+
+def get_number_sign(col):
+    """Native column expression of the number sign: +1, 0, -1 or None"""
+    return F.signum(col).cast('int')
+
+
+def get_market_trend(price_sign, volume_sign):
+    """Native column expression of the market trend of the price and volume signs"""
+    return F.when((price_sign > 0) & (volume_sign > 0), 'Bullish') \
+        .when((price_sign > 0) & (volume_sign < 0), 'Weak Buying') \
+        .when((price_sign < 0) & (volume_sign > 0), 'Bearish') \
+        .when((price_sign < 0) & (volume_sign < 0), 'Weak Selling')
@@ -0,0 +1,61 @@
+"""
+Spark backend of the feature registry: the window expressions of the `etl.features` specs.
+"""
+import sys
+
+import pyspark.sql.functions as F
+from pyspark.sql.window import Window
+
+from etl.features import ANNUAL_RATE, ROLLING_KINDS
+from etl.spark.expressions import get_number_sign, get_market_trend
+
+
+def get_windows(features):
+    """Windows of the features per Symbol ordered by TimeStamp, the rolling windows by their days"""
+    symbol_partition = Window.partitionBy('Symbol').orderBy(F.col('TimeStamp'))
+    windows = {
+        'partition': symbol_partition,
+        # Backward rolling window of maximum size per each stock and ETF
+        'backward': symbol_partition.rowsBetween(-sys.maxsize, 0),
+    }
+    for feature in features:
+        if feature.kind in ROLLING_KINDS:
+            windows[feature.window_days] = symbol_partition.rangeBetween(-feature.window_days * 86400, 0)
+    return windows
+
+
+def get_feature_column(feature, windows):
+    """Native column expression of one feature"""
+    sources = [F.col(i) for i in feature.sources]
+    if feature.kind == 'rolling_mean':
+        return F.avg(sources[0]).over(windows[feature.window_days])
+    if feature.kind == 'rolling_median':
+        return F.percentile_approx(sources[0], 0.5).over(windows[feature.window_days])
+    if feature.kind == 'rolling_std':
+        return F.stddev_samp(sources[0]).over(windows[feature.window_days])
+    if feature.kind == 'log':
+        return F.log(sources[0])
+    if feature.kind == 'daily_return':
+        return sources[0] / F.lag(sources[0]).over(windows['partition']) - F.lit(1)
+    if feature.kind == 'annualize':
+        return sources[0] * F.lit(ANNUAL_RATE)
+    if feature.kind == 'sign':
+        return get_number_sign(sources[0])
+    if feature.kind == 'ratio':
+        return sources[0] / sources[1]
+    if feature.kind == 'trend_sign':
+        return get_number_sign(sources[0] - F.lag(sources[0]).over(windows['partition']))
+    if feature.kind == 'market_trend':
+        # The last known trend for the unknown ones
+        return F.last(get_market_trend(sources[0], sources[1]), ignorenulls=True).over(windows['backward'])
+    if feature.kind == 'lead':
+        return F.lead(sources[0]).over(windows['partition'])
+    raise ValueError(f'Unknown feature kind: {feature.kind}')
+
+
+def with_features(df, features):
+    """Add the feature columns to the DataFrame with the TimeStamp seconds column, in the order of the features"""
+    windows = get_windows(features)
+    for feature in features:
+        df = df.withColumn(feature.name, get_feature_column(feature, windows))
+    return df
@@ -0,0 +1,30 @@
+from etl.layout import OutputLayout, write_file_stats
+
+# Bytes of each parquet row group without Row_Group_MB, about a thousand rows of the Step 1 and Step 2 outputs as the
+# pandas engine, so the Date2 statistics skip the unread years rather than one row group spanning the whole history
+ROW_GROUP_BYTES = 128 * 1024
+
+
+def write_output(df, data_path, layout=None, mode='overwrite', dynamic_overwrite=False):
+    """
+    Write the parquet output in the output layout, and its file statistics.
+
+    The rows of each file are sorted by Symbol and Date2, so the row group statistics skip the unread symbols and dates.
+    The clustered layout range partitions the rows by Symbol, so each file holds a distinct range of the symbols.
+    """
+    layout = layout or OutputLayout()
+    if layout.clustered:
+        df = df.repartitionByRange(layout.num_files, 'Symbol') if layout.num_files else df.repartitionByRange('Symbol')
+        writer = df.sortWithinPartitions('Symbol', 'Date2').write
+    else:
+        writer = df.sortWithinPartitions('Symbol', 'Date2').write.partitionBy('Symbol')
+
+    writer = writer.mode(mode).option('compression', layout.compression)
+    row_group_bytes = int(layout.row_group_mb * 1024 * 1024) if layout.row_group_mb is not None else ROW_GROUP_BYTES
+    writer = writer.option('parquet.block.size', row_group_bytes)
+    if dynamic_overwrite:
+        # Only the Symbol partitions of the rows are overwritten
+        writer = writer.option('partitionOverwriteMode', 'dynamic')
+
+    writer.parquet(data_path)
+    write_file_stats(data_path)
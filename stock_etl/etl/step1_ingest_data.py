@@ -1,19 +1,23 @@
 import logging
 import os
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 import pyspark.sql.functions as F
 from pyspark.sql.types import StringType, FloatType, IntegerType, TimestampType
 from pyspark.sql.types import StructType, StructField
 from pyspark.sql.utils import ParseException
 
-from etl.spark.udf import get_symbol_filename_udf
+from etl.diagnostics import show_diagnostics
+from etl.spark.expressions import get_symbol_filename
+from etl.spark.layout import write_output
+from etl.watermark import load_watermarks, save_watermarks, clear_watermarks
 
 logger = logging.getLogger(__name__)
 
 
-def main(spark, stock_csv, symbol_csv, start_date, end_date, data_output_path):
-    schema = StructType([
+def get_csv_schema():
+    """Schema of the daily stock CSV files"""
+    return StructType([
         StructField("Date", StringType()),
         StructField("Open", FloatType()),
         StructField("High", FloatType()),
@@ -23,20 +27,29 @@ def main(spark, stock_csv, symbol_csv, start_date, end_date, data_output_path):
         StructField("Volume", IntegerType())
     ])
 
+
+def main(spark, stock_csv, symbol_csv, start_date, end_date, data_output_path, incremental=False,
+         diagnostics='none', layout=None):
+    """
+    Ingest the daily stock CSV files into the parquet of the output `layout`, partitioned by Symbol by default.
+
+    The `diagnostics` level shows the written output, no extra Spark job runs with the default 'none'.
+
+    In the incremental mode, only the rows newer than the watermark of their symbol are ingested,
+    and appended into the affected Symbol partitions.
+    """
+    schema = get_csv_schema()
+
     try:
         df_daily = spark.read.csv(stock_csv, schema=schema, sep=',', header=True)
     except ParseException as e:
         logger.error(str(e))
         raise e
 
-    df_daily = df_daily.withColumn('Symbol', get_symbol_filename_udf(F.input_file_name())) \
-        .withColumn('Symbol', get_symbol_filename_udf(F.input_file_name())) \
+    df_daily = filter_csv_dates(df_daily, start_date, end_date)
+    df_daily = df_daily.withColumn('Symbol', get_symbol_filename(F.input_file_name())) \
         .withColumn('Date2', F.to_date('Date', 'yyyy-MM-dd'))
 
-    df_daily.printSchema()
-
-    df_daily.summary().show()
-
     date_from, date_to = [
         F.to_date(F.lit(i)).cast(TimestampType()) if i is not None else None for i in [start_date, end_date]
     ]
@@ -50,19 +63,69 @@ def main(spark, stock_csv, symbol_csv, start_date, end_date, data_output_path):
         date_to = date_to + timedelta(days=1)
         df_daily = df_daily.filter(df_daily.Date2 <= date_to)
 
-    logger.info(df_daily.show(10))
+    if incremental:
+        watermarks = load_watermarks(spark, data_output_path)
+        df_daily = filter_new_rows(spark, df_daily, watermarks)
 
     try:
-        df_symbol = spark.read.csv(symbol_csv, sep=',', inferSchema=True, header=True)
+        # Symbol and Security Name are strings, without the extra scan of inferSchema
+        df_symbol = spark.read.csv(symbol_csv, sep=',', header=True)
     except ParseException as e:
         logger.error(str(e))
         raise e
 
     df_out = df_daily.join(df_symbol.select(['Symbol', 'Security Name']), on='Symbol', how='left')
-    print(df_out.show(10))
-    df_out.printSchema()
 
     data_dir = os.path.dirname(data_output_path)
     os.makedirs(data_dir, exist_ok=True)
-    df_out.write.partitionBy('Symbol').mode('overwrite').parquet(data_output_path)
-    print('Export:', data_output_path)
+    if not incremental:
+        write_output(df_out, data_output_path, layout)
+        print('Export:', data_output_path)
+        clear_watermarks(data_output_path)
+        show_diagnostics(spark, data_output_path, diagnostics)
+        return
+
+    df_out = df_out.cache()
+    df_mark = df_out.groupBy('Symbol').agg(F.max('Date2').alias('Watermark'))
+    new_watermarks = {row.Symbol: str(row.Watermark) for row in df_mark.collect()}
+    if len(new_watermarks) == 0:
+        print('No new rows to ingest:', data_output_path)
+        df_out.unpersist()
+        return
+
+    # Only the Symbol partitions of the new rows get new files
+    write_output(df_out, data_output_path, layout, mode='append')
+    df_out.unpersist()
+    print(f'Export: {data_output_path} - {len(new_watermarks)} symbols')
+
+    watermarks.update(new_watermarks)
+    save_watermarks(data_output_path, watermarks)
+    show_diagnostics(spark, data_output_path, diagnostics)
+
+
+def filter_csv_dates(df_daily, start_date, end_date):
+    """
+    Filter the raw yyyy-MM-dd Date strings of the CSV rows, the same range as the Date2 filters.
+
+    The string comparisons are pushed down into the CSV scan, so the rows out of range are dropped while parsing.
+    """
+    if start_date is not None:
+        date_from = datetime.strptime(start_date, '%Y-%m-%d').date() - timedelta(days=30)
+        df_daily = df_daily.filter(F.col('Date') >= F.lit(date_from.isoformat()))
+
+    if end_date is not None:
+        date_to = datetime.strptime(end_date, '%Y-%m-%d').date() + timedelta(days=1)
+        df_daily = df_daily.filter(F.col('Date') <= F.lit(date_to.isoformat()))
+    return df_daily
+
+
+def filter_new_rows(spark, df_daily, watermarks):
+    """Keep the rows newer than the watermark of their symbol"""
+    if len(watermarks) == 0:
+        return df_daily
+
+    df_mark = spark.createDataFrame(list(watermarks.items()), ['Symbol', 'Watermark']) \
+        .withColumn('Watermark', F.to_date('Watermark'))
+    return df_daily.join(F.broadcast(df_mark), on='Symbol', how='left') \
+        .filter(F.col('Watermark').isNull() | (F.col('Date2') > F.col('Watermark'))) \
+        .drop('Watermark')
@@ -1,95 +1,62 @@
 import logging
-import math
 import os
-import sys
-from pyspark.sql.window import Window
+from datetime import datetime, timedelta
+from functools import partial
 from pyspark.sql import functions as F
-from pyspark.sql.types import TimestampType
-from etl.spark.udf import get_number_sign_udf, get_market_trend_udf
+from pyspark.sql.types import TimestampType, StructType, StructField, DoubleType
+from etl.spark.features import with_features
+from etl.features import FEATURES, FEATURE_NAMES, ROLLING_KINDS, get_features, get_dependencies
+from etl.features import compute_features_pandas
+from etl.diagnostics import show_diagnostics
+from etl.layout import select_files
+from etl.spark.layout import write_output
+from etl.watermark import load_watermarks, save_watermarks, clear_watermarks
+from etl.rolling import LOOKBACK_DAYS
 
 logger = logging.getLogger(__name__)
 
+# Features of the 30 days rolling window computed by the feature engine
+ROLLING_FEATURES = [i.name for i in FEATURES if i.kind in ROLLING_KINDS]
 
-def main(spark, stock_price_daily, stock_price_staging, start_date, end_date):
+
+def main(spark, stock_price_daily, stock_price_staging, start_date, end_date, incremental=False,
+         feature_engine='window', diagnostics='none', layout=None):
+    """
+    Extract the features of the daily stock prices into the staging parquet of the output `layout`, partitioned by
+    Symbol by default.
+
+    The rolling features are computed with the Spark window expressions of `feature_engine='window'`, or exactly
+    per symbol with the pandas engine of `feature_engine='pandas'`.
+
+    In the incremental mode, only the symbols with rows newer than the staging watermark are processed. Their features
+    are recomputed over the trailing lookback window plus the new rows, and merged into the rewritten Symbol partitions.
+
+    The `diagnostics` level shows the written output, no extra Spark job runs with the default 'none'.
+    """
     try:
-        df_daily = spark.read.parquet(stock_price_daily)
+        df_daily = read_lookback_files(spark, stock_price_daily, start_date, end_date)
     except Exception as e:
         logger.warning(f'file {stock_price_daily} does not exists!')
         raise e
 
-    df_daily.printSchema()
+    df_daily = filter_lookback_dates(df_daily, start_date, end_date)
 
-    # we need this timestampGMT as seconds for our Window time frame
-    # df_daily = df_daily.withColumn('TimeStamp', F.unix_timestamp(F.to_timestamp('Date')).cast('long'))
-    df_daily = df_daily.withColumn('TimeStamp', F.unix_timestamp('Date2').cast('long'))
+    if incremental:
+        ingest_watermarks = load_watermarks(spark, stock_price_daily)
+        staging_watermarks = load_watermarks(spark, stock_price_staging)
+        updates = {
+            symbol: staging_watermarks.get(symbol) for symbol, watermark in ingest_watermarks.items()
+            if staging_watermarks.get(symbol) is None or watermark > staging_watermarks[symbol]
+        }
+        if len(updates) == 0:
+            print('No new rows to extract the features:', stock_price_staging)
+            return
 
-    # Total seconds of selected days
-    days = lambda i: i * 86400
+        df_updates = spark.createDataFrame(list(updates.items()), 'Symbol string, Staged_Date string') \
+            .withColumn('Staged_Date', F.to_date('Staged_Date'))
+        df_daily = select_lookback_rows(df_daily, df_updates)
 
-    # 252 - number of trading days in a year
-    annual_rate = math.sqrt(252)
-
-    # we need this timestampGMT as seconds for our Window time frame
-    # Define the window partition by Symbol order by TimeStamp
-    symbol_partition = Window.partitionBy('Symbol').orderBy(F.col("TimeStamp"))
-
-    # Rolling window of 30 days per each stock and ETF
-    symbol_30days_win = symbol_partition.rangeBetween(-days(30), 0)
-
-    # Backward rolling window of maximum size per each stock and ETF
-    symbol_backward_win = symbol_partition.rowsBetween(-sys.maxsize, 0)
-
-    def get_median(col_name, win):
-        """Calculate the median value over the rolling window"""
-        return F.percentile_approx(col_name, 0.5).over(win)
-
-    def get_avg(col_name, win):
-        """Calculate the mean value over the rolling window"""
-        return F.avg(col_name).over(win)
-
-    def get_daily_return(col_name, win):
-        """Calculate the stock price return value"""
-        return F.col(col_name) / F.lag(col_name).over(win) - F.lit(1)
-
-    def get_std(col_name, win):
-        """Calculate the sample standard deviation value over the rolling window"""
-        return F.stddev_samp(col_name).over(win)
-
-    def get_annual_std(col_name):
-        """Calculate the annualized standard deviation value"""
-        return F.col(col_name) * F.lit(annual_rate)
-
-    def get_price_volume_ration(col_price, col_volume):
-        """Calculate the radio of High price and Volume"""
-        return F.col(col_price) / F.col(col_volume)
-
-    def get_trend_sign(col_name, win):
-        """Calculate the trend sign: +1, -1 or None"""
-        return get_number_sign_udf(F.col(col_name) - F.lag(col_name).over(win))
-
-    def get_lead_value(col_name, win):
-        """Forward filled value over the rolling windows"""
-        return F.lead(col_name).over(win)
-
-    def get_backward_filled(col_name, win):
-        """Backward filled value over the rolling windows"""
-        return F.last(col_name, ignorenulls=True).over(win)
-
-    # Extract the features
-    df_daily = df_daily.withColumn('vol_moving_avg', get_avg('Volume', symbol_30days_win)) \
-        .withColumn('vol_moving_avg_log', F.log('vol_moving_avg')) \
-        .withColumn('adj_close_rolling_med', get_median('Adj Close', symbol_30days_win)) \
-        .withColumn('adj_close_return', get_daily_return('Adj Close', symbol_partition)) \
-        .withColumn('adj_close_daily_std', get_std('adj_close_return', symbol_30days_win)) \
-        .withColumn('adj_close_annual_std', get_annual_std('adj_close_daily_std')) \
-        .withColumn('adj_close_trend_flag', get_number_sign_udf(F.col('adj_close_return'))) \
-        .withColumn('high_vol_ratio', get_price_volume_ration('High', 'Volume')) \
-        .withColumn('vol_trend_flag', get_trend_sign('Volume', symbol_partition)) \
-        .withColumn('market_trend', get_market_trend_udf(F.col('adj_close_trend_flag'), F.col('vol_trend_flag'))) \
-        .withColumn('market_trend', get_backward_filled('market_trend', symbol_backward_win)) \
-        .withColumn('future_adj_close', get_lead_value('Adj Close', symbol_partition)) \
-        .withColumn('future_volume', get_lead_value('Volume', symbol_partition)) \
-        .withColumn('future_volume_log', F.log('future_volume'))
+    df_daily = extract_features(df_daily, feature_engine)
 
     columns = [
         'Symbol', "Date", 'Volume', 'vol_moving_avg', 'vol_moving_avg_log', 'future_volume', 'future_volume_log',
@@ -107,9 +74,106 @@ def main(spark, stock_price_daily, stock_price_staging, start_date, end_date):
     if end_date is not None:
         df_daily = df_daily.filter(df_daily.TimeStamp <= F.unix_timestamp(date_to))
 
-    df_daily.select(columns).show(20)
     df_daily = df_daily.drop('TimeStamp')
 
     data_dir = os.path.dirname(stock_price_staging)
     os.makedirs(data_dir, exist_ok=True)
-    df_daily.write.partitionBy('Symbol').mode("overwrite").parquet(stock_price_staging)
+    if not incremental:
+        write_output(df_daily, stock_price_staging, layout)
+        clear_watermarks(stock_price_staging)
+    else:
+        write_incremental(spark, df_daily, df_updates, stock_price_staging, layout)
+        staging_watermarks.update({symbol: ingest_watermarks[symbol] for symbol in updates})
+        save_watermarks(stock_price_staging, staging_watermarks)
+
+    show_diagnostics(spark, stock_price_staging, diagnostics, columns)
+
+
+def get_lookback_range(start_date, end_date):
+    """Date range of the rows read for the features of [start_date, end_date]"""
+    date_from, date_to = [datetime.strptime(i, '%Y-%m-%d').date() if i is not None else None
+                          for i in [start_date, end_date]]
+    if date_from is not None:
+        date_from = date_from - timedelta(days=LOOKBACK_DAYS)
+    if date_to is not None:
+        # The day after the end date is kept for the future values, the same as Step 1
+        date_to = date_to + timedelta(days=1)
+    return date_from, date_to
+
+
+def read_lookback_files(spark, stock_price_daily, start_date, end_date):
+    """
+    Read the daily stock prices, only the files of the lookback date range when the output has file statistics.
+
+    The selected files are read without listing all the Symbol partitions of the output.
+    """
+    date_from, date_to = get_lookback_range(start_date, end_date)
+    files = select_files(stock_price_daily, date_from=date_from, date_to=date_to)
+    if not files:
+        return spark.read.parquet(stock_price_daily)
+    return spark.read.option('basePath', stock_price_daily).parquet(*files)
+
+
+def filter_lookback_dates(df_daily, start_date, end_date):
+    """
+    Read only the rows of [start_date - lookback, end_date + 1 day] for the features of [start_date, end_date].
+
+    The Date2 filters are pushed down into the parquet scan, and skip the row groups out of range.
+    """
+    if start_date is not None:
+        df_daily = df_daily.filter(F.col('Date2') >= F.date_sub(F.to_date(F.lit(start_date)), LOOKBACK_DAYS))
+
+    if end_date is not None:
+        # The day after the end date is kept for the future values, the same as Step 1
+        df_daily = df_daily.filter(F.col('Date2') <= F.date_add(F.to_date(F.lit(end_date)), 1))
+    return df_daily
+
+
+def select_lookback_rows(df_daily, df_updates):
+    """
+    Select the rows of the updated symbols from the lookback window before their staged date.
+
+    The lookback covers the 30 days rolling window and the lag of its first row.
+    """
+    return df_daily.join(F.broadcast(df_updates), on='Symbol', how='inner') \
+        .filter(F.col('Staged_Date').isNull() | (F.col('Date2') >= F.date_sub('Staged_Date', LOOKBACK_DAYS)))
+
+
+def write_incremental(spark, df_features, df_updates, stock_price_staging, layout=None):
+    """Merge the recomputed rows into the staging data, and rewrite only the affected Symbol partitions"""
+    # The rows from the staged date are recomputed, as the future values of the staged date change
+    df_features = df_features.filter(F.col('Staged_Date').isNull() | (F.col('Date2') >= F.col('Staged_Date')))
+
+    if os.path.exists(stock_price_staging):
+        df_staged = spark.read.parquet(stock_price_staging) \
+            .join(F.broadcast(df_updates), on='Symbol', how='inner') \
+            .filter(F.col('Date2') < F.col('Staged_Date'))
+        df_features = df_features.unionByName(df_staged)
+
+    # Materialize the merged rows before their source partitions are overwritten
+    df_features = df_features.drop('Staged_Date').localCheckpoint(eager=True)
+    write_output(df_features, stock_price_staging, layout, dynamic_overwrite=True)
+    print('Export:', stock_price_staging)
+
+
+def extract_features(df_daily, feature_engine='window'):
+    """Extract the window features per Symbol ordered by date, the features of the registry"""
+    if feature_engine not in ['window', 'pandas']:
+        raise ValueError(f'Unknown feature engine: {feature_engine}')
+
+    # we need this timestampGMT as seconds for our Window time frame
+    # df_daily = df_daily.withColumn('TimeStamp', F.unix_timestamp(F.to_timestamp('Date')).cast('long'))
+    df_daily = df_daily.withColumn('TimeStamp', F.unix_timestamp('Date2').cast('long'))
+    columns = df_daily.columns + FEATURE_NAMES
+
+    features = get_features()
+    if feature_engine == 'pandas':
+        # Exact rolling statistics over the sorted rows of each symbol, by the NumPy backend
+        rolling_features = get_features(ROLLING_FEATURES)
+        df_daily = with_features(df_daily, get_dependencies(rolling_features))
+        schema = StructType(df_daily.schema.fields + [StructField(i, DoubleType()) for i in ROLLING_FEATURES])
+        df_daily = df_daily.groupBy('Symbol').applyInPandas(
+            partial(compute_features_pandas, names=ROLLING_FEATURES), schema)
+        features = [i for i in features if i.name not in df_daily.columns]
+
+    return with_features(df_daily, features).select(columns)
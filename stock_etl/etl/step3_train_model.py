@@ -1,7 +1,11 @@
 import joblib
+import multiprocessing
 import os
+import tempfile
+import time
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
 from sklearn.model_selection import train_test_split
@@ -10,6 +14,10 @@ from sklearn.metrics import mean_absolute_error, mean_squared_error
 
 from sklearn.feature_selection import SelectKBest
 from sklearn.feature_selection import mutual_info_regression
+
+from etl.forest_arrays import export_forest_arrays, get_forest_arrays_path
+from etl.run_report import get_peak_rss_mb
+from etl.train_data import load_train_data, TrainData
 # from sklearn import tree
 
 # import matplotlib.pyplot as plt
@@ -56,52 +64,84 @@ class StockPredictor:
             return self.model.predict(best_features)
 
 
-def main(model_output, staging_data_path, predictors):
-    # Load the staging parquet
-    data_df = pd.read_parquet(staging_data_path)
-    #
-    # Assume `data` is loaded as a Pandas DataFrame
-    data_df['Date'] = pd.to_datetime(data_df['Date'])
-    data_df.set_index('Date', inplace=True)
-
-    # Remove rows with NaN values
-    data_df.dropna(inplace=True)
+def main(model_output, staging_data_path, predictors, memory_budget_mb=None, cpu_budget=None):
+    """
+    Train the regression model of each predictor.
 
-    if 'adj_close_rolling_med' in data_df.columns:
-        # Remove the adj_close_rolling_med with negative or big numbers
-        selected_price = ((data_df['adj_close_rolling_med'] > 0) & (data_df['adj_close_rolling_med'] < 1000000))
-        data_df = data_df[selected_price]
+    Without `cpu_budget`, the predictors are trained one by one in this process. With `cpu_budget`, they are trained
+    concurrently in separate processes over the memory-mapped training data, each forest fitting with the `n_jobs`
+    share of the CPU budget.
+    """
+    # Load the columns of the predictors from the staging parquet, without the rows with NaN values in any column
+    # or the adj_close_rolling_med with negative or big numbers
+    train_data = load_train_data(staging_data_path, predictors, memory_budget_mb, RADOM_STATE)
 
+    tasks = []
     for config_dict in predictors:
         predict_model_path = f'{model_output}_{config_dict["Target_Name"]}_Model.joblib'
         feat_columns = config_dict['Target_Features']
         num_features = config_dict.get('Num_Features')
         n_estimators = config_dict.get('N_Estimators', 40)
+        tasks.append((predict_model_path, feat_columns, num_features, n_estimators))
+
+    if cpu_budget is None:
+        for task in tasks:
+            build_predict_model(task[0], train_data, *task[1:])
+        return
+
+    concurrency = max(1, min(len(tasks), cpu_budget))
+    n_jobs = max(1, cpu_budget // concurrency)
+    print(f'Train {len(tasks)} predictors: {concurrency} at a time, n_jobs {n_jobs}')
+    with tempfile.TemporaryDirectory(prefix='train_data_') as data_dir:
+        train_data.save(data_dir)
+        mp_context = multiprocessing.get_context('spawn')
+
+        def train_predictor(task):
+            # A new process per predictor, so its peak RSS is reported alone
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as executor:
+                executor.submit(build_shared_predict_model, data_dir, *task, n_jobs).result()
 
-        build_predict_model(predict_model_path, data_df, feat_columns, num_features, n_estimators)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(train_predictor, tasks))
 
 
-def build_predict_model(predict_model_path, data_df, feat_columns, num_features, n_estimators):
+def build_shared_predict_model(data_dir, predict_model_path, feat_columns, num_features, n_estimators, n_jobs):
+    """Train a predictor over the training data memory-mapped read-only from `data_dir`"""
+    train_data = TrainData.load(data_dir, mmap_mode='r')
+    build_predict_model(predict_model_path, train_data, feat_columns, num_features, n_estimators, n_jobs,
+                        own_process=True)
+
+
+def build_predict_model(predict_model_path, train_data, feat_columns, num_features, n_estimators, n_jobs=None,
+                        own_process=False):
+    """
+    Train, save and evaluate the model of a predictor.
+
+    With `own_process`, the model is trained alone in its process, and the peak RSS of the process is reported as
+    its `Peak RSS`. Otherwise it is the `Process Peak RSS` so far, of the training data and all the models before.
+    """
+    start_time = time.perf_counter()
     print(f'feat_columns: {len(feat_columns)} - {feat_columns}')
+    data_df = train_data.to_frame(feat_columns)
     if data_df.shape[0] > 5000:
-        price_df = data_df[feat_columns].sample(n=3000, random_state=RADOM_STATE)
+        price_df = data_df.sample(n=3000, random_state=RADOM_STATE)
         desc_df = price_df.describe().reset_index()
     else:
-        desc_df = data_df[feat_columns].describe().reset_index()
+        desc_df = data_df.describe().reset_index()
 
     print(desc_df)
     train_columns = feat_columns[1:]
     target = feat_columns[0]
 
-    X = data_df[train_columns].to_numpy()
-    y = data_df[target].to_numpy()
+    X = train_data.get_features(train_columns)
+    y = train_data.get_column(target)
     # Split data into train and test sets
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=RADOM_STATE)
     print(f'Split the train data: {len(X_train)} - test data: {len(X_test)}')
 
     # Define the StockPredictor
     # # Create a RandomForest Regressoion model
-    stock_predictor = RandomForestRegressor(n_estimators=n_estimators, random_state=RADOM_STATE)
+    stock_predictor = RandomForestRegressor(n_estimators=n_estimators, random_state=RADOM_STATE, n_jobs=n_jobs)
     # stock_predictor, best_features = select_best_features(X_train, y_train, train_columns, num_features, n_estimators)
 
     # Descriptive statistics for each column
@@ -109,10 +149,16 @@ def build_predict_model(predict_model_path, data_df, feat_columns, num_features,
 
     # Train the model
     stock_predictor.fit(X_train, y_train)
+    # Predict single threaded in the API, the trees are the same whatever n_jobs fitted them
+    stock_predictor.set_params(n_jobs=None)
     # Save the model
     joblib.dump(stock_predictor, predict_model_path)
     print('Save the regression model:', predict_model_path)
 
+    # Export the forest arrays for the compiled inference engine of the API
+    forest_output = get_forest_arrays_path(predict_model_path)
+    export_forest_arrays(stock_predictor, forest_output)
+
     # Load the model
     loaded_model = joblib.load(predict_model_path)
     print('Load the regression model:', predict_model_path)
@@ -125,6 +171,8 @@ def build_predict_model(predict_model_path, data_df, feat_columns, num_features,
         f'Target: {target}',
         f'Train Features: {train_columns}',
     ]
+    if train_data.sampled:
+        train_output.append(f'Sampled data: {len(train_data)} of {train_data.num_rows}')
 
     # if best_features is not None:
     #     train_output.append(f'Best Features: {best_features}')
@@ -141,6 +189,12 @@ def build_predict_model(predict_model_path, data_df, feat_columns, num_features,
             f'Root Mean Squared Error: {np.sqrt(mse)}',
         ])
 
+    train_output.extend([
+        f'N Jobs: {n_jobs}',
+        f'Wall Time: {time.perf_counter() - start_time:.3f}s',
+        f'{"Peak RSS" if own_process else "Process Peak RSS"}: {get_peak_rss_mb():.1f} MB',
+    ])
+
     print('Train metrics:', train_output)
     output_df = pd.DataFrame({'Metrics': train_output})
     metrix_dict = {
@@ -0,0 +1,192 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from etl.layout import select_files
+
+# Range of the valid adj_close_rolling_med values, the negative or big numbers are removed
+ROLLING_MED_RANGE = (0, 1000000)
+
+# Rows of each record batch read from the staging parquet
+BATCH_SIZE = 64 * 1024
+
+
+class TrainData:
+    """
+    Compact training data of the predictors.
+
+    The feature columns are kept in one float32 matrix, the same precision as the sklearn trees split on,
+    and the target columns in float64 vectors.
+    """
+    def __init__(self, columns, matrix, targets, num_rows, sampled=False):
+        self.columns = columns
+        self.matrix = matrix
+        self.targets = targets
+        self.num_rows = num_rows
+        self.sampled = sampled
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def get_features(self, columns):
+        if all(i in self.columns for i in columns):
+            return self.matrix[:, [self.columns.index(i) for i in columns]]
+        return np.column_stack([self.get_column(i) for i in columns]).astype(np.float32)
+
+    def get_column(self, name):
+        if name in self.targets:
+            return self.targets[name]
+        return self.matrix[:, self.columns.index(name)]
+
+    def to_frame(self, columns):
+        return pd.DataFrame({i: self.get_column(i) for i in columns})
+
+    def save(self, data_dir):
+        """Save the arrays as .npy files, which the training processes memory-map instead of copying"""
+        np.save(os.path.join(data_dir, 'matrix.npy'), self.matrix)
+        for i, name in enumerate(self.targets):
+            np.save(os.path.join(data_dir, f'target_{i}.npy'), self.targets[name])
+
+        meta = {'columns': self.columns, 'targets': list(self.targets), 'num_rows': self.num_rows,
+                'sampled': self.sampled}
+        with open(os.path.join(data_dir, 'train_data.json'), 'w') as fp:
+            json.dump(meta, fp)
+
+    @classmethod
+    def load(cls, data_dir, mmap_mode='r'):
+        with open(os.path.join(data_dir, 'train_data.json')) as fp:
+            meta = json.load(fp)
+
+        matrix = np.load(os.path.join(data_dir, 'matrix.npy'), mmap_mode=mmap_mode)
+        targets = {
+            name: np.load(os.path.join(data_dir, f'target_{i}.npy'), mmap_mode=mmap_mode)
+            for i, name in enumerate(meta['targets'])
+        }
+        return cls(meta['columns'], matrix, targets, meta['num_rows'], meta['sampled'])
+
+
+class Reservoir:
+    """
+    Uniform sample of at most `size` rows of a stream of batches, the reservoir sampling Algorithm R.
+    """
+    def __init__(self, size, random_state=None):
+        self.size = size
+        self.seen = 0
+        self.rng = np.random.default_rng(random_state)
+        self.rows = None
+
+    def add(self, rows):
+        num_rows = rows.shape[0]
+        if self.rows is None:
+            self.rows = np.empty((self.size, rows.shape[1]), dtype=rows.dtype)
+
+        # Fill the reservoir first
+        filled = min(max(self.size - self.seen, 0), num_rows)
+        self.rows[self.seen:self.seen + filled] = rows[:filled]
+
+        # Then the row t of the stream replaces a random row of the reservoir with the probability size / (t + 1)
+        rest = rows[filled:]
+        stream_index = np.arange(self.seen + filled, self.seen + num_rows)
+        slots = (self.rng.random(len(rest)) * (stream_index + 1)).astype(np.int64)
+        replaced = np.flatnonzero(slots < self.size)
+        if len(replaced) > 0:
+            # The later row of the batch wins over the earlier ones of the same slot, as if added one by one
+            _, last = np.unique(slots[replaced][::-1], return_index=True)
+            replaced = replaced[len(replaced) - 1 - last]
+            self.rows[slots[replaced]] = rest[replaced]
+
+        self.seen += num_rows
+
+    def get_rows(self):
+        if self.rows is None:
+            return None
+        return self.rows[:min(self.seen, self.size)]
+
+
+def get_missing_rows(batch):
+    """Mask of the rows with a null or NaN value in any column, the same rows as the pandas dropna removes"""
+    missing = np.zeros(batch.num_rows, dtype=bool)
+    for column in batch.columns:
+        if column.null_count > 0 or pa.types.is_floating(column.type):
+            missing |= pc.is_null(column, nan_is_null=True).to_numpy(zero_copy_only=False)
+    return missing
+
+
+def iter_batches(staging_data_path, columns):
+    """
+    Read the staging parquet one row group batch at a time, as the float64 rows of the columns and the mask of the
+    rows with a missing value in any column of the parquet.
+
+    The files are taken from the file statistics of the output when it has them, without listing its directories.
+    """
+    files = select_files(staging_data_path)
+    if not files:
+        dataset = ds.dataset(staging_data_path, format='parquet', partitioning='hive')
+    else:
+        dataset = ds.dataset(files, format='parquet', partitioning='hive', partition_base_dir=staging_data_path)
+    # All the columns are read for the missing values, but only the rows of the given columns are kept
+    for batch in dataset.to_batches(batch_size=BATCH_SIZE):
+        rows = np.column_stack([batch.column(i).to_numpy(zero_copy_only=False) for i in columns]).astype(np.float64)
+        yield rows, get_missing_rows(batch)
+
+
+def select_rows(rows, columns, missing):
+    """Remove the rows with a missing value in any column, and the adj_close_rolling_med out of range"""
+    selected = ~missing
+    if 'adj_close_rolling_med' in columns:
+        rolling_med = rows[:, columns.index('adj_close_rolling_med')]
+        with np.errstate(invalid='ignore'):
+            selected &= (rolling_med > ROLLING_MED_RANGE[0]) & (rolling_med < ROLLING_MED_RANGE[1])
+    return rows[selected]
+
+
+def load_train_data(staging_data_path, predictors, memory_budget_mb=None, random_state=None):
+    """
+    Load the columns of the predictors from the staging parquet in batches.
+
+    The same as the pandas dropna of the whole staging data, a row with a missing value in any of its columns is
+    removed, even in a column which no predictor uses. The rows are filtered batch by batch, so only the selected
+    rows of the needed columns are kept in memory.
+    When the selected rows exceed `memory_budget_mb`, a uniform reservoir sample of them is kept instead.
+    """
+    target_columns = list(dict.fromkeys(i['Target_Features'][0] for i in predictors))
+    columns = list(dict.fromkeys(j for i in predictors for j in i['Target_Features'][1:]))
+    columns = [i for i in columns if i not in target_columns]
+    read_columns = columns + target_columns
+    if 'adj_close_rolling_med' not in read_columns:
+        read_columns.append('adj_close_rolling_med')
+
+    max_rows = None
+    if memory_budget_mb is not None:
+        # The reservoir keeps the float64 rows of the features and targets
+        row_bytes = 8 * (len(columns) + len(target_columns))
+        max_rows = int(memory_budget_mb * 1024 * 1024 // row_bytes)
+
+    reservoir = Reservoir(max_rows, random_state) if max_rows is not None else None
+    feature_chunks, target_chunks = [], []
+    num_rows = 0
+    for rows, missing in iter_batches(staging_data_path, read_columns):
+        rows = select_rows(rows, read_columns, missing)
+        num_rows += len(rows)
+        if reservoir is not None:
+            reservoir.add(rows[:, :len(columns) + len(target_columns)])
+        else:
+            feature_chunks.append(rows[:, :len(columns)].astype(np.float32))
+            target_chunks.append(rows[:, len(columns):len(columns) + len(target_columns)])
+
+    if reservoir is not None and reservoir.get_rows() is not None:
+        rows = reservoir.get_rows()
+        feature_chunks, target_chunks = [rows[:, :len(columns)].astype(np.float32)], [rows[:, len(columns):]]
+
+    matrix = np.concatenate(feature_chunks) if feature_chunks else np.empty((0, len(columns)), dtype=np.float32)
+    target_rows = np.concatenate(target_chunks) if target_chunks else np.empty((0, len(target_columns)))
+
+    targets = {name: np.ascontiguousarray(target_rows[:, i]) for i, name in enumerate(target_columns)}
+    sampled = reservoir is not None and num_rows > max_rows
+    print(f'Load the train data: {staging_data_path} - {len(matrix)} of {num_rows} rows')
+    return TrainData(columns, matrix, targets, num_rows, sampled)
@@ -0,0 +1,52 @@
+import json
+import logging
+import os
+
+import pyspark.sql.functions as F
+
+from etl.layout import get_symbol_dates
+
+logger = logging.getLogger(__name__)
+
+
+def get_watermark_path(data_path):
+    """The watermark file is kept next to the parquet output, so an overwrite of the output keeps it"""
+    return f'{data_path}_Watermark.json'
+
+
+def load_watermarks(spark, data_path):
+    """
+    Load the latest date of each symbol in the parquet output.
+
+    The watermarks are derived from the parquet output when the watermark file does not exist yet, from its file
+    statistics when each file holds one symbol.
+    """
+    watermark_path = get_watermark_path(data_path)
+    if os.path.exists(watermark_path):
+        with open(watermark_path) as fp:
+            return json.load(fp)
+
+    if not os.path.exists(data_path):
+        return {}
+
+    symbol_dates = get_symbol_dates(data_path)
+    if symbol_dates is not None:
+        return symbol_dates
+
+    logger.info(f'Derive the watermarks from {data_path}')
+    df_mark = spark.read.parquet(data_path).groupBy('Symbol').agg(F.max('Date2').alias('Watermark'))
+    return {row.Symbol: str(row.Watermark) for row in df_mark.collect() if row.Watermark is not None}
+
+
+def save_watermarks(data_path, watermarks):
+    watermark_path = get_watermark_path(data_path)
+    with open(watermark_path, 'w') as fp:
+        json.dump(watermarks, fp, indent=2, sort_keys=True)
+    print('Export:', watermark_path)
+
+
+def clear_watermarks(data_path):
+    """Remove the watermark file after a full rewrite, so the next incremental run derives it from the output"""
+    watermark_path = get_watermark_path(data_path)
+    if os.path.exists(watermark_path):
+        os.remove(watermark_path)
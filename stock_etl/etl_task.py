@@ -1,41 +1,209 @@
 import argparse
 import json
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+from etl.diagnostics import get_diagnostics_level
+from etl.forest_arrays import get_forest_arrays_path
+from etl.layout import OutputLayout
+from etl.manifest import StepManifest
+from etl.run_report import RunReport, get_run_report_path, get_peak_rss_mb, get_children_peak_rss_mb
 from etl.spark.session import start_spark
 from etl import step1_ingest_data, step2_extract_features, step3_train_model
+from etl.local import step1_ingest_data as local_step1_ingest_data
+from etl.local import step2_extract_features as local_step2_extract_features
 
 try:
     from json.decoder import JSONDecodeError
 except ImportError:
     JSONDecodeError = ValueError
 
+# Configuration keys which change the output of each step, recorded in the step manifests
+STEP_CONFIG_KEYS = {
+    'Step1': ['Start_Date', 'End_Date', 'Incremental', 'Engine', 'Output_Layout', 'Compression', 'Row_Group_MB',
+              'Output_Files'],
+    'Step2': ['Start_Date', 'End_Date', 'Incremental', 'Engine', 'Feature_Engine', 'Output_Layout', 'Compression',
+              'Row_Group_MB', 'Output_Files'],
+    'Step3': ['Predictors', 'Train_Memory_MB'],
+}
 
-def start_etl_task(spark, stock_config, output_data, output_model):
+
+def start_etl_task(spark, stock_config, output_data, output_model, run_report=None):
     # Define the Stock ETL configure
-    model_name = stock_config['Model_Name']
+    parallelism = get_parallelism(stock_config)
+    if get_engine(stock_config) == 'pandas' and stock_config.get('Incremental', False):
+        raise ValueError('Incremental mode is only supported by the spark engine.')
+    if get_output_layout(stock_config).clustered and stock_config.get('Incremental', False):
+        raise ValueError('Incremental mode is only supported by the partitioned output layout.')
+
+    stock_data = list(stock_config['Stock_Data'].items())
+    if parallelism == 1:
+        for stock_type, stock_csv in stock_data:
+            run_pipeline(spark, stock_config, stock_type, stock_csv, output_data, output_model, run_report=run_report)
+        return
+
+    # Submit the Spark jobs of each dataset from its own thread into its FAIR scheduler pool,
+    # and train the models in separate processes, so Step 3 of one dataset does not hold the others
+    train_executor = ProcessPoolExecutor(max_workers=parallelism, mp_context=multiprocessing.get_context('spawn'))
+    with train_executor, ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = [
+            executor.submit(
+                run_pipeline, spark, stock_config, stock_type, stock_csv, output_data, output_model, train_executor,
+                run_report,
+            ) for stock_type, stock_csv in stock_data
+        ]
+        for future in futures:
+            future.result()
+
+
+def run_pipeline(spark, stock_config, stock_type, stock_csv, output_data, output_model, train_executor=None,
+                 run_report=None):
+    """
+    Run the ETL steps of one dataset, Step 3 in the `train_executor` process pool if any.
+
+    Each step appends its record to the `run_report`. The peak RSS of a step is its own only when the datasets run one
+    at a time, without the `train_executor`.
+    """
     symbol_csv = stock_config['Stock_Desc']
     start_date = stock_config.get('Start_Date')
     end_date = stock_config.get('End_Date')
     etl_steps = stock_config.get('ETL_Steps', ['Step1', 'Step2', 'Step3'])
     predictors = stock_config.get('Predictors')
+    incremental = stock_config.get('Incremental', False)
+    feature_engine = stock_config.get('Feature_Engine', 'window')
+    engine = get_engine(stock_config)
+    workers = stock_config.get('Workers')
+    diagnostics = get_diagnostics_level(stock_config.get('Diagnostics'))
+    memory_budget_mb = stock_config.get('Train_Memory_MB')
+    cpu_budget = stock_config.get('CPU_Budget')
+    layout = get_output_layout(stock_config)
+    skip_unchanged = stock_config.get('Skip_Unchanged', False)
+    data_ingest, data_staging, model_output = get_output_paths(stock_config, stock_type, output_data, output_model)
+    run_report = run_report or RunReport()
+    exclusive = train_executor is None
+
+    if spark is not None and train_executor is not None:
+        # The scheduler pool is a thread local property of the jobs submitted from this thread
+        spark.sparkContext.setLocalProperty('spark.scheduler.pool', stock_type)
+
+    # Step 1 - Ingest the CSV file
+    if "Step1" in etl_steps:
+        manifest = get_step_manifest(stock_config, 'Step1', stock_type, stock_csv, output_data, output_model)
+        with run_report.step(spark, stock_type, manifest, exclusive) as record:
+            if manifest.skip(skip_unchanged):
+                record['status'] = 'skipped'
+            else:
+                if engine == 'pandas':
+                    local_step1_ingest_data.main(
+                        stock_csv, symbol_csv, start_date, end_date, data_ingest, workers, layout
+                    )
+                else:
+                    step1_ingest_data.main(
+                        spark, stock_csv, symbol_csv, start_date, end_date, data_ingest, incremental, diagnostics,
+                        layout,
+                    )
+                manifest.save()
+
+    # Step 2 - Feature Engineering
+    if "Step2" in etl_steps:
+        manifest = get_step_manifest(stock_config, 'Step2', stock_type, stock_csv, output_data, output_model)
+        with run_report.step(spark, stock_type, manifest, exclusive) as record:
+            if manifest.skip(skip_unchanged):
+                record['status'] = 'skipped'
+            else:
+                if engine == 'pandas':
+                    local_step2_extract_features.main(data_ingest, data_staging, start_date, end_date, workers, layout)
+                else:
+                    step2_extract_features.main(
+                        spark, data_ingest, data_staging, start_date, end_date, incremental, feature_engine,
+                        diagnostics, layout,
+                    )
+                manifest.save()
+
+    # Step 3 - ML Training
+    if "Step3" in etl_steps and predictors is not None:
+        manifest = get_step_manifest(stock_config, 'Step3', stock_type, stock_csv, output_data, output_model)
+        with run_report.step(None, stock_type, manifest, exclusive) as record:
+            if manifest.skip(skip_unchanged):
+                record['status'] = 'skipped'
+            else:
+                if train_executor is None:
+                    step3_train_model.main(model_output, data_staging, predictors, memory_budget_mb, cpu_budget)
+                else:
+                    # The peak RSS of the training is measured in the process of the pool which ran it
+                    record.update(train_executor.submit(
+                        train_model, model_output, data_staging, predictors, memory_budget_mb, cpu_budget
+                    ).result())
+                manifest.save()
+
 
-    for stock_type, stock_csv in stock_config['Stock_Data'].items():
-        data_ingest = os.path.join(output_data, f'{model_name}-{stock_type}_IngestData')
-        data_staging = os.path.join(output_data, f'{model_name}-{stock_type}_StageData')
-        model_output = os.path.join(output_model, f'{model_name}-{stock_type}')
+def train_model(model_output, data_staging, predictors, memory_budget_mb, cpu_budget):
+    """Run Step 3 in a process of the train pool, and the peak RSS of the process and its children"""
+    step3_train_model.main(model_output, data_staging, predictors, memory_budget_mb, cpu_budget)
+    return {'peak_rss_mb': get_peak_rss_mb(), 'children_peak_rss_mb': get_children_peak_rss_mb()}
 
-        # Step 1 - Ingest the CSV file
-        if "Step1" in etl_steps:
-            step1_ingest_data.main(spark, stock_csv, symbol_csv, start_date, end_date, data_ingest)
 
-        # Step 2 - Feature Engineering
-        if "Step2" in etl_steps:
-            step2_extract_features.main(spark, data_ingest, data_staging, start_date, end_date)
+def get_output_paths(stock_config, stock_type, output_data, output_model):
+    """Outputs of Step 1, Step 2 and the prefix of the Step 3 models of one dataset"""
+    model_name = stock_config['Model_Name']
+    data_ingest = os.path.join(output_data, f'{model_name}-{stock_type}_IngestData')
+    data_staging = os.path.join(output_data, f'{model_name}-{stock_type}_StageData')
+    model_output = os.path.join(output_model, f'{model_name}-{stock_type}')
+    return data_ingest, data_staging, model_output
+
+
+def get_step_manifest(stock_config, step, stock_type, stock_csv, output_data, output_model):
+    """Manifest of a step of one dataset, with the fingerprints of its inputs taken now"""
+    data_ingest, data_staging, model_output = get_output_paths(stock_config, stock_type, output_data, output_model)
+    config = {i: stock_config.get(i) for i in STEP_CONFIG_KEYS[step]}
+    if step == 'Step1':
+        return StepManifest(step, data_ingest, [stock_csv, stock_config['Stock_Desc']], [data_ingest], config)
+    if step == 'Step2':
+        return StepManifest(step, data_staging, [data_ingest], [data_staging], config)
+
+    model_paths = [f'{model_output}_{i["Target_Name"]}_Model.joblib' for i in stock_config.get('Predictors') or []]
+    outputs = [j for i in model_paths for j in [i, get_forest_arrays_path(i)]]
+    return StepManifest(step, model_output, [data_staging], outputs, config)
+
+
+def need_spark(stock_config, output_data, output_model):
+    """Whether any Spark step of the datasets runs, not when all of them are skipped as unchanged"""
+    etl_steps = [i for i in stock_config['ETL_Steps'] if i in ['Step1', 'Step2']]
+    if len(etl_steps) == 0 or get_engine(stock_config) != 'spark':
+        return False
+    if not stock_config.get('Skip_Unchanged', False):
+        return True
+
+    # Step 2 of a dataset is checked against the current Step 1 output, which is kept when Step 1 is skipped too
+    return any(
+        len(get_step_manifest(stock_config, step, stock_type, stock_csv, output_data, output_model).get_changes()) > 0
+        for stock_type, stock_csv in stock_config['Stock_Data'].items() for step in etl_steps
+    )
+
+
+def get_parallelism(stock_config):
+    """Number of the datasets of Stock_Data processed concurrently, one at a time by default"""
+    parallelism = int(stock_config.get('Parallelism', 1))
+    if parallelism < 1:
+        raise ValueError(f'Parallelism must be at least 1: {parallelism}')
+    return min(parallelism, len(stock_config['Stock_Data']))
+
 
-        # Step 3 - ML Training
-        if "Step3" in etl_steps and predictors is not None:
-            step3_train_model.main(model_output, data_staging, predictors)
+def get_engine(stock_config):
+    """Execution engine of Step 1 and Step 2: spark, or pandas without a Spark JVM"""
+    engine = stock_config.get('Engine', 'spark')
+    if engine not in ['spark', 'pandas']:
+        raise ValueError(f'Unknown engine: {engine}')
+    return engine
+
+
+def get_output_layout(stock_config):
+    """Output layout of the Step 1 and Step 2 parquet outputs, the Symbol partitions by default"""
+    return OutputLayout(
+        stock_config.get('Output_Layout', 'partitioned'), stock_config.get('Compression', 'snappy'),
+        stock_config.get('Row_Group_MB'), stock_config.get('Output_Files'),
+    )
 
 
 def main(stock_config, spark_config=None):
@@ -49,17 +217,25 @@ def main(stock_config, spark_config=None):
     if len(output_missed) > 0:
         raise ValueError(f'Output path {", ".join(output_missed)} does not exist.')
 
-    if 'Step1' in stock_config['ETL_Steps'] or 'Step2' in stock_config['ETL_Steps']:
+    if need_spark(stock_config, output_data, output_model):
+        if get_parallelism(stock_config) > 1:
+            # Share the executors between the concurrent datasets
+            spark_config = dict(spark_config or {}, **{'spark.scheduler.mode': 'FAIR'})
         spark = start_spark(model_name, spark_config)
     else:
         spark = None
 
+    # The run report of the steps is appended next to the outputs
+    run_report = RunReport(get_run_report_path(output_data, model_name))
+    status = 'failed'
     try:
-        start_etl_task(spark, stock_config, output_data, output_model)
+        start_etl_task(spark, stock_config, output_data, output_model, run_report)
+        status = 'ok'
         print(f'stock_config: {stock_config}')
         print(f'output_data: {output_data}')
         print(f'output_model: {output_model}')
     finally:
+        run_report.finish(status)
         if spark is not None:
             spark.stop()
 
@@ -0,0 +1,78 @@
+import os
+
+from etl.manifest import StepManifest, get_manifest_path
+
+CONFIG = {'Start_Date': '2019-01-01', 'End_Date': None}
+
+
+def make_step(tmp_path, config=CONFIG):
+    """A step of one input CSV directory and one output directory"""
+    input_path, output_path = tmp_path / 'input', tmp_path / 'output'
+    input_path.mkdir(exist_ok=True)
+    output_path.mkdir(exist_ok=True)
+    if not (input_path / 'AAA.csv').exists():
+        (input_path / 'AAA.csv').write_text('Date,Close\n2019-01-02,1.0\n')
+        (output_path / 'part-00000.parquet').write_bytes(b'rows')
+    return StepManifest('Step1', str(output_path), [str(input_path)], [str(output_path)], config)
+
+
+def run_step(tmp_path, config=CONFIG):
+    manifest = make_step(tmp_path, config)
+    manifest.save()
+    return manifest
+
+
+def touch(path, seconds=10):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+def test_runs_without_manifest(tmp_path):
+    manifest = make_step(tmp_path)
+    assert manifest.get_changes() == ['no manifest of the last run']
+    assert not manifest.skip(True)
+
+
+def test_skips_unchanged_step(tmp_path):
+    run_step(tmp_path)
+    assert os.path.exists(get_manifest_path(str(tmp_path / 'output')))
+
+    manifest = make_step(tmp_path)
+    assert manifest.get_changes() == []
+    assert manifest.skip(True)
+    # The unchanged step still runs without `skip_unchanged`
+    assert not manifest.skip(False)
+
+
+def test_runs_after_input_change(tmp_path):
+    run_step(tmp_path)
+    touch(tmp_path / 'input' / 'AAA.csv')
+    assert make_step(tmp_path).get_changes() == [f'input {tmp_path / "input"} changed']
+
+    run_step(tmp_path)
+    (tmp_path / 'input' / 'BBB.csv').write_text('Date,Close\n')
+    assert not make_step(tmp_path).skip(True)
+
+
+def test_runs_after_config_change(tmp_path):
+    run_step(tmp_path)
+    changes = make_step(tmp_path, dict(CONFIG, End_Date='2020-01-01')).get_changes()
+    assert changes == ['config End_Date changed']
+
+
+def test_runs_after_output_change(tmp_path):
+    run_step(tmp_path)
+    (tmp_path / 'output' / 'part-00000.parquet').write_bytes(b'other rows')
+    assert make_step(tmp_path).get_changes() == [f'output {tmp_path / "output"} changed']
+
+    run_step(tmp_path)
+    os.remove(tmp_path / 'output' / 'part-00000.parquet')
+    assert not make_step(tmp_path).skip(True)
+
+
+def test_input_changed_during_the_step_runs_it_again(tmp_path):
+    # The input fingerprints are taken before the step, so a change during the step is not recorded as seen
+    manifest = make_step(tmp_path)
+    touch(tmp_path / 'input' / 'AAA.csv')
+    manifest.save()
+    assert not make_step(tmp_path).skip(True)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from etl.rolling import WINDOW_30_DAYS, MedianWindow, get_window_bounds, rolling_median
+
+
+def make_series(seed, num_rows, nan_ratio=0.2, trend=0.0):
+    """Daily values of random gaps between the days, with NaN values"""
+    rng = np.random.default_rng(seed)
+    days = np.cumsum(rng.integers(1, 5, num_rows))
+    values = np.round(rng.normal(100, 5, num_rows), 1) + trend * np.arange(num_rows)
+    values[rng.random(num_rows) < nan_ratio] = np.nan
+    return pd.Series(values, index=pd.Timestamp('2019-01-01') + pd.to_timedelta(days, unit='D'))
+
+
+def get_rolling_median(series):
+    timestamps = (series.index - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+    start, end = get_window_bounds(np.asarray(timestamps), WINDOW_30_DAYS)
+    return rolling_median(series.to_numpy(), start, end)
+
+
+@pytest.mark.parametrize('seed, trend', [(0, 0.0), (1, 0.0), (2, 0.5), (3, -0.5)])
+def test_rolling_median_equals_pandas(seed, trend):
+    series = make_series(seed, 500, trend=trend)
+    # The window of a row is the 30 days before it, both ends included
+    expected = series.rolling('30D', closed='both').median()
+    np.testing.assert_array_equal(get_rolling_median(series), expected.to_numpy())
+
+
+def test_rolling_median_of_nan_windows():
+    series = make_series(4, 200, nan_ratio=0.95)
+    expected = series.rolling('30D', closed='both').median()
+    result = get_rolling_median(series)
+    assert np.isnan(result).any()
+    np.testing.assert_array_equal(result, expected.to_numpy())
+
+
+def test_median_window_keeps_trending_heaps_small():
+    window = MedianWindow()
+    for i in range(10000):
+        window.add(float(i))
+        if i >= 30:
+            window.remove(float(i - 30))
+        assert len(window.lower) + len(window.upper) <= 2 * len(window) + 16
+
+    assert len(window) == 30
+    assert window.median() == np.median(np.arange(10000 - 30, 10000))
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from etl.train_data import Reservoir, load_train_data
+
+PREDICTORS = [
+    {'Target_Name': 'Volume', 'Target_Features': ['future_volume', 'vol_moving_avg', 'adj_close_rolling_med']},
+]
+
+
+def add_in_batches(reservoir, rows, batch_size):
+    for i in range(0, len(rows), batch_size):
+        reservoir.add(rows[i:i + batch_size])
+
+
+def test_reservoir_keeps_all_rows_within_its_size():
+    rows = np.arange(20, dtype=np.float64).reshape(10, 2)
+    reservoir = Reservoir(16, random_state=0)
+    add_in_batches(reservoir, rows, 3)
+    np.testing.assert_array_equal(reservoir.get_rows(), rows)
+
+
+def test_reservoir_batches_sample_as_row_by_row():
+    rows = np.arange(1000, dtype=np.float64).reshape(-1, 1)
+    by_row, by_batch = Reservoir(50, random_state=7), Reservoir(50, random_state=7)
+    add_in_batches(by_row, rows, 1)
+    add_in_batches(by_batch, rows, 128)
+    np.testing.assert_array_equal(by_row.get_rows(), by_batch.get_rows())
+
+
+def test_reservoir_sample_is_uniform():
+    num_rows, size, runs = 100, 10, 2000
+    rows = np.arange(num_rows, dtype=np.float64).reshape(-1, 1)
+    counts = np.zeros(num_rows)
+    for seed in range(runs):
+        reservoir = Reservoir(size, random_state=seed)
+        add_in_batches(reservoir, rows, 32)
+        sample = reservoir.get_rows()[:, 0].astype(np.int64)
+        assert len(np.unique(sample)) == size
+        counts[sample] += 1
+
+    # Each row is sampled with the probability size / num_rows, 200 times of the 2000 runs
+    expected = runs * size / num_rows
+    assert np.abs(counts - expected).max() < 5 * np.sqrt(expected)
+
+
+def write_staging_data(data_path, num_rows=100):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'future_volume': rng.normal(1000, 10, num_rows),
+        'vol_moving_avg': rng.normal(1000, 10, num_rows),
+        'adj_close_rolling_med': rng.normal(50, 1, num_rows),
+        'market_trend': rng.normal(0, 1, num_rows),
+    })
+    df.loc[0, 'vol_moving_avg'] = np.nan
+    df.loc[1, 'adj_close_rolling_med'] = -1.0
+    # A row with a NaN only in a column which no predictor uses
+    df.loc[2, 'market_trend'] = np.nan
+    data_path.mkdir()
+    df.to_parquet(data_path / 'part-00000.parquet', index=False)
+    return df
+
+
+def test_load_train_data_drops_rows_with_nan_in_any_column(tmp_path):
+    df = write_staging_data(tmp_path / 'StageData')
+    train_data = load_train_data(str(tmp_path / 'StageData'), PREDICTORS)
+
+    assert train_data.num_rows == len(df) - 3 and not train_data.sampled
+    assert train_data.matrix.dtype == np.float32
+    np.testing.assert_array_equal(train_data.get_column('future_volume'), df['future_volume'].to_numpy()[3:])
+
+
+def test_load_train_data_samples_within_memory_budget(tmp_path):
+    write_staging_data(tmp_path / 'StageData')
+    # The budget of 40 rows of 3 float64 columns
+    train_data = load_train_data(str(tmp_path / 'StageData'), PREDICTORS, 40 * 24 / 1024 / 1024, random_state=0)
+
+    assert len(train_data) == 40 and train_data.num_rows == 97 and train_data.sampled
@@ -0,0 +1,69 @@
+import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from etl.layout import write_file_stats
+from etl.watermark import clear_watermarks, get_watermark_path, load_watermarks, save_watermarks
+
+
+def write_symbol_file(data_path, symbol, dates):
+    """A parquet file of the partition of one symbol, with its Date2 column"""
+    partition = data_path / f'Symbol={symbol}'
+    partition.mkdir(parents=True)
+    table = pa.table({'Date2': [datetime.date.fromisoformat(i) for i in dates], 'Volume': [1.0] * len(dates)})
+    pq.write_table(table, partition / 'part-00000.parquet')
+
+
+def test_save_and_load_watermarks(tmp_path):
+    data_path = str(tmp_path / 'IngestData')
+    save_watermarks(data_path, {'BBB': '2020-01-03', 'AAA': '2020-01-02'})
+    # The file is kept next to the output, so no output is read
+    assert load_watermarks(None, data_path) == {'AAA': '2020-01-02', 'BBB': '2020-01-03'}
+
+    clear_watermarks(data_path)
+    assert not (tmp_path / 'IngestData_Watermark.json').exists()
+    assert load_watermarks(None, data_path) == {}
+
+
+def test_watermarks_from_file_statistics(tmp_path):
+    data_path = tmp_path / 'IngestData'
+    write_symbol_file(data_path, 'AAA', ['2020-01-02', '2020-01-06', '2020-01-03'])
+    write_symbol_file(data_path, 'BBB', ['2019-12-31'])
+    write_file_stats(str(data_path))
+
+    assert load_watermarks(None, str(data_path)) == {'AAA': '2020-01-06', 'BBB': '2019-12-31'}
+    assert get_watermark_path(str(data_path)) == f'{data_path}_Watermark.json'
+
+
+@pytest.fixture(scope='module')
+def spark():
+    pytest.importorskip('pyspark')
+    from etl.spark.session import start_spark
+    try:
+        spark = start_spark('TestWatermark', {'spark.master': 'local[1]'})
+    except Exception as e:
+        pytest.skip(f'Spark cannot start: {e}')
+    yield spark
+    spark.stop()
+
+
+def test_filter_new_rows(spark):
+    from etl.step1_ingest_data import filter_new_rows
+
+    rows = [('AAA', datetime.date(2020, 1, i)) for i in range(1, 5)] + [('CCC', datetime.date(2020, 1, 1))]
+    df_daily = spark.createDataFrame(rows, ['Symbol', 'Date2'])
+    df_new = filter_new_rows(spark, df_daily, {'AAA': '2020-01-02', 'BBB': '2020-01-01'})
+
+    # The rows after the watermark of their symbol, and all the rows of a symbol without a watermark
+    assert sorted((i.Symbol, i.Date2.day) for i in df_new.collect()) == [('AAA', 3), ('AAA', 4), ('CCC', 1)]
+
+
+def test_derive_watermarks_from_output(spark, tmp_path):
+    data_path = tmp_path / 'IngestData'
+    write_symbol_file(data_path, 'AAA', ['2020-01-02', '2020-01-06'])
+    write_symbol_file(data_path, 'BBB', ['2019-12-31'])
+
+    # Without the file statistics, the watermarks are the latest Date2 of each symbol of the output
+    assert load_watermarks(spark, str(data_path)) == {'AAA': '2020-01-06', 'BBB': '2019-12-31'}